@@ -10,4 +10,11 @@ Sistema completo de Inteligencia Artificial que incluye:
 - Sistema de aprendizaje (learn.py)
 - Procesamiento de documentos (chunker.py)
 - Construcción de índices (build_index.py)
+- Tablas de cabida estructuradas (cabida.py)
+- Procedimientos desde flujogramas (flujogramas.py)
+- Respuestas curadas por tomo (respuestas.py)
+- Resoluciones indexadas por número y año (resoluciones.py)
+- Ingesta en streaming del reglamento de emergencia (emergencia.py)
+- Esquema SQLite y migraciones versionadas (schema.py)
+- Compactación de FAQs casi duplicadas (faqs.py)
 """
\ No newline at end of file
@@ -5,7 +5,7 @@ from .config import (
     AZURE_OPENAI_DEPLOYMENT_NAME
 )
 from .prompts import SYSTEM_RAG, USER_TEMPLATE
-from .retrieve import HybridRetriever
+from .retrieve import HybridRetriever, span
 
 class AnswerEngine:
     def __init__(self, retriever: HybridRetriever):
@@ -42,7 +42,8 @@ class AnswerEngine:
         return "\n\n".join(lines)
 
     def answer(self, query: str, k=6, conversation_history: List[Dict] = None) -> Dict:
-        ctx = self.retriever.hybrid(query, final_k=k)
+        with span('retrieval', k=k):
+            ctx = self.retriever.hybrid(query, final_k=k)
         context_text = self.format_context(ctx)
         user_msg = USER_TEMPLATE.format(query=query, context=context_text)
 
@@ -60,11 +61,12 @@ class AnswerEngine:
         # Añadir el mensaje actual del usuario
         messages.append({"role": "user", "content": user_msg})
 
-        resp = self.client.chat.completions.create(
-            model=AZURE_OPENAI_DEPLOYMENT_NAME,
-            messages=messages,
-            temperature=0.2
-        )
+        with span('llm', model=AZURE_OPENAI_DEPLOYMENT_NAME):
+            resp = self.client.chat.completions.create(
+                model=AZURE_OPENAI_DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=0.2
+            )
         text = resp.choices[0].message.content
 
         citations = []
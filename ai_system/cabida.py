@@ -0,0 +1,299 @@
+"""ai_system.cabida
+
+Consulta estructurada de las tablas de cabida (`TablaCabida_Tomo_N.txt`).
+
+- Ingesta: convierte las tablas markdown de cada tomo en filas tipadas
+  (tomo, distrito, cabida mínima y máxima normalizadas a m²) y las guarda
+  en la tabla `cabida_distritos` de la base de conocimiento.
+- Consulta: responde preguntas como "¿cuál es la cabida mínima en Distrito II?"
+  directamente desde esos valores, sin recuperar contexto ni llamar al LLM.
+
+Los valores se mantienen además en memoria por columnas (listas paralelas)
+para que cada consulta sea un recorrido de unas pocas decenas de filas.
+"""
+from typing import List, Dict, Optional, Tuple
+import argparse
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+from .db import get_conn
+from .config import DB_PATH, RESPUESTAS_DIR
+from .chunker import find_tomo_files
+
+logger = logging.getLogger(__name__)
+
+# Factores de conversión a m² (1 cuerda = 3,930.3956 m²)
+_UNIT_FACTORS = [
+    (re.compile(r"hect[áa]reas?|\bha\b", re.IGNORECASE), 10000.0),
+    (re.compile(r"cuerdas?", re.IGNORECASE), 3930.3956),
+    (re.compile(r"m²|m2|metros?\s+cuadrados?", re.IGNORECASE), 1.0),
+]
+_NUMBER_RE = re.compile(r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:[.,]\d+)?")
+_SEPARATOR_RE = re.compile(r"^\|?[\s:\-|]+\|?$")
+_CODE_RE = re.compile(r"\(([A-Z][A-Z0-9\-]{0,7})\)")
+_QUERY_DISTRICT_RE = re.compile(r"distrito\s+(?:de\s+calificaci[óo]n\s+)?([a-z0-9áéíóú\-]+)", re.IGNORECASE)
+_QUERY_CODE_RE = re.compile(r"\b([A-Z]{1,3}-[A-Z0-9]{1,3})\b")
+_QUERY_TOMO_RE = re.compile(r"tomo\s+(\d{1,2})\b", re.IGNORECASE)
+
+_columns = None
+_columns_lock = threading.RLock()
+
+
+def _strip_accents(text: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
+
+
+def _normalize_distrito(name: str) -> str:
+    norm = _strip_accents((name or '').lower())
+    norm = re.sub(r"\([^)]*\)", '', norm)
+    norm = re.sub(r"^distrito\s+", '', norm.strip())
+    return ' '.join(norm.split())
+
+
+def _parse_number(raw: str) -> float:
+    if re.fullmatch(r"\d{1,3}(?:,\d{3})+(?:\.\d+)?", raw):
+        return float(raw.replace(',', ''))
+    return float(raw.replace(',', '.'))
+
+
+def parse_area(cell: str, default_factor: Optional[float] = None) -> Optional[float]:
+    """Convertir una celda como '0.5 hectáreas', '200 m²' o '150' a m².
+
+    Retorna None para valores no numéricos ('Sin límite', 'No aplica', 'Variable').
+    """
+    m = _NUMBER_RE.search(cell or '')
+    if not m:
+        return None
+    factor = default_factor
+    for unit_re, unit_factor in _UNIT_FACTORS:
+        if unit_re.search(cell):
+            factor = unit_factor
+            break
+    if factor is None:
+        factor = 1.0
+    return _parse_number(m.group(0)) * factor
+
+
+def _split_row(line: str) -> List[str]:
+    return [c.strip() for c in line.strip().strip('|').split('|')]
+
+
+def _header_factor(header: str) -> Optional[float]:
+    for unit_re, unit_factor in _UNIT_FACTORS:
+        if unit_re.search(header):
+            return unit_factor
+    return None
+
+
+def parse_cabida_tables(text: str) -> List[Dict]:
+    """Extraer filas de todas las tablas markdown de cabida presentes en `text`.
+
+    Cada fila: {distrito, codigo, cabida_min_m2, cabida_max_m2, min_texto, max_texto}
+    """
+    rows = []
+    idx_min = idx_max = None
+    factor_min = factor_max = None
+    for line in (text or '').splitlines():
+        stripped = line.strip()
+        if not stripped.startswith('|'):
+            idx_min = idx_max = None
+            continue
+        if _SEPARATOR_RE.match(stripped):
+            continue
+        cells = _split_row(stripped)
+        lowered = [_strip_accents(c.lower()) for c in cells]
+        if any('cabida' in c for c in lowered):
+            # Fila de encabezado: ubicar columnas mínima/máxima y su unidad
+            idx_min = next((i for i, c in enumerate(lowered) if 'min' in c), None)
+            idx_max = next((i for i, c in enumerate(lowered) if 'max' in c), None)
+            factor_min = _header_factor(cells[idx_min]) if idx_min is not None else None
+            factor_max = _header_factor(cells[idx_max]) if idx_max is not None else None
+            continue
+        if idx_min is None or not cells or not cells[0]:
+            continue
+        min_texto = cells[idx_min] if idx_min < len(cells) else ''
+        max_texto = cells[idx_max] if idx_max is not None and idx_max < len(cells) else ''
+        code = _CODE_RE.search(cells[0])
+        rows.append({
+            'distrito': cells[0],
+            'codigo': code.group(1).lower() if code else None,
+            'cabida_min_m2': parse_area(min_texto, factor_min),
+            'cabida_max_m2': parse_area(max_texto, factor_max),
+            'min_texto': min_texto,
+            'max_texto': max_texto,
+        })
+    return rows
+
+
+def ensure_cabida_table(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS cabida_distritos(
+            tomo INTEGER NOT NULL,
+            distrito TEXT NOT NULL,
+            distrito_norm TEXT NOT NULL,
+            codigo TEXT,
+            cabida_min_m2 REAL,
+            cabida_max_m2 REAL,
+            min_texto TEXT,
+            max_texto TEXT,
+            fuente TEXT,
+            PRIMARY KEY (tomo, distrito_norm)
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_cabida_distrito ON cabida_distritos(distrito_norm)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_cabida_codigo ON cabida_distritos(codigo)")
+
+
+def ingest_cabida(data_dir: str = RESPUESTAS_DIR, db_path: str = DB_PATH) -> Dict:
+    """Parsear todos los `TablaCabida_Tomo_N*.txt` y reemplazar `cabida_distritos`.
+
+    Retorna un resumen: {'files': n, 'rows': m}
+    """
+    global _columns
+    records = []
+    files = find_tomo_files(data_dir, 'TablaCabida')
+    for tomo, path in files:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            parsed = parse_cabida_tables(f.read())
+        for r in parsed:
+            records.append((tomo, r['distrito'], _normalize_distrito(r['distrito']), r['codigo'],
+                            r['cabida_min_m2'], r['cabida_max_m2'], r['min_texto'], r['max_texto'],
+                            os.path.basename(path)))
+
+    with get_conn(db_path) as con:
+        ensure_cabida_table(con)
+        con.execute("DELETE FROM cabida_distritos")
+        # Tomos con versiones duplicadas (p. ej. TablaCabida_Tomo_10_nuevo.txt) colapsan por PK
+        con.executemany("INSERT OR REPLACE INTO cabida_distritos VALUES (?,?,?,?,?,?,?,?,?)", records)
+
+    with _columns_lock:
+        _columns = None
+    logger.info(f"✅ Tablas de cabida ingeridas: {len(records)} filas desde {len(files)} archivos")
+    return {'files': len(files), 'rows': len(records)}
+
+
+def _load_columns(db_path: str = DB_PATH) -> Dict[str, list]:
+    global _columns
+    if _columns is not None:
+        return _columns
+    with _columns_lock:
+        if _columns is not None:
+            return _columns
+        cols = {k: [] for k in ('tomo', 'distrito', 'distrito_norm', 'codigo',
+                                'cabida_min_m2', 'cabida_max_m2', 'min_texto', 'max_texto', 'fuente')}
+        try:
+            with get_conn(db_path) as con:
+                ensure_cabida_table(con)
+                count = con.execute("SELECT COUNT(*) FROM cabida_distritos").fetchone()[0]
+            if count == 0:
+                # Primera ejecución: construir la tabla desde los archivos del repositorio
+                ingest_cabida(db_path=db_path)
+            with get_conn(db_path) as con:
+                for row in con.execute("SELECT * FROM cabida_distritos ORDER BY tomo, distrito"):
+                    for k in cols:
+                        cols[k].append(row[k])
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron cargar las tablas de cabida: {e}")
+        _columns = cols
+        return _columns
+
+
+def preload(db_path: str = DB_PATH) -> int:
+    """Cargar las columnas en memoria (p. ej. en el maestro antes del fork); retorna las filas."""
+    return len(_load_columns(db_path)['tomo'])
+
+
+def es_consulta_cabida(mensaje: str) -> bool:
+    """Detectar preguntas numéricas sobre cabida por distrito."""
+    texto = _strip_accents((mensaje or '').lower())
+    return 'cabida' in texto and ('distrito' in texto or bool(_QUERY_CODE_RE.search(mensaje or '')))
+
+
+def _query_targets(mensaje: str) -> Tuple[List[str], Optional[int]]:
+    targets = []
+    for m in _QUERY_DISTRICT_RE.finditer(mensaje):
+        targets.append(_normalize_distrito(m.group(1).rstrip('?.,;')))
+    for m in _QUERY_CODE_RE.finditer(mensaje):
+        targets.append(m.group(1).lower())
+    tomo = _QUERY_TOMO_RE.search(mensaje)
+    return list(dict.fromkeys(targets)), (int(tomo.group(1)) if tomo else None)
+
+
+def lookup_cabida(mensaje: str) -> List[Dict]:
+    """Filas de cabida que corresponden a los distritos mencionados en la pregunta."""
+    targets, tomo = _query_targets(mensaje)
+    if not targets:
+        return []
+    cols = _load_columns()
+    out = []
+    for i, norm in enumerate(cols['distrito_norm']):
+        if norm not in targets and cols['codigo'][i] not in targets:
+            continue
+        if tomo is not None and cols['tomo'][i] != tomo:
+            continue
+        out.append({k: cols[k][i] for k in cols})
+    return out
+
+
+def _fmt_m2(value: Optional[float], texto: str) -> str:
+    if value is None:
+        return texto or 'no especificada'
+    num = f"{value:,.0f}" if float(value).is_integer() else f"{value:,.2f}"
+    shown = f"{num} m²"
+    # Conservar la unidad original cuando no era m² (p. ej. hectáreas)
+    if texto and _header_factor(texto) not in (None, 1.0):
+        shown += f" ({texto})"
+    return shown
+
+
+def responder_cabida(mensaje: str) -> Optional[Dict]:
+    """Responder una consulta de cabida desde la tabla estructurada.
+
+    Retorna un dict con el formato de resultado del pipeline de chat o None si
+    no hay filas que correspondan (el llamador continúa con el flujo normal).
+    """
+    rows = lookup_cabida(mensaje)
+    if not rows:
+        return None
+
+    texto = _strip_accents(mensaje.lower())
+    quiere_min = 'minim' in texto
+    quiere_max = 'maxim' in texto
+    if not quiere_min and not quiere_max:
+        quiere_min = quiere_max = True
+
+    lineas = []
+    for r in rows:
+        partes = []
+        if quiere_min:
+            partes.append(f"cabida mínima **{_fmt_m2(r['cabida_min_m2'], r['min_texto'])}**")
+        if quiere_max:
+            partes.append(f"cabida máxima **{_fmt_m2(r['cabida_max_m2'], r['max_texto'])}**")
+        lineas.append(f"• {r['distrito']} (TOMO {r['tomo']}): " + ", ".join(partes))
+
+    if len(rows) == 1:
+        encabezado = "Según la tabla de cabidas del Reglamento Conjunto 2023:"
+    else:
+        encabezado = f"Encontré {len(rows)} valores en las tablas de cabida del Reglamento Conjunto 2023:"
+    respuesta = encabezado + "\n\n" + "\n".join(lineas)
+    citas = list(dict.fromkeys(f"TOMO {r['tomo']}, Tabla de Cabida ({r['fuente']})" for r in rows))
+
+    return {
+        'respuesta': respuesta,
+        'sistema_usado': 'consulta_cabida',
+        'confianza': 1.0,
+        'citas': citas,
+        'contexto_chars': 0,
+        'metadata_adicional': {'filas': len(rows)}
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data_dir", default=RESPUESTAS_DIR)
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args()
+    print("Tablas de cabida:", ingest_cabida(args.data_dir, args.db))
@@ -1,4 +1,6 @@
 from typing import List, Dict, Tuple
+import glob
+import os
 import re
 
 def split_into_blocks(text: str, max_chars: int = 4000, overlap: int = 600) -> List[str]:
@@ -37,3 +39,14 @@ def guess_metadata_from_text(block: str) -> Dict:
     return {
         "heading_path": heading or ""
     }
+
+def find_tomo_files(base_dir: str, prefix: str) -> List[Tuple[int, str]]:
+    # Los archivos por tomo no tienen una ubicación uniforme: algunos están en
+    # RespuestasIA_TomoN/ y otros en subcarpetas (Tablas/, Flujogramas/, ...).
+    pattern = os.path.join(base_dir, "**", f"{prefix}_Tomo_*.txt")
+    out = []
+    for path in glob.glob(pattern, recursive=True):
+        m = re.search(r"_Tomo_(\d+)", os.path.basename(path))
+        if m:
+            out.append((int(m.group(1)), path))
+    return sorted(out)
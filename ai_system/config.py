@@ -18,6 +18,24 @@ AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT
 DB_PATH = os.getenv("DB_PATH", "database/hybrid_knowledge.db")
 FAISS_PATH = os.getenv("FAISS_PATH", "database/faiss_index.bin")
 
+# Respuestas curadas por tomo (tablas de cabida, flujogramas, resoluciones, respuestas)
+RESPUESTAS_DIR = os.getenv("RESPUESTAS_DIR", "data/RespuestasParaChatBot")
+# Confianza mínima para responder desde el nivel de respuestas curadas
+RESPUESTAS_MIN_CONFIANZA = float(os.getenv("RESPUESTAS_MIN_CONFIANZA", "0.75"))
+
 # Chunking
 CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "1000"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))
+
+# Facts aprendidos (knowledge_facts) en la recuperación híbrida
+FACTS_K = int(os.getenv("FACTS_K", "4"))
+FACT_WEIGHT = float(os.getenv("FACT_WEIGHT", "1.0"))
+# Multiplicador para facts type='correction' (correcciones de usuarios vía /learn)
+CORRECTION_BOOST = float(os.getenv("CORRECTION_BOOST", "2.0"))
+# Solo facts aprendidos: correcciones (/learn) y "aprender:" (faq/definicion). Las
+# respuestas pasadas del bot (type='conversation', 'auto') no entran al contexto
+FACT_TYPES = tuple(t.strip() for t in os.getenv("FACT_TYPES", "correction,faq,definicion").split(",") if t.strip())
+# Términos de la consulta que un fact debe contener (o todos, si la consulta tiene menos)
+FACT_MIN_TERMS = int(os.getenv("FACT_MIN_TERMS", "2"))
+# Máximo de facts que pueden desplazar chunks del reglamento en el contexto final
+FACT_MAX_SLOTS = int(os.getenv("FACT_MAX_SLOTS", "2"))
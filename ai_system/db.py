@@ -39,7 +39,8 @@ def fts_search(con, query: str, limit: int = 24):
     try:
         cur = con.execute("""SELECT rowid, chunk_text, doc_id, heading_path, page_start, page_end,
                                snippet(fts_chunks, 0, '«', '»', ' … ', 10) AS snip
-                            FROM fts_chunks WHERE fts_chunks MATCH ? LIMIT ?""", (query, limit))
+                            FROM fts_chunks WHERE fts_chunks MATCH ?
+                            ORDER BY bm25(fts_chunks) LIMIT ?""", (query, limit))
         results = []
         for row in cur.fetchall():
             # Convertir a formato esperado por el sistema
@@ -59,8 +60,13 @@ def fts_search(con, query: str, limit: int = 24):
         return []
 
 def insert_knowledge_fact(con, fact_id, content, citation, type_, tags=None):
-    con.execute("""INSERT OR REPLACE INTO knowledge_facts(id, content, citation, type, tags)
-                 VALUES(?,?,?,?,?)""", (fact_id, content, citation, type_, json.dumps(tags or {})))
+    # UPSERT (no INSERT OR REPLACE) para que los triggers de fts_facts vean el cambio
+    con.execute("""INSERT INTO knowledge_facts(id, content, citation, type, tags)
+                 VALUES(?,?,?,?,?)
+                 ON CONFLICT(id) DO UPDATE SET
+                   content=excluded.content, citation=excluded.citation,
+                   type=excluded.type, tags=excluded.tags""",
+                (fact_id, content, citation, type_, json.dumps(tags or {})))
 
 def upsert_faq(con, faq_id, query_normalized, answer, citations):
     con.execute("""INSERT INTO faqs(id, query_normalized, answer, citations, usage_count)
@@ -0,0 +1,187 @@
+"""ai_system.emergencia
+
+Ingesta en streaming del análisis del Reglamento de Emergencia JP-RP-41
+(`data/reglamento_emergencia_jp41_chatbot_*.json`).
+
+El archivo guarda todo el análisis en un único string `analisis_completo`
+(~580 KB) con marcadores `=== FRAGMENTO N - ANÁLISIS PARCIAL ===` y
+subsecciones `=== ... ===`. En lugar de cargar el JSON completo, el string se
+decodifica por bloques mientras se lee el archivo y se corta en fragmentos y
+secciones a medida que aparecen los marcadores. Cada pieza se indexa como los
+tomos (`chunks_meta` + `fts_chunks`) con su ruta de encabezados.
+"""
+from typing import Dict, Iterator
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+
+from .db import get_conn, upsert_chunk
+from .config import DB_PATH
+from .chunker import split_into_blocks
+
+logger = logging.getLogger(__name__)
+
+EMERGENCIA_GLOB = os.path.join("data", "reglamento_emergencia_jp41_chatbot_*.json")
+DOC_TITLE = "Reglamento de Emergencia JP-RP-41"
+
+_MARKER_RE = re.compile(r"^=*=== (.+?) ===[ \t]*$", re.MULTILINE)
+_FRAGMENT_RE = re.compile(r"FRAGMENTO\s+(\d+)", re.IGNORECASE)
+_HIGH_SURROGATE_RE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}")
+
+
+def _find_string_end(buf: str) -> int:
+    """Posición de la comilla que cierra el string JSON en `buf`, o -1."""
+    i = buf.find('"')
+    while i != -1:
+        j = i
+        while j > 0 and buf[j - 1] == '\\':
+            j -= 1
+        if (i - j) % 2 == 0:
+            return i
+        i = buf.find('"', i + 1)
+    return -1
+
+
+def _safe_cut(buf: str) -> int:
+    """Índice donde cortar `buf` sin partir una secuencia de escape (máx. 12 chars: `\\uXXXX\\uXXXX`)."""
+    p = buf.rfind('\\', max(0, len(buf) - 12))
+    if p == -1:
+        return len(buf)
+    while p > 0 and buf[p - 1] == '\\':
+        p -= 1
+    # No separar un par sustituto (\uD83D\uDE00): cortar antes de la mitad alta
+    if p >= 6 and _HIGH_SURROGATE_RE.match(buf, p - 6) and (p == 6 or buf[p - 7] != '\\'):
+        p -= 6
+    return p
+
+
+def iter_json_string(path: str, field: str, chunk_size: int = 16 * 1024) -> Iterator[str]:
+    """Decodificar por partes el valor string de `field` en un JSON, leyendo `chunk_size` a la vez."""
+    key_re = re.compile(re.escape(json.dumps(field)) + r'\s*:\s*"')
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buf += chunk
+            m = key_re.search(buf)
+            if m:
+                buf = buf[m.end():]
+                break
+            buf = buf[-(len(field) + 32):]
+
+        while True:
+            end = _find_string_end(buf)
+            if end != -1:
+                if end:
+                    yield json.loads('"' + buf[:end] + '"')
+                return
+            cut = _safe_cut(buf)
+            if cut:
+                yield json.loads('"' + buf[:cut] + '"')
+                buf = buf[cut:]
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError(f"String '{field}' sin cerrar en {path}")
+            buf += chunk
+
+
+def iter_sections(pieces: Iterator[str]) -> Iterator[Dict]:
+    """Cortar el texto en secciones a medida que llegan los marcadores `=== ... ===`.
+
+    Cada sección: {fragmento, seccion, heading_path, text}
+    """
+    buf = ''
+    fragmento = None
+    seccion = None
+
+    def emit(text):
+        text = text.strip()
+        if not text:
+            return None
+        partes = [DOC_TITLE]
+        if fragmento is not None:
+            partes.append(f"Fragmento {fragmento}")
+        if seccion:
+            partes.append(seccion.capitalize())
+        return {'fragmento': fragmento, 'seccion': seccion, 'heading_path': ' > '.join(partes), 'text': text}
+
+    for piece in pieces:
+        buf += piece
+        pos = 0
+        for m in _MARKER_RE.finditer(buf):
+            # Solo marcadores con su línea completa: el último puede estar cortado
+            if m.end() == len(buf):
+                break
+            out = emit(buf[pos:m.start()])
+            if out:
+                yield out
+            titulo = m.group(1).strip()
+            frag = _FRAGMENT_RE.search(titulo)
+            if frag:
+                fragmento = int(frag.group(1))
+                seccion = titulo.split('-', 1)[1].strip() if '-' in titulo else None
+            else:
+                seccion = titulo
+            pos = m.end()
+        buf = buf[pos:]
+    out = emit(buf)
+    if out:
+        yield out
+
+
+def ensure_chunk_tables(con):
+    # Mismo esquema que ai_system/schema.py
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS chunks_meta(
+            chunk_id TEXT PRIMARY KEY, doc_id TEXT, page_start INTEGER, page_end INTEGER,
+            heading_path TEXT, hash TEXT
+        )
+    """)
+    con.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS fts_chunks USING fts5(
+            chunk_text, chunk_id UNINDEXED, doc_id UNINDEXED, heading_path UNINDEXED,
+            page_start UNINDEXED, page_end UNINDEXED
+        )
+    """)
+
+
+def ingest_emergencia(path: str, db_path: str = DB_PATH, max_chars: int = 4000) -> Dict:
+    """Indexar el análisis del reglamento de emergencia por fragmento y sección.
+
+    Reemplaza los chunks previos del mismo documento. Retorna {'doc_id', 'chunks', 'fragments'}.
+    """
+    doc_id = os.path.basename(path)
+    chunks = 0
+    fragments = set()
+    with get_conn(db_path) as con:
+        ensure_chunk_tables(con)
+        con.execute("DELETE FROM fts_chunks WHERE doc_id = ?", (doc_id,))
+        con.execute("DELETE FROM chunks_meta WHERE doc_id = ?", (doc_id,))
+        for sec in iter_sections(iter_json_string(path, 'analisis_completo')):
+            fragments.add(sec['fragmento'])
+            slug = re.sub(r"[^a-z0-9]+", '-', (sec['seccion'] or 'intro').lower()).strip('-')
+            base_id = f"{doc_id}#f{sec['fragmento'] or 0}-{slug}"
+            blocks = split_into_blocks(sec['text'], max_chars=max_chars, overlap=300)
+            for i, block in enumerate(blocks):
+                chunk_id = base_id if len(blocks) == 1 else f"{base_id}-{i + 1}"
+                upsert_chunk(con, chunk_id, doc_id, None, None, sec['heading_path'],
+                             f"{sec['heading_path']}\n{block}")
+                chunks += 1
+    logger.info(f"✅ Reglamento de emergencia indexado: {chunks} chunks de {len(fragments)} fragmentos ({doc_id})")
+    return {'doc_id': doc_id, 'chunks': chunks, 'fragments': len(fragments)}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--path", default=None, help="JSON del reglamento (por defecto el más reciente en data/)")
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args()
+    path = args.path or (sorted(glob.glob(EMERGENCIA_GLOB)) or [None])[-1]
+    if not path:
+        ap.error("No se encontró data/reglamento_emergencia_jp41_chatbot_*.json")
+    print("Reglamento de emergencia:", ingest_emergencia(path, args.db))
@@ -0,0 +1,207 @@
+"""ai_system.faqs
+
+Compactación de la tabla `faqs`.
+
+`faqs` solo deduplica por `query_normalized` exacto, así que "¿qué es un
+permiso verde?" y "que es el permiso verde" quedan como filas distintas. Este
+job agrupa preguntas casi iguales con MinHash + LSH y fusiona cada grupo en
+una sola fila: suma los usos, conserva la mejor respuesta (la más usada; a
+igualdad, la más reciente) y une las citas. Después, si la tabla supera
+`max_entries`, elimina las entradas frías por menor uso (LFU).
+
+Uso:
+    python -m ai_system.faqs --dry-run
+    python -m ai_system.faqs --threshold 0.7 --max-entries 5000
+"""
+from typing import Dict, List, Optional
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+
+from .config import DB_PATH
+from .schema import get_capabilities
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 64
+BANDS = 16                      # 16 bandas x 4 filas: candidatos desde Jaccard ~0.5
+SHINGLE = 4                     # n-gramas de caracteres
+DEFAULT_THRESHOLD = float(os.getenv('FAQ_DEDUP_THRESHOLD', '0.7'))
+DEFAULT_MAX_ENTRIES = int(os.getenv('FAQ_MAX_ENTRIES', '5000'))
+
+_MERSENNE = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(20250101)
+_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+_NON_WORD_RE = re.compile(r"[^a-z0-9 ]+")
+# Palabras funcionales: "qué es un permiso" y "que es el permiso" son la misma pregunta
+_STOPWORDS = frozenset(
+    'a al como con cual cuales cuando cuanto cuantos de del donde el en es esta este hay la las '
+    'lo los me mi para por que se si sobre su sus un una unos unas y favor puede pueden'.split()
+)
+# Una negación cambia la respuesta legal y casi no cambia los 4-gramas
+_NEGATIONS = frozenset('no ni sin nunca jamas tampoco ningun ninguna ninguno nada nadie'.split())
+
+
+def _canon(text: str) -> str:
+    """Minúsculas, sin acentos ni puntuación y sin palabras funcionales."""
+    text = ''.join(c for c in unicodedata.normalize('NFD', (text or '').lower())
+                   if unicodedata.category(c) != 'Mn')
+    return ' '.join(w for w in _NON_WORD_RE.sub(' ', text).split() if w not in _STOPWORDS)
+
+
+def _numbers(text: str) -> str:
+    """Números de la pregunta (distrito R-1 vs R-3, Tomo 6 vs 7): deben coincidir para fusionar."""
+    # En orden: "R-12 zona 3" y "R-3 zona 12" no son la misma pregunta
+    return ' '.join(w for w in _canon(text).split() if any(c.isdigit() for c in w))
+
+
+def _negations(text: str) -> str:
+    """Negaciones de la pregunta ("se requiere" vs "no se requiere"): deben coincidir para fusionar."""
+    return ' '.join(sorted(set(_canon(text).split()) & _NEGATIONS))
+
+
+def _shingles(text: str) -> np.ndarray:
+    t = _canon(text)
+    if len(t) <= SHINGLE:
+        grams = {t} if t else set()
+    else:
+        grams = {t[i:i + SHINGLE] for i in range(len(t) - SHINGLE + 1)}
+    return np.fromiter((zlib.crc32(g.encode('utf-8')) & 0x7FFFFFFF for g in grams), dtype=np.uint64)
+
+
+def minhash(text: str) -> np.ndarray:
+    """Firma MinHash (NUM_PERM valores) de los 4-gramas de `text`."""
+    x = _shingles(text)
+    if x.size == 0:
+        return np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    # (a*x + b) mod p con p = 2^31-1: a, x < 2^31, así que no hay desborde en uint64
+    return ((np.outer(_A, x) + _B[:, None]) % _MERSENNE).min(axis=1)
+
+
+def estimated_jaccard(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    return float(np.count_nonzero(sig_a == sig_b)) / NUM_PERM
+
+
+def cluster_near_duplicates(texts: List[str], threshold: float = DEFAULT_THRESHOLD) -> List[List[int]]:
+    """Índices de `texts` agrupados por similitud (solo grupos de 2 o más).
+
+    Las preguntas solo se comparan con otras que mencionan los mismos números
+    y las mismas negaciones.
+    """
+    sigs = [minhash(t) for t in texts]
+    guards = [f"{_numbers(t)}|{_negations(t)}".encode('utf-8') for t in texts]
+    rows = NUM_PERM // BANDS
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(BANDS):
+        buckets: Dict[bytes, List[int]] = {}
+        for i, sig in enumerate(sigs):
+            key = guards[i] + b'|' + sig[band * rows:(band + 1) * rows].tobytes()
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            first = members[0]
+            for other in members[1:]:
+                ra, rb = find(first), find(other)
+                if ra != rb and estimated_jaccard(sigs[first], sigs[other]) >= threshold:
+                    parent[rb] = ra
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(texts)):
+        groups.setdefault(find(i), []).append(i)
+    return [g for g in groups.values() if len(g) > 1]
+
+
+def _merge_citations(values: List[Optional[str]]) -> str:
+    merged = []
+    for v in values:
+        try:
+            items = json.loads(v) if v else []
+        except (TypeError, ValueError):
+            items = [v]
+        for it in items if isinstance(items, list) else [items]:
+            if it not in merged:
+                merged.append(it)
+    return json.dumps(merged, ensure_ascii=False)
+
+
+def compact_faqs(db_path: str = DB_PATH, threshold: float = DEFAULT_THRESHOLD,
+                 max_entries: Optional[int] = DEFAULT_MAX_ENTRIES, dry_run: bool = False) -> Dict:
+    """Fusionar FAQs casi duplicadas y recortar las menos usadas.
+
+    Retorna {'before', 'clusters', 'merged', 'evicted', 'after', 'elapsed_seconds'}.
+    """
+    started = time.perf_counter()
+    get_capabilities(db_path)
+    con = sqlite3.connect(db_path)
+    try:
+        rows = con.execute("SELECT id, query_normalized, answer, citations, COALESCE(usage_count, 0), "
+                           "COALESCE(updated_at, '') FROM faqs").fetchall()
+        clusters = cluster_near_duplicates([r[1] or '' for r in rows], threshold)
+
+        updates, deletes = [], []
+        for members in clusters:
+            group = [rows[i] for i in members]
+            # Mejor respuesta: la más usada; a igualdad, la más reciente
+            best = max(group, key=lambda r: (r[4], r[5]))
+            # usage_count cuenta repeticiones tras la primera: total de consultas - 1
+            usage = sum(r[4] + 1 for r in group) - 1
+            updates.append((usage, _merge_citations([r[3] for r in group]), best[0]))
+            deletes.extend((r[0],) for r in group if r[0] != best[0])
+
+        remaining = len(rows) - len(deletes)
+        evict = max(0, remaining - max_entries) if max_entries else 0
+        summary = {'before': len(rows), 'clusters': len(clusters), 'merged': len(deletes), 'evicted': evict}
+
+        if not dry_run:
+            with con:
+                con.executemany("UPDATE faqs SET usage_count = ?, citations = ?, updated_at = CURRENT_TIMESTAMP "
+                                "WHERE id = ?", updates)
+                con.executemany("DELETE FROM faqs WHERE id = ?", deletes)
+                if evict:
+                    # Entradas frías: menor uso primero, y entre ellas las más antiguas
+                    con.execute("""DELETE FROM faqs WHERE id IN (
+                                       SELECT id FROM faqs ORDER BY usage_count ASC, updated_at ASC LIMIT ?)""",
+                                (evict,))
+        summary['after'] = remaining - evict
+    finally:
+        con.close()
+    summary['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    logger.info(f"🧹 FAQs: {summary['before']} → {summary['after']} ({summary['clusters']} grupos, "
+                f"{summary['merged']} fusionadas, {summary['evicted']} frías eliminadas)"
+                f"{' [simulación]' if dry_run else ''}")
+    return summary
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fusionar FAQs casi duplicadas y recortar las menos usadas")
+    ap.add_argument('--db', default=DB_PATH)
+    ap.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                    help="Jaccard mínimo (sobre 4-gramas) para fusionar")
+    ap.add_argument('--max-entries', type=int, default=DEFAULT_MAX_ENTRIES,
+                    help="Tamaño máximo de la tabla tras fusionar (0 = sin límite)")
+    ap.add_argument('--dry-run', action='store_true', help="Solo reportar, sin modificar la base")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    print(json.dumps(compact_faqs(args.db, args.threshold, args.max_entries or None, args.dry_run),
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
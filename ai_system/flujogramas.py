@@ -0,0 +1,299 @@
+"""ai_system.flujogramas
+
+Grafos de procedimiento precalculados a partir de los archivos `flujograma*_Tomo_N.txt`.
+
+- Ingesta: cada flujograma (cambios de calificación, sitios históricos, terrenos
+  públicos) se convierte en una lista de pasos {n, titulo, detalle, subpasos,
+  actor, siguiente, ramas} y se guarda como JSON compacto en la tabla
+  `procedimientos` de la base de conocimiento.
+- Consulta: preguntas del tipo "¿cuáles son los pasos para...?" se responden
+  desde esa estructura, sin recuperar contexto ni llamar al LLM.
+"""
+from typing import List, Dict, Optional
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+from .db import get_conn
+from .config import DB_PATH, RESPUESTAS_DIR
+from .chunker import find_tomo_files
+
+logger = logging.getLogger(__name__)
+
+# prefijo de archivo -> (tipo, nombre legible, palabras clave normalizadas)
+PROCEDIMIENTOS = {
+    'flujogramaCambiosCalificacion': ('cambios_calificacion', 'Cambios de calificación directo',
+                                      # "distrito de calificación" aparece en todo el corpus: solo el cambio
+                                      ('cambio de calificacion', 'cambios de calificacion',
+                                       'cambiar la calificacion', 'recalificacion', 'rezonificacion')),
+    'flujogramaSitiosHistoricos': ('sitios_historicos', 'Evaluación de Sitios Históricos',
+                                   # "zona histórica" no es una evaluación de sitio histórico
+                                   ('sitio historico', 'sitios historicos')),
+    'flujogramaTerrPublicos': ('terrenos_publicos', 'Transacciones de terrenos públicos',
+                               ('terrenos publicos', 'terreno publico', 'terrenos del estado')),
+}
+
+# Actores que aparecen en los flujogramas, en el orden en que se prefieren
+_ACTORES = [
+    # "JP-RP-41" es un reglamento, no la Junta
+    (re.compile(r"junta\s+de\s+planificaci[óo]n|\bJP\b(?!-)", re.IGNORECASE), 'Junta de Planificación'),
+    (re.compile(r"oficina\s+de\s+gerencia\s+de\s+permisos|\bOGPe\b", re.IGNORECASE), 'OGPe'),
+    (re.compile(r"municipios?\s+aut[óo]nomos?", re.IGNORECASE), 'Municipio Autónomo'),
+    (re.compile(r"instituto\s+de\s+cultura\s+puertorrique[ñn]a", re.IGNORECASE), 'Instituto de Cultura Puertorriqueña'),
+    (re.compile(r"entidades?\s+gubernamentales?\s+concernidas?", re.IGNORECASE), 'Entidades Gubernamentales Concernidas'),
+    (re.compile(r"comit[ée]", re.IGNORECASE), 'Comité especializado'),
+    (re.compile(r"profesionales?\s+autorizados?", re.IGNORECASE), 'Profesional Autorizado'),
+    # "notificar al solicitante" no convierte al solicitante en actor del paso; el
+    # promotor del proyecto es quien solicita
+    (re.compile(r"(?<!\bal )(?<!\ba los )\b(?:solicitantes?|promotor(?:es)?)\b", re.IGNORECASE), 'Solicitante'),
+]
+
+_STEP_RE = re.compile(r"^\s{0,3}(?:#{1,6}\s*)?(\d{1,2})\.\s+(.+)$")
+_BOLD_TITLE_RE = re.compile(r"^\*\*(.+?)\*\*\s*:?\s*(.*)$")
+_BULLET_RE = re.compile(r"^\s*(?:[-*•]|[a-z]\.)\s+(.+)$")
+_BRANCH_RE = re.compile(r"^\**\s*(S[íi]|No)\b\s*(?::\s*\**|\**\s*:)\s*(.+)$", re.IGNORECASE)
+_GOTO_RE = re.compile(r"paso\s+(\d{1,2})", re.IGNORECASE)
+_QUERY_TOMO_RE = re.compile(r"tomo\s+(\d{1,2})\b", re.IGNORECASE)
+_QUERY_INTENT = ('pasos', 'procedimiento', 'tramite', 'flujograma', 'proceso', 'como solicit', 'requisitos para')
+
+_cache = None
+_cache_lock = threading.RLock()
+
+
+def _strip_accents(text: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
+
+
+def _clean(text: str) -> str:
+    return ' '.join(text.replace('**', '').split()).strip(' :')
+
+
+def _detect_actor(text: str) -> Optional[str]:
+    best = None
+    for actor_re, actor in _ACTORES:
+        m = actor_re.search(text)
+        if m and (best is None or m.start() < best[0]):
+            best = (m.start(), actor)
+    return best[1] if best else None
+
+
+def _branch_target(accion: str, n: int) -> Optional[int]:
+    m = _GOTO_RE.search(accion)
+    if m:
+        return int(m.group(1))
+    if 'siguiente paso' in _strip_accents(accion.lower()):
+        return n + 1
+    return None
+
+
+def parse_flujograma(text: str) -> List[Dict]:
+    """Convertir un flujograma en texto libre en una lista de pasos enlazados.
+
+    Algunos archivos repiten la numeración (un borrador seguido del flujograma
+    final); se conserva la secuencia con más pasos, y ante empate la última.
+    """
+    sequences = []
+    current = None
+    for line in (text or '').splitlines():
+        if not line.strip():
+            continue
+        m = _STEP_RE.match(line)
+        if m:
+            n = int(m.group(1))
+            if n == 1 or not sequences or (sequences[-1] and n <= sequences[-1][-1]['n']):
+                sequences.append([])
+            body = m.group(2).strip()
+            bold = _BOLD_TITLE_RE.match(body)
+            titulo, detalle = (bold.group(1), bold.group(2)) if bold else (body, '')
+            current = {'n': n, 'titulo': _clean(titulo), 'detalle': _clean(detalle),
+                       'subpasos': [], 'ramas': []}
+            sequences[-1].append(current)
+            continue
+        if current is None:
+            continue
+        if line.lstrip().startswith('#') or not line[:1].isspace() and not _BULLET_RE.match(line):
+            # Encabezado o párrafo de cierre: termina el paso en curso
+            current = None
+            continue
+        bullet = _BULLET_RE.match(line)
+        content = bullet.group(1) if bullet else line.strip()
+        branch = _BRANCH_RE.match(content)
+        if branch:
+            accion = _clean(branch.group(2))
+            current['ramas'].append({'condicion': 'Sí' if branch.group(1).lower() != 'no' else 'No',
+                                     'accion': accion,
+                                     'destino': _branch_target(accion, current['n'])})
+        else:
+            current['subpasos'].append(_clean(content))
+
+    if not sequences:
+        return []
+    steps = max(reversed(sequences), key=len)
+    numbers = [s['n'] for s in steps]
+    for i, step in enumerate(steps):
+        step['siguiente'] = numbers[i + 1] if i + 1 < len(numbers) else None
+        texto = ' '.join([step['titulo'], step['detalle']] + step['subpasos'])
+        step['actor'] = _detect_actor(texto)
+    return steps
+
+
+def ensure_procedimientos_table(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS procedimientos(
+            tomo INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            titulo TEXT,
+            pasos TEXT NOT NULL,
+            n_pasos INTEGER,
+            fuente TEXT,
+            PRIMARY KEY (tipo, tomo)
+        )
+    """)
+
+
+def ingest_flujogramas(data_dir: str = RESPUESTAS_DIR, db_path: str = DB_PATH) -> Dict:
+    """Parsear todos los flujogramas y reemplazar la tabla `procedimientos`.
+
+    Retorna un resumen: {'files': n, 'procedures': m, 'steps': k}
+    """
+    global _cache
+    records = []
+    total_files = 0
+    for prefix, (tipo, nombre, _kw) in PROCEDIMIENTOS.items():
+        for tomo, path in find_tomo_files(data_dir, prefix):
+            total_files += 1
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                pasos = parse_flujograma(f.read())
+            if not pasos:
+                # p. ej. archivos que solo enlazan una imagen del flujograma
+                logger.info(f"ℹ️ Flujograma sin pasos en texto: {os.path.basename(path)}")
+                continue
+            records.append((tomo, tipo, nombre,
+                            json.dumps(pasos, ensure_ascii=False, separators=(',', ':')),
+                            len(pasos), os.path.basename(path)))
+
+    with get_conn(db_path) as con:
+        ensure_procedimientos_table(con)
+        con.execute("DELETE FROM procedimientos")
+        con.executemany("INSERT OR REPLACE INTO procedimientos VALUES (?,?,?,?,?,?)", records)
+
+    with _cache_lock:
+        _cache = None
+    steps = sum(r[4] for r in records)
+    logger.info(f"✅ Flujogramas ingeridos: {len(records)} procedimientos, {steps} pasos desde {total_files} archivos")
+    return {'files': total_files, 'procedures': len(records), 'steps': steps}
+
+
+def _load_cache(db_path: str = DB_PATH) -> Dict[str, List[Dict]]:
+    global _cache
+    if _cache is not None:
+        return _cache
+    with _cache_lock:
+        if _cache is not None:
+            return _cache
+        cache = {}
+        try:
+            with get_conn(db_path) as con:
+                ensure_procedimientos_table(con)
+                count = con.execute("SELECT COUNT(*) FROM procedimientos").fetchone()[0]
+            if count == 0:
+                ingest_flujogramas(db_path=db_path)
+            with get_conn(db_path) as con:
+                for row in con.execute("SELECT * FROM procedimientos ORDER BY tipo, tomo"):
+                    cache.setdefault(row['tipo'], []).append({
+                        'tomo': row['tomo'], 'titulo': row['titulo'],
+                        'pasos': json.loads(row['pasos']), 'fuente': row['fuente'],
+                    })
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron cargar los flujogramas: {e}")
+        _cache = cache
+        return _cache
+
+
+def preload(db_path: str = DB_PATH) -> int:
+    """Cargar la caché en memoria (p. ej. en el maestro antes del fork); retorna los procedimientos."""
+    return sum(len(v) for v in _load_cache(db_path).values())
+
+
+def _detect_tipo(texto: str) -> Optional[str]:
+    for tipo, _nombre, keywords in PROCEDIMIENTOS.values():
+        if any(k in texto for k in keywords):
+            return tipo
+    return None
+
+
+def es_consulta_procedimiento(mensaje: str) -> bool:
+    """Detectar preguntas sobre los pasos de un procedimiento con flujograma."""
+    texto = _strip_accents((mensaje or '').lower())
+    return any(k in texto for k in _QUERY_INTENT) and _detect_tipo(texto) is not None
+
+
+def _richness(proc: Dict) -> int:
+    return sum(1 + len(p['subpasos']) + len(p['ramas']) for p in proc['pasos'])
+
+
+def lookup_procedimiento(mensaje: str) -> Optional[Dict]:
+    """Procedimiento que corresponde a la pregunta (del tomo indicado o el más detallado)."""
+    texto = _strip_accents((mensaje or '').lower())
+    tipo = _detect_tipo(texto)
+    if tipo is None:
+        return None
+    candidatos = _load_cache().get(tipo) or []
+    if not candidatos:
+        return None
+    tomo = _QUERY_TOMO_RE.search(mensaje)
+    if tomo:
+        elegidos = [p for p in candidatos if p['tomo'] == int(tomo.group(1))]
+        if elegidos:
+            return elegidos[0]
+    return max(candidatos, key=_richness)
+
+
+def formatear_procedimiento(proc: Dict) -> str:
+    lineas = [f"**{proc['titulo']}** (TOMO {proc['tomo']}, flujograma):", ""]
+    for paso in proc['pasos']:
+        encabezado = f"{paso['n']}. **{paso['titulo']}**"
+        if paso['actor']:
+            encabezado += f" — _{paso['actor']}_"
+        lineas.append(encabezado)
+        if paso['detalle']:
+            lineas.append(f"   {paso['detalle']}")
+        for sub in paso['subpasos']:
+            lineas.append(f"   • {sub}")
+        for rama in paso['ramas']:
+            destino = ''
+            if rama['destino'] and not _GOTO_RE.search(rama['accion']):
+                destino = f" (→ paso {rama['destino']})"
+            lineas.append(f"   ↳ {rama['condicion']}: {rama['accion']}{destino}")
+    return "\n".join(lineas)
+
+
+def responder_procedimiento(mensaje: str) -> Optional[Dict]:
+    """Responder una consulta de pasos desde el grafo precalculado.
+
+    Retorna un dict con el formato de resultado del pipeline de chat o None si
+    no hay un flujograma aplicable (el llamador continúa con el flujo normal).
+    """
+    proc = lookup_procedimiento(mensaje)
+    if not proc:
+        return None
+    return {
+        'respuesta': formatear_procedimiento(proc),
+        'sistema_usado': 'consulta_procedimiento',
+        'confianza': 0.95,
+        'citas': [f"TOMO {proc['tomo']}, Flujograma ({proc['fuente']})"],
+        'contexto_chars': 0,
+        'metadata_adicional': {'pasos': len(proc['pasos'])}
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data_dir", default=RESPUESTAS_DIR)
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args()
+    print("Flujogramas:", ingest_flujogramas(args.data_dir, args.db))
@@ -12,13 +12,17 @@ Diseño: mantenerlo pequeño y robusto. Si la base de datos no está disponible,
 las funciones fallan silenciosamente y registran el error (no interrumpen el flujo).
 """
 from typing import List, Dict, Optional
+from pathlib import Path
+import hashlib
 import uuid
 import json
 import logging
 import os
+import time
 
 from .db import get_conn, insert_knowledge_fact, upsert_faq
 from .config import DB_PATH
+from .schema import get_capabilities
 
 logger = logging.getLogger(__name__)
 
@@ -55,15 +59,11 @@ def save_learning(conversation_id: str, user_query: str, assistant_response: str
         max_content = 4000
         content = (assistant_response or '')[:max_content]
 
+        # Columnas de knowledge_facts desde la caché del esquema (sin PRAGMA por llamada)
+        cols = get_capabilities(DB_PATH).columns('knowledge_facts')
+
         # Insertar en DB usando el context manager; soportar múltiples esquemas
         with get_conn(DB_PATH) as con:
-            try:
-                # Detectar columnas de la tabla knowledge_facts
-                cur = con.execute("PRAGMA table_info(knowledge_facts)")
-                cols = [r[1] for r in cur.fetchall()]
-            except Exception:
-                cols = []
-
             try:
                 if 'content' in cols and 'tags' in cols:
                     # Usar helper que asume columnas content, tags
@@ -94,7 +94,9 @@ def save_learning(conversation_id: str, user_query: str, assistant_response: str
                     # Intentar una inserción genérica (columna content)
                     try:
                         con.execute(
-                            "INSERT OR REPLACE INTO knowledge_facts(id, content, citation, type, tags) VALUES (?, ?, ?, ?, ?)",
+                            "INSERT INTO knowledge_facts(id, content, citation, type, tags) VALUES (?, ?, ?, ?, ?) "
+                            "ON CONFLICT(id) DO UPDATE SET content=excluded.content, citation=excluded.citation, "
+                            "type=excluded.type, tags=excluded.tags",
                             (fact_id, content, citation, fact_type, json.dumps(tags))
                         )
                     except Exception as e:
@@ -126,11 +128,8 @@ def list_recent_learnings(limit: int = 20) -> List[Dict]:
     Cada item: {id, content, citation, type, tags, created_at}
     """
     try:
+        cols = get_capabilities(DB_PATH).columns('knowledge_facts')
         with get_conn(DB_PATH) as con:
-            # Detectar columnas
-            cur = con.execute("PRAGMA table_info(knowledge_facts)")
-            cols = [r[1] for r in cur.fetchall()]
-
             out = []
             if 'content' in cols:
                 sel = con.execute("SELECT id, content AS content, citation, type, tags, created_at FROM knowledge_facts ORDER BY created_at DESC LIMIT ?", (limit,))
@@ -144,7 +143,7 @@ def list_recent_learnings(limit: int = 20) -> List[Dict]:
                         'id': r['id'],
                         'content': r['content'],
                         'citation': r['citation'],
-                        'type': r.get('type'),
+                        'type': r['type'],
                         'tags': tags,
                         'created_at': r['created_at']
                     })
@@ -188,132 +187,149 @@ def summarize_learnings(limit: int = 10) -> str:
     return "\n".join(parts)
 
 
-def ingest_conversations(source_db_path: Optional[str] = None, limit: Optional[int] = None) -> Dict:
-    """Ingesta segura desde la base `database/conversaciones.db` hacia la base de conocimiento.
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '500'))
+_MAX_CONTENT = 4000
+
+_INSERT_FACT_SQL = """INSERT OR IGNORE INTO knowledge_facts(id, content, citation, type, tags)
+                      VALUES(?,?,?,?,?)"""
+_UPSERT_FAQ_SQL = """INSERT INTO faqs(id, query_normalized, answer, citations, usage_count)
+                     VALUES(?,?,?,?,0)
+                     ON CONFLICT(query_normalized) DO UPDATE SET
+                       answer=excluded.answer,
+                       citations=excluded.citations,
+                       usage_count=faqs.usage_count+1,
+                       updated_at=CURRENT_TIMESTAMP"""
+_TRACK_SQL = """INSERT OR IGNORE INTO processed_conversations(source, source_rowid, processed_at, content_hash)
+                VALUES (?, ?, ?, ?)"""
+
+
+def _content_hash(pregunta: str, respuesta: str) -> str:
+    text = _normalize_query(pregunta) + '\x1f' + ' '.join((respuesta or '').split())
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _resolve_source_path(source_db_path: Optional[str]) -> Path:
+    # Preferir source_db_path -> CONVERSACIONES_DB/DATABASE_URL -> default 'database/conversaciones.db'
+    env_src = source_db_path or (os.getenv('CONVERSACIONES_DB') or os.getenv('DATABASE_URL'))
+    if not env_src:
+        return Path('database') / 'conversaciones.db'
+    if env_src.startswith('sqlite:///'):
+        env_src = env_src.replace('sqlite:///', '', 1)
+    elif env_src.startswith('sqlite://'):
+        env_src = env_src.replace('sqlite://', '', 1)
+    return Path(env_src)
+
+
+def ingest_conversations(source_db_path: Optional[str] = None, limit: Optional[int] = None,
+                         batch_size: int = INGEST_BATCH_SIZE) -> Dict:
+    """Ingesta por lotes desde `conversaciones` hacia la base de conocimiento.
 
-    - source_db_path: ruta del archivo SQLite de conversaciones (por defecto 'database/conversaciones.db')
+    - source_db_path: ruta del archivo SQLite de conversaciones (por defecto CONVERSACIONES_DB
+      o 'database/conversaciones.db')
     - limit: máximo número de filas a procesar en una ejecución (None = ilimitado)
+    - batch_size: filas leídas por página (paginación por rowid) y escritas por transacción
 
-    Retorna un resumen: {'processed': n, 'errors': m, 'last_processed_source_id': id}
+    Cada lote escribe facts, FAQs y filas de seguimiento con `executemany` en
+    una sola transacción. Las filas cuyo contenido (pregunta normalizada +
+    respuesta) ya se ingirió se marcan como procesadas sin duplicar el fact.
+
+    Retorna un resumen: {'processed', 'duplicates', 'skipped', 'errors',
+    'last_processed_source_id', 'batches', 'elapsed_seconds', 'rows_per_second'}
     """
     import sqlite3
-    from pathlib import Path
     from datetime import datetime
 
+    started = time.perf_counter()
+    summary = {'processed': 0, 'duplicates': 0, 'skipped': 0, 'errors': 0, 'batches': 0}
     try:
-        # Determinar ruta de origen: preferir source_db_path -> CONVERSACIONES_DB/DATABASE_URL -> default 'database/conversaciones.db'
-        env_src = source_db_path or (os.getenv('CONVERSACIONES_DB') or os.getenv('DATABASE_URL'))
-        if env_src:
-            if isinstance(env_src, str) and env_src.startswith('sqlite'):
-                if env_src.startswith('sqlite:///'):
-                    env_src = env_src.replace('sqlite:///', '', 1)
-                elif env_src.startswith('sqlite://'):
-                    env_src = env_src.replace('sqlite://', '', 1)
-            source = Path(env_src)
-        else:
-            source = Path('database') / 'conversaciones.db'
-
+        source = _resolve_source_path(source_db_path)
         if not source.exists():
-            return {'processed': 0, 'errors': 1, 'message': f'Source DB not found: {source}'}
+            return {**summary, 'errors': 1, 'message': f'Source DB not found: {source}'}
+
+        # Ambas bases quedan en el esquema canónico (processed_conversations con content_hash)
+        get_capabilities(str(source))
+        get_capabilities(DB_PATH)
 
-        # Conectar DB de origen y target
         src_conn = sqlite3.connect(str(source))
-        src_conn.row_factory = sqlite3.Row
-        src_cur = src_conn.cursor()
-
-        # Target (hybrid knowledge DB)
-        tgt_path = Path(DB_PATH)
-        tgt_conn = sqlite3.connect(str(tgt_path))
-        tgt_conn.row_factory = sqlite3.Row
-        tgt_cur = tgt_conn.cursor()
-
-        # Crear tabla de tracking si no existe
-        tgt_cur.execute("""
-            CREATE TABLE IF NOT EXISTS processed_conversations (
-                source TEXT,
-                source_rowid INTEGER,
-                processed_at DATETIME,
-                UNIQUE(source, source_rowid)
-            )
-        """)
-        tgt_conn.commit()
-
-        # Obtener último source_rowid procesado
-        tgt_cur.execute("SELECT MAX(source_rowid) as maxid FROM processed_conversations WHERE source = ?", (str(source),))
-        row = tgt_cur.fetchone()
-        last_processed = int(row['maxid']) if row and row['maxid'] is not None else 0
-
-        # Determinar columna PK en la tabla conversaciones
+        tgt_conn = sqlite3.connect(DB_PATH)
         try:
-            src_cur.execute("PRAGMA table_info(conversaciones)")
-            cols_info = src_cur.fetchall()
-            pk_cols = [c['name'] for c in cols_info if c[5] == 1]  # c[5] es pk flag
-        except Exception:
-            pk_cols = []
-
-        # Elegir selector SQL según PK detectada
-        if pk_cols:
-            pk = pk_cols[0]
-            q = f"SELECT * FROM conversaciones WHERE {pk} > ? ORDER BY {pk} ASC"
-            params = (last_processed,)
-        else:
-            # fallback a rowid
-            pk = 'rowid'
-            q = f"SELECT rowid as rowid, * FROM conversaciones WHERE rowid > ? ORDER BY rowid ASC"
-            params = (last_processed,)
-
-        if limit and isinstance(limit, int):
-            q = q + f" LIMIT {limit}"
-
-        src_cur.execute(q, params)
-        rows = src_cur.fetchall()
-
-        processed = 0
-        errors = 0
-        last_id = last_processed
-
-        for r in rows:
-            try:
-                # Determinar id según pk seleccionado
-                if pk in r.keys():
-                    source_rowid = int(r[pk])
-                elif 'rowid' in r.keys():
-                    source_rowid = int(r['rowid'])
-                else:
-                    source_rowid = None
-                usuario = r.get('usuario') or r.get('user') or 'unknown'
-                pregunta = r.get('consulta') or r.get('pregunta') or r.get('question') or ''
-                respuesta = r.get('respuesta') or r.get('answer') or ''
+            row = tgt_conn.execute("SELECT MAX(source_rowid) FROM processed_conversations WHERE source = ?",
+                                   (str(source),)).fetchone()
+            last_id = int(row[0]) if row and row[0] is not None else 0
+            remaining = limit if isinstance(limit, int) and limit > 0 else None
+
+            while remaining is None or remaining > 0:
+                page = batch_size if remaining is None else min(batch_size, remaining)
+                rows = src_conn.execute(
+                    "SELECT rowid, usuario, consulta, respuesta FROM conversaciones "
+                    "WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_id, page)).fetchall()
+                if not rows:
+                    break
+
+                hashes = {}
+                for rowid, _usuario, pregunta, respuesta in rows:
+                    hashes[rowid] = _content_hash(pregunta or '', respuesta or '')
+                # Hashes ya ingeridos (de esta u otra fuente), en una sola consulta
+                known = set()
+                unique_hashes = list(set(hashes.values()))
+                for i in range(0, len(unique_hashes), 500):
+                    chunk = unique_hashes[i:i + 500]
+                    qmarks = ",".join("?" * len(chunk))
+                    known.update(r[0] for r in tgt_conn.execute(
+                        f"SELECT content_hash FROM processed_conversations WHERE content_hash IN ({qmarks})", chunk))
+
+                facts, faqs, tracking = [], [], []
+                now = datetime.utcnow().isoformat()
+                for rowid, usuario, pregunta, respuesta in rows:
+                    h = hashes[rowid]
+                    tracking.append((str(source), rowid, now, h))
+                    if not (pregunta or '').strip() or not (respuesta or '').strip():
+                        summary['skipped'] += 1
+                        continue
+                    if h in known:
+                        summary['duplicates'] += 1
+                        continue
+                    known.add(h)
+                    convo_id = f"src_{rowid}"
+                    content = respuesta[:_MAX_CONTENT]
+                    tags = {'conversation_id': convo_id, 'source': 'conversation', 'usuario': usuario}
+                    facts.append((f"fact_{h[:12]}", content, f"conversation:{convo_id}", 'conversation',
+                                  json.dumps(tags, ensure_ascii=False)))
+                    faqs.append((f"faq_{h[:12]}", _normalize_query(pregunta), content, '[]'))
 
-                convo_id = f"src_{source_rowid}"
-
-                # Guardar aprendizaje usando la función existente
                 try:
-                    save_learning(convo_id, pregunta, respuesta, citations=None, fact_type='conversation')
-                except Exception as e:
-                    # No detener el proceso
-                    errors += 1
-                    tgt_cur.execute("INSERT OR IGNORE INTO processed_conversations(source, source_rowid, processed_at) VALUES (?, ?, ?)",
-                                    (str(source), source_rowid, datetime.utcnow().isoformat()))
-                    tgt_conn.commit()
-                    continue
-
-                # Marcar como procesado
-                tgt_cur.execute("INSERT OR IGNORE INTO processed_conversations(source, source_rowid, processed_at) VALUES (?, ?, ?)",
-                                (str(source), source_rowid, datetime.utcnow().isoformat()))
-                tgt_conn.commit()
-                processed += 1
-                last_id = source_rowid
-            except Exception as e:
-                errors += 1
-                continue
-
-        src_conn.close()
-        tgt_conn.close()
-
-        return {'processed': processed, 'errors': errors, 'last_processed_source_id': last_id}
+                    with tgt_conn:
+                        tgt_conn.executemany(_INSERT_FACT_SQL, facts)
+                        tgt_conn.executemany(_UPSERT_FAQ_SQL, faqs)
+                        tgt_conn.executemany(_TRACK_SQL, tracking)
+                except sqlite3.Error as e:
+                    # La transacción del lote se revierte completa; no avanzar el cursor
+                    summary['errors'] += len(rows)
+                    summary['message'] = str(e)
+                    logger.error(f"❌ ingest_conversations: lote desde rowid {last_id} revertido: {e}")
+                    break
+
+                summary['processed'] += len(facts)
+                summary['batches'] += 1
+                last_id = rows[-1][0]
+                if remaining is not None:
+                    remaining -= len(rows)
+                logger.debug(f"Ingesta: lote {summary['batches']} hasta rowid {last_id} ({len(facts)} nuevos)")
+        finally:
+            src_conn.close()
+            tgt_conn.close()
+
+        elapsed = time.perf_counter() - started
+        read = summary['processed'] + summary['duplicates'] + summary['skipped']
+        summary.update({
+            'last_processed_source_id': last_id,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(read / elapsed, 1) if elapsed > 0 else 0.0,
+        })
+        logger.info(f"✅ Ingesta de conversaciones: {summary['processed']} nuevas, {summary['duplicates']} duplicadas, "
+                     f"{summary['skipped']} vacías en {elapsed:.2f}s ({summary['rows_per_second']} filas/s)")
+        return summary
 
     except Exception as e:
         logger.error(f"❌ ingest_conversations error: {e}")
-        return {'processed': 0, 'errors': 1, 'message': str(e)}
-
+        return {**summary, 'errors': summary['errors'] + 1, 'message': str(e)}
@@ -1,17 +1,28 @@
 """Minimal memory helpers for JP-LegalBot - Claude-Mejoras implementation
 
 This module provides lightweight functions used for development/testing only:
-- get_user_memory_context: returns last N user messages
-- calculate_query_similarity: naive overlap score
-- analyze_user_patterns: returns frequent tokens
+- get_user_memory_context: returns last N user messages (served from an
+  in-process per-user ring buffer, see MemoryCache)
+- remember_turn: write-through hook called when a conversation is saved
+- select_memory_context: past turns ranked against the current question,
+  trimmed to a token budget
+- calculate_query_similarity: token overlap score (stopwords removed)
+- analyze_user_patterns: top terms of a user from `user_term_stats`, kept up
+  to date incrementally on save (record_user_terms) with exponential decay
+  (log2 weights, merged by the `logaddexp2` SQL function)
 
 These are intentionally simple and safe; replace with embeddings/vector search
 for production.
 """
+import math
 import sqlite3
 import os
 import re
-from typing import List, Dict
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Tuple
 
 # Resolve database path: prefer CONVERSACIONES_DB, then DATABASE_URL, then default
 _env_db = os.getenv('CONVERSACIONES_DB') or os.getenv('DATABASE_URL') or 'database/conversaciones.db'
@@ -35,51 +46,340 @@ def _get_conn():
     conn.row_factory = sqlite3.Row
     return conn
 
-def get_user_memory_context(user_id: str, window: int = 5) -> List[Dict]:
-    """Return the last `window` conversation entries for a given user."""
+def _load_recent(user_id: str, limit: int) -> List[Dict]:
+    """Last `limit` turns of `user_id`, oldest first (uses idx_conversaciones_usuario_ts)."""
+    conn = _get_conn()
     try:
-        conn = _get_conn()
-        cur = conn.cursor()
-        cur.execute(
+        cur = conn.execute(
             'SELECT consulta AS pregunta, respuesta AS respuesta, timestamp FROM conversaciones WHERE usuario = ? ORDER BY timestamp DESC LIMIT ?',
-            (user_id, window)
+            (user_id, limit)
         )
         rows = [dict(r) for r in cur.fetchall()]
+    finally:
         conn.close()
-        # return in chronological order (oldest first)
-        return list(reversed(rows))
+    return list(reversed(rows))
+
+
+def _now_timestamp() -> str:
+    # Same format as SQLite datetime('now') so cached and stored turns sort together
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _public(turn: Dict) -> Dict:
+    return {k: v for k, v in turn.items() if not k.startswith('_')}
+
+
+class _UserTurns:
+    __slots__ = ('turns', 'unsaved', 'hydrated', 'loaded_at')
+
+    def __init__(self, capacity: int):
+        self.turns = deque(maxlen=capacity)
+        # Turns appended by this process and not yet seen in SQLite
+        self.unsaved = deque(maxlen=capacity)
+        self.hydrated = False
+        self.loaded_at = 0.0
+
+
+class MemoryCache:
+    """Per-user ring buffers of recent turns with LRU eviction across users.
+
+    Saves are written through (`append`), so reading the history of an active
+    user is a memory read. A user not in the cache is hydrated lazily from
+    SQLite on the first read; turns appended by this process that are not in
+    SQLite yet (still in the write-behind queue) are merged by timestamp so
+    none is lost. Entries are re-read after `ttl_seconds` to pick up turns
+    written by other worker processes.
+    """
+
+    def __init__(self, capacity: int = 20, max_users: int = 1024, ttl_seconds: float = 300.0):
+        self.capacity = capacity
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._users: 'OrderedDict[str, _UserTurns]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, user_id: str) -> _UserTurns:
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = _UserTurns(self.capacity)
+            self._users[user_id] = entry
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return entry
+
+    def append(self, user_id: str, pregunta: str, respuesta: str, timestamp: Optional[str] = None):
+        turn = {'pregunta': pregunta, 'respuesta': respuesta, 'timestamp': timestamp or _now_timestamp()}
+        with self._lock:
+            entry = self._entry(user_id)
+            entry.turns.append(turn)
+            entry.unsaved.append(turn)
+
+    def get(self, user_id: str, window: int) -> List[Dict]:
+        if window > self.capacity:
+            return _load_recent(user_id, window)
+        if window <= 0:
+            return []
+        return [_public(t) for t in self.turns(user_id)[-window:]]
+
+    def turns(self, user_id: str) -> List[Dict]:
+        """Cached turns of `user_id` (oldest first), hydrating on a miss.
+
+        The dicts are the cached ones: callers must not modify them.
+        """
+        with self._lock:
+            entry = self._users.get(user_id)
+            fresh = (entry is not None and entry.hydrated
+                     and time.monotonic() - entry.loaded_at < self.ttl_seconds)
+            if fresh:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return list(entry.turns)
+            self.misses += 1
+        # Read outside the lock; concurrent misses for the same user just load twice
+        rows = _load_recent(user_id, self.capacity)
+        with self._lock:
+            entry = self._entry(user_id)
+            stored = {(r['timestamp'], r['pregunta']) for r in rows}
+            # Only this process's own unsaved turns are carried over: older cached
+            # turns missing from `rows` just fell out of the window
+            pending = [t for t in entry.unsaved if (t['timestamp'], t['pregunta']) not in stored]
+            entry.unsaved = deque(pending, maxlen=self.capacity)
+            entry.turns.clear()
+            entry.turns.extend(sorted(rows + pending, key=lambda t: t['timestamp']))
+            entry.hydrated = True
+            entry.loaded_at = time.monotonic()
+            return list(entry.turns)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'users': len(self._users), 'max_users': self.max_users,
+                    'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses}
+
+
+_cache = MemoryCache(
+    capacity=int(os.getenv('MEMORY_CACHE_TURNS', '20')),
+    max_users=int(os.getenv('MEMORY_CACHE_USERS', '1024')),
+    ttl_seconds=float(os.getenv('MEMORY_CACHE_TTL', '300')),
+)
+
+
+def get_memory_cache() -> MemoryCache:
+    return _cache
+
+
+def remember_turn(user_id: str, pregunta: str, respuesta: str, timestamp: Optional[str] = None):
+    """Write-through: add a just-saved turn to the user's ring buffer."""
+    _cache.append(user_id, pregunta, respuesta, timestamp)
+
+
+def invalidate_user_memory(user_id: Optional[str] = None):
+    """Drop cached turns (one user, or everyone) after deleting conversations."""
+    _cache.invalidate(user_id)
+
+
+def get_user_memory_context(user_id: str, window: int = 5) -> List[Dict]:
+    """Return the last `window` conversation entries for a given user (oldest first)."""
+    try:
+        return _cache.get(user_id, window)
     except Exception:
         return []
 
 def _tokenize(text: str) -> List[str]:
     return re.findall(r"\w+", (text or '').lower())
 
-def calculate_query_similarity(query: str, contexts: List[Dict]) -> float:
-    """Naive similarity: token overlap between query and concatenated contexts."""
-    qtokens = set(_tokenize(query))
-    if not qtokens:
-        return 0.0
-    ctx_text = ' '.join((c.get('pregunta','') + ' ' + c.get('respuesta','')) for c in contexts)
-    ctx_tokens = set(_tokenize(ctx_text))
-    if not ctx_tokens:
+# Function words that would make any two Spanish sentences look related
+_STOPWORDS = frozenset(
+    'a al algo como con cual cuales cuando de del donde el en es esa ese esta este hay la las '
+    'le les lo los me mi mas muy no o para pero por que se si sin sobre son su sus un una uno y ya '
+    'qué cuál cuáles cómo cuándo dónde más sí'.split()
+)
+
+
+def _terms(text: str) -> frozenset:
+    return frozenset(t for t in _tokenize(text) if len(t) > 1 and t not in _STOPWORDS)
+
+
+def _turn_terms(turn: Dict) -> frozenset:
+    # Memoized on the cached turn: the per-user index is built once per turn
+    terms = turn.get('_terms')
+    if terms is None:
+        terms = _terms(turn.get('pregunta', '')) | _terms(turn.get('respuesta', ''))
+        turn['_terms'] = terms
+    return terms
+
+
+def _overlap(qterms: frozenset, ctx_terms: frozenset) -> float:
+    if not qterms or not ctx_terms:
         return 0.0
-    overlap = qtokens.intersection(ctx_tokens)
-    return len(overlap) / max(len(qtokens), 1)
+    return len(qterms & ctx_terms) / len(qterms)
+
+
+def calculate_query_similarity(query: str, contexts: List[Dict]) -> float:
+    """Similarity: share of the query's content words found in the contexts."""
+    ctx_terms = frozenset()
+    for c in contexts:
+        ctx_terms |= _terms(c.get('pregunta', '')) | _terms(c.get('respuesta', ''))
+    return _overlap(_terms(query), ctx_terms)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for Spanish text (~4 characters per token)."""
+    return (len(text or '') + 3) // 4
+
+
+def select_memory_context(user_id: str, query: str, max_turns: int = 5, token_budget: int = 1500,
+                          keep_last: int = 1, min_score: float = 0.1) -> List[Dict]:
+    """Past turns most related to `query`, oldest first, within `token_budget`.
 
-def analyze_user_patterns(user_id: str, top_n: int = 10) -> Dict[str,int]:
-    """Return top tokens used by the user across their recent conversations."""
+    The user's cached turns are scored with the same overlap as
+    `calculate_query_similarity` (ties go to the most recent). The last
+    `keep_last` turns are always candidates so follow-ups ("¿y en R-2?")
+    keep their antecedent. Turns that do not fit the remaining budget are
+    skipped. Each returned turn carries its `score`.
+    """
+    try:
+        turns = _cache.turns(user_id)
+    except Exception:
+        return []
+    if not turns or max_turns <= 0:
+        return []
+    qterms = _terms(query)
+    n = len(turns)
+    scored = []
+    for i, turn in enumerate(turns):
+        score = _overlap(qterms, _turn_terms(turn))
+        forced = i >= n - keep_last
+        if forced or score >= min_score:
+            scored.append((forced, score, i))
+    scored.sort(key=lambda x: (x[0], x[1], x[2]), reverse=True)
+
+    chosen, used = [], 0
+    for _forced, score, i in scored:
+        if len(chosen) >= max_turns:
+            break
+        turn = turns[i]
+        cost = estimate_tokens(turn.get('pregunta', '')) + estimate_tokens(turn.get('respuesta', ''))
+        if used + cost > token_budget:
+            continue
+        used += cost
+        chosen.append((i, score))
+    chosen.sort()
+    return [{**_public(turns[i]), 'score': round(score, 3)} for i, score in chosen]
+
+# --- per-user term statistics -------------------------------------------------
+# Weights decay with a half-life, stored relative to a fixed epoch: a
+# occurrence at time t adds 2**((t - EPOCH) / half_life). Every stored weight
+# shrinks by the same factor over time, so ORDER BY weight is already the
+# decayed ranking and top-N is an index read; the factor 2**(-(now - EPOCH) /
+# half_life) is applied only to the returned values.
+# The column holds log2 of that sum (a float 2** overflows ~1024 half-lives
+# after the epoch); occurrences are added with logaddexp2().
+TERM_STATS_EPOCH = 1735689600.0  # 2025-01-01 UTC
+TERM_HALF_LIFE_DAYS = float(os.getenv('USER_TERMS_HALF_LIFE_DAYS', '30'))
+# Answer words describe the bot more than the user: count them at a fraction
+ANSWER_TERM_WEIGHT = 0.25
+
+UPSERT_USER_TERM_SQL = """
+    INSERT INTO user_term_stats (usuario, term, weight, last_seen) VALUES (?, ?, ?, ?)
+    ON CONFLICT(usuario, term) DO UPDATE SET
+        weight = logaddexp2(weight, excluded.weight),
+        last_seen = MAX(COALESCE(last_seen, 0), excluded.last_seen)
+"""
+
+
+def _epoch_seconds(timestamp) -> float:
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    if timestamp:
+        try:
+            dt = datetime.strptime(str(timestamp)[:19], '%Y-%m-%d %H:%M:%S')
+            return dt.replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+def _log_growth(seconds: float) -> float:
+    return (seconds - TERM_STATS_EPOCH) / (TERM_HALF_LIFE_DAYS * 86400.0)
+
+
+def logaddexp2(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    """log2(2**a + 2**b) without leaving log space."""
+    if a is None or b is None:
+        return b if a is None else a
+    hi, lo = (a, b) if a >= b else (b, a)
+    return hi + math.log2(1.0 + 2.0 ** (lo - hi))
+
+
+def register_sql_functions(con) -> None:
+    """Register logaddexp2 (used by UPSERT_USER_TERM_SQL) on a connection."""
+    con.create_function('logaddexp2', 2, logaddexp2, deterministic=True)
+
+
+def _term_counts(pregunta: str, respuesta: str) -> Dict[str, float]:
+    counts: Dict[str, float] = {}
+    for text, weight in ((pregunta, 1.0), (respuesta, ANSWER_TERM_WEIGHT)):
+        for t in _tokenize(text):
+            if len(t) > 1 and t not in _STOPWORDS and not t.isdigit():
+                counts[t] = counts.get(t, 0.0) + weight
+    return counts
+
+
+def user_term_rows(user_id: str, pregunta: str, respuesta: str, timestamp=None) -> List[Tuple]:
+    """Parameters for UPSERT_USER_TERM_SQL for one saved turn."""
+    ts = _epoch_seconds(timestamp)
+    g = _log_growth(ts)
+    return [(user_id, term, math.log2(count) + g, ts) for term, count in _term_counts(pregunta, respuesta).items()]
+
+
+def record_user_terms(con, user_id: str, pregunta: str, respuesta: str, timestamp=None) -> int:
+    rows = user_term_rows(user_id, pregunta, respuesta, timestamp)
+    register_sql_functions(con)
+    con.executemany(UPSERT_USER_TERM_SQL, rows)
+    return len(rows)
+
+
+def backfill_user_term_stats(con) -> int:
+    """Rebuild user_term_stats from `conversaciones` in one pass (used by the migration)."""
+    tables = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'conversaciones' not in tables:
+        return 0
+    con.execute("DELETE FROM user_term_stats")
+    acc: Dict[Tuple[str, str], List[float]] = {}
+    cur = con.execute("SELECT usuario, consulta, respuesta, timestamp FROM conversaciones WHERE usuario IS NOT NULL")
+    for usuario, consulta, respuesta, timestamp in cur:
+        for _, term, weight, ts in user_term_rows(usuario, consulta or '', respuesta or '', timestamp):
+            cell = acc.setdefault((usuario, term), [None, ts])
+            cell[0] = logaddexp2(cell[0], weight)
+            cell[1] = max(cell[1], ts)
+    con.executemany("INSERT INTO user_term_stats (usuario, term, weight, last_seen) VALUES (?, ?, ?, ?)",
+                    ((u, t, w, ts) for (u, t), (w, ts) in acc.items()))
+    return len(acc)
+
+
+def analyze_user_patterns(user_id: str, top_n: int = 10) -> Dict[str, float]:
+    """Return the user's top terms with their decayed weights (most frequent first)."""
     try:
         conn = _get_conn()
-        cur = conn.cursor()
-        cur.execute('SELECT consulta AS pregunta, respuesta FROM conversaciones WHERE usuario = ? ORDER BY timestamp DESC LIMIT 200', (user_id,))
-        text = ' '.join((r['pregunta'] or '') + ' ' + (r['respuesta'] or '') for r in cur.fetchall())
-        conn.close()
-        tokens = _tokenize(text)
-        freq = {}
-        for t in tokens:
-            freq[t] = freq.get(t, 0) + 1
-        # return top N
-        items = sorted(freq.items(), key=lambda x: x[1], reverse=True)[:top_n]
-        return {k:v for k,v in items}
+        try:
+            rows = conn.execute(
+                'SELECT term, weight FROM user_term_stats WHERE usuario = ? ORDER BY weight DESC LIMIT ?',
+                (user_id, top_n)
+            ).fetchall()
+        finally:
+            conn.close()
+        now = _log_growth(time.time())
+        return {r['term']: round(2.0 ** min(r['weight'] - now, 64.0), 3) for r in rows}
     except Exception:
         return {}
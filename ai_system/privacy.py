@@ -1,14 +1,53 @@
 import re
 import sqlite3
 import os
-from datetime import datetime
-from typing import Dict, Tuple
+import argparse
+import io
+import json
+import logging
+import time
+import zipfile
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import config
+from .schema import get_capabilities
+
+logger = logging.getLogger(__name__)
 
 # Patrones básicos PII (ajustar según necesidad local)
 _EMAIL_RE = re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b")
-_PHONE_RE = re.compile(r"\b(\+?\d{1,3}[\s-]?)?(?:\d{2,4}[\s-]?){2,4}\d{2,4}\b")
+# Teléfono con forma de teléfono: [+CC] [NNN | (NNN)] NNN NNNN con separadores.
+# Los lookbehind evitan tomar la cola de un número más largo o de una lista de
+# números ("30 100 500 1000"); fechas (dd-mm-aaaa) y expedientes (2021-123456)
+# no tienen esa forma
+_PHONE_RE = re.compile(
+    r"(?<!\d)(?<!\d[\s-])(?P<cc>\+\d{1,3}[\s-]?)?(?P<area>\(\d{3}\)\s?|\d{3}[\s-])?\d{3}[\s-]\d{4}(?!\d)"
+)
+# Teléfono de 10 dígitos sin separadores (7875551234): área y central no empiezan por 0/1
+_PHONE_DIGITS_RE = re.compile(r"[2-9]\d{2}[2-9]\d{6}")
+# Seguro social con guiones: 123-45-6789
+_SSN_RE = re.compile(r"(?<![\d-])\d{3}-\d{2}-\d{4}(?![\d-])")
+# "Ley 161-2009": número de ley y año, con la misma forma que un teléfono local
+_LAW_YEAR_RE = re.compile(r"\d{3}[\s-](?:19|20)\d{2}")
 _ID_RE = re.compile(r"\b\d{6,15}\b")
-_COORD_RE = re.compile(r"\b-?\d{1,3}\.\d+[, ]\s*-?\d{1,3}\.\d+\b")
+# 3+ decimales: "Reglas 2.1, 3.4" no es una coordenada
+_COORD_RE = re.compile(r"\b-?\d{1,3}\.\d{3,}[, ]\s*-?\d{1,3}\.\d{3,}\b")
+
+# Escáner de una sola pasada. Todo dato PII salvo el email empieza por dígito,
+# signo o el paréntesis de un código de área, así que el patrón combinado
+# arranca con esa clase de caracteres y el motor de `re` salta en C las
+# posiciones de texto normal; el lookbehind evita empezar a mitad de palabra o
+# de número ("x2019", "2.1234"). Los tramos numéricos se clasifican después en
+# ids, seguros sociales y teléfonos. Los emails solo se buscan si el texto
+# contiene '@'.
+_PII_RE = re.compile(
+    r"(?P<paren>(?<![\w.+-])(?:\+\d{1,3}[\s-]?)?\(\d{3}\)\s?\d{3}[\s-]\d{4}(?!\d))"
+    r"|[-+\d](?<![\w.+-][-+\d])"
+    r"(?:(?P<coords>\d{0,2}\.\d{3,}[, ]\s*-?\d{1,3}\.\d{3,}\b)"
+    r"|(?P<number>\d?[\d -]{4,22}\d\b))"
+)
+PII_CATEGORIES = ('emails', 'phones', 'ids', 'ssns', 'coords')
 
 _env_db = os.getenv('CONVERSACIONES_DB') or os.getenv('DATABASE_URL') or 'database/conversaciones.db'
 if isinstance(_env_db, str) and _env_db.startswith('sqlite'):
@@ -24,25 +63,125 @@ if not _db_path.is_absolute():
 
 DB_PATH = str(_db_path)
 
+# Base de aprendizaje, donde la app guarda conversations y conversation_messages
+# (misma resolución que app.resolve_learning_db_path)
+_env_learning_db = os.getenv('DB_PATH') or os.getenv('DATABASE_URL') or 'database/hybrid_knowledge.db'
+if _env_learning_db.startswith('sqlite:///'):
+    _env_learning_db = _env_learning_db.replace('sqlite:///', '', 1)
+elif _env_learning_db.startswith('sqlite://'):
+    _env_learning_db = _env_learning_db.replace('sqlite://', '', 1)
+_learning_db_path = Path(_env_learning_db)
+if not _learning_db_path.is_absolute():
+    _learning_db_path = Path(__file__).resolve().parents[1] / _learning_db_path
+
+LEARNING_DB_PATH = str(_learning_db_path)
+
 def _get_conn():
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
+
+def _number_hits(value: str, start: int) -> List[Tuple[str, int, int, str]]:
+    """Clasificar un tramo numérico.
+
+    Solo dígitos → teléfono si tiene forma de número de 10 dígitos, si no id;
+    con separadores → seguro(s) social(es) y teléfono(s).
+    """
+    if value.isdigit():
+        if _PHONE_DIGITS_RE.fullmatch(value):
+            return [('phones', start, start + len(value), value)]
+        return [('ids', start, start + len(value), value)] if _ID_RE.fullmatch(value) else []
+    hits = [('ssns', start + m.start(), start + m.end(), m.group()) for m in _SSN_RE.finditer(value)]
+    # El tramo puede juntar un teléfono con números vecinos ("787-555-1234 2 veces")
+    for m in _PHONE_RE.finditer(value):
+        phone = m.group()
+        if not m.group('cc') and not m.group('area') and _LAW_YEAR_RE.fullmatch(phone):
+            continue
+        if any(h[1] - start < m.end() and m.start() < h[2] - start for h in hits):
+            continue
+        hits.append(('phones', start + m.start(), start + m.end(), phone))
+    hits.sort(key=lambda h: h[1])
+    return hits
+
+
+def scan_pii(text: str) -> List[Tuple[str, int, int, str]]:
+    """Hallazgos PII de `text` ordenados por posición: [(categoría, inicio, fin, valor)]."""
+    if not text:
+        return []
+    found = []
+    for m in _PII_RE.finditer(text):
+        if m.lastgroup == 'coords':
+            found.append(('coords', m.start(), m.end(), m.group()))
+        else:
+            found.extend(_number_hits(m.group(), m.start()))
+    if '@' in text:
+        emails = [('emails', m.start(), m.end(), m.group()) for m in _EMAIL_RE.finditer(text)]
+        if emails:
+            # Los dígitos dentro de un email ya quedan cubiertos por él
+            found = [h for h in found if not any(e[1] <= h[1] < e[2] for e in emails)] + emails
+            found.sort(key=lambda h: h[1])
+    return found
+
+
 def detect_pii(text: str) -> Dict[str, list]:
-    return {
-        'emails': [],
-        'phones': [],
-        'ids': [],
-        'coords': [],
-    }
+    hits = {k: [] for k in PII_CATEGORIES}
+    for kind, _, _, value in scan_pii(text):
+        hits[kind].append(value)
+    return hits
+
 
 def sanitize_text(text: str, redact_token='[REDACTED]') -> str:
-    return text
+    found = scan_pii(text)
+    if not found:
+        return text
+    parts, last = [], 0
+    for _, start, end, _ in found:
+        parts.append(text[last:start])
+        parts.append(redact_token)
+        last = end
+    parts.append(text[last:])
+    return ''.join(parts)
+
 
 def safe_to_send(text: str) -> Tuple[bool, Dict[str, list]]:
     hits = detect_pii(text)
-    return (True, hits)
+    return (not any(hits.values()), hits)
+
+
+def scan_texts(texts: Iterable[str]) -> List[Dict[str, list]]:
+    """Versión por lotes de detect_pii (mismo orden que `texts`)."""
+    return [detect_pii(t) for t in texts]
+
+
+def scan_conversations(db_path: Optional[str] = None, batch_size: int = 1000,
+                       after_rowid: int = 0) -> Iterator[Dict]:
+    """Recorrer conversaciones guardadas y devolver las que contienen PII.
+
+    Paginación por rowid (sin OFFSET), un lote por consulta; `after_rowid`
+    permite reanudar un escaneo. Cada resultado trae rowid, usuario y los
+    hallazgos de consulta y respuesta.
+    """
+    conn = sqlite3.connect(db_path or DB_PATH)
+    try:
+        while True:
+            rows = conn.execute("""SELECT rowid, usuario, consulta, respuesta FROM conversaciones
+                                   WHERE rowid > ? ORDER BY rowid LIMIT ?""",
+                                (after_rowid, batch_size)).fetchall()
+            if not rows:
+                break
+            for rowid, usuario, consulta, respuesta in rows:
+                consulta_hits, respuesta_hits = scan_pii(consulta or ''), scan_pii(respuesta or '')
+                if consulta_hits or respuesta_hits:
+                    yield {
+                        'rowid': rowid,
+                        'usuario': usuario,
+                        'consulta': [(k, v) for k, _, _, v in consulta_hits],
+                        'respuesta': [(k, v) for k, _, _, v in respuesta_hits],
+                    }
+            after_rowid = rows[-1][0]
+    finally:
+        conn.close()
 
 # --- DB helpers for consent and audit ---
 def ensure_privacy_tables():
@@ -57,8 +196,202 @@ def set_user_consent(user_id: str, consent: bool):
 def get_user_consent(user_id: str) -> bool:
     return True
 
+# --- Exportación de datos del usuario ---
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '500'))
+# Tamaño aproximado de cada bloque escrito a la respuesta HTTP
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def _keyset_rows(con, sql: str, params: tuple, start: tuple, key, batch_size: int) -> Iterator[Dict]:
+    """Filas de `sql` por lotes con paginación por clave (sin OFFSET).
+
+    `sql` termina en `> (?...) ORDER BY ... LIMIT ?`; `key(row)` devuelve la
+    clave de la última fila para el siguiente lote. Cada lote es una consulta
+    independiente, así que no queda una transacción de lectura abierta
+    mientras el cliente descarga.
+    """
+    last = start
+    while True:
+        rows = con.execute(sql, (*params, *last, batch_size)).fetchall()
+        for r in rows:
+            yield r
+        if len(rows) < batch_size:
+            return
+        last = key(rows[-1])
+
+
+def _export_record(table: str, row: sqlite3.Row) -> Dict:
+    return {'tipo': table, **{k: row[k] for k in row.keys() if k != '_rowid'}}
+
+
+def iter_user_export(user_id: str, db_path: Optional[str] = None, knowledge_db_path: Optional[str] = None,
+                     learning_db_path: Optional[str] = None,
+                     batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    """Registros del usuario uno a uno, con `tipo` = tabla de origen.
+
+    Orden: conversaciones y user_term_stats (base de conversaciones),
+    conversations y los conversation_messages de esas conversaciones,
+    agrupados por conversación (base de aprendizaje), y los knowledge_facts
+    que creó (tags.created_by); los registros de cada tipo salen contiguos.
+    El primero es una cabecera y el último un resumen con el conteo por tipo.
+    """
+    path = db_path or DB_PATH
+    kpath = knowledge_db_path or config.DB_PATH
+    lpath = learning_db_path or LEARNING_DB_PATH
+    counts: Dict[str, int] = {}
+    yield {'tipo': 'export', 'usuario': user_id, 'generado': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+    caps = get_capabilities(path)
+    con = sqlite3.connect(path)
+    con.row_factory = sqlite3.Row
+    try:
+        if caps.has_table('conversaciones'):
+            # (timestamp, rowid) recorre el índice (usuario, timestamp) sin ordenar
+            for r in _keyset_rows(con, """SELECT rowid AS _rowid, * FROM conversaciones
+                                          WHERE usuario = ? AND (timestamp, rowid) > (?, ?)
+                                          ORDER BY timestamp, rowid LIMIT ?""",
+                                  (user_id,), ('', 0), lambda r: (r['timestamp'], r['_rowid']), batch_size):
+                counts['conversaciones'] = counts.get('conversaciones', 0) + 1
+                yield _export_record('conversaciones', r)
+
+        if caps.has_table('user_term_stats'):
+            for r in _keyset_rows(con, """SELECT term AS _rowid, term, weight, last_seen FROM user_term_stats
+                                          WHERE usuario = ? AND term > ? ORDER BY term LIMIT ?""",
+                                  (user_id,), ('',), lambda r: (r['term'],), batch_size):
+                counts['user_term_stats'] = counts.get('user_term_stats', 0) + 1
+                yield _export_record('user_term_stats', r)
+    finally:
+        con.close()
+
+    # conversations y conversation_messages los escribe la app en la base de aprendizaje
+    lcaps = get_capabilities(lpath)
+    if lcaps.has_table('conversations'):
+        lcon = sqlite3.connect(lpath)
+        lcon.row_factory = sqlite3.Row
+        try:
+            for conv in _keyset_rows(lcon, """SELECT rowid AS _rowid, * FROM conversations
+                                              WHERE user_id = ? AND rowid > ? ORDER BY rowid LIMIT ?""",
+                                     (user_id,), (0,), lambda r: (r['_rowid'],), batch_size):
+                counts['conversations'] = counts.get('conversations', 0) + 1
+                yield _export_record('conversations', conv)
+
+            if lcaps.has_table('conversation_messages'):
+                # Segunda pasada: cada tipo sale contiguo (el ZIP escribe una entrada por tipo)
+                for conv in _keyset_rows(lcon, """SELECT rowid AS _rowid, id FROM conversations
+                                                  WHERE user_id = ? AND rowid > ? ORDER BY rowid LIMIT ?""",
+                                         (user_id,), (0,), lambda r: (r['_rowid'],), batch_size):
+                    for r in _keyset_rows(lcon, """SELECT rowid AS _rowid, * FROM conversation_messages
+                                                   WHERE conversation_id = ? AND (created_at, rowid) > (?, ?)
+                                                   ORDER BY created_at, rowid LIMIT ?""",
+                                          (conv['id'],), ('', 0), lambda r: (r['created_at'], r['_rowid']),
+                                          batch_size):
+                        counts['conversation_messages'] = counts.get('conversation_messages', 0) + 1
+                        yield _export_record('conversation_messages', r)
+        finally:
+            lcon.close()
+
+    kcaps = get_capabilities(kpath)
+    if kcaps.has_columns('knowledge_facts', 'content', 'tags'):
+        kcon = sqlite3.connect(kpath)
+        kcon.row_factory = sqlite3.Row
+        try:
+            for r in _keyset_rows(kcon, """SELECT rowid AS _rowid, id, content, citation, type, tags, created_at
+                                           FROM knowledge_facts
+                                           WHERE (CASE WHEN json_valid(tags) THEN json_extract(tags, '$.created_by') END) = ?
+                                             AND rowid > ? ORDER BY rowid LIMIT ?""",
+                                  (user_id,), (0,), lambda r: (r['_rowid'],), batch_size):
+                counts['knowledge_facts'] = counts.get('knowledge_facts', 0) + 1
+                yield _export_record('knowledge_facts', r)
+        finally:
+            kcon.close()
+
+    yield {'tipo': 'fin', 'conteo': counts}
+
+
+def _ndjson_line(record: Dict) -> str:
+    return json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+
+def stream_user_export_ndjson(user_id: str, **kwargs) -> Iterator[bytes]:
+    """Exportación NDJSON en bloques de ~EXPORT_CHUNK_BYTES (memoria constante)."""
+    buf, size = [], 0
+    for record in iter_user_export(user_id, **kwargs):
+        line = _ndjson_line(record).encode('utf-8')
+        buf.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b''.join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b''.join(buf)
+
+
+class _ZipSink(io.RawIOBase):
+    """Destino no seekable para zipfile: acumula bytes hasta que se drenan."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self.size += len(b)
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks, self.size = [], 0
+        return data
+
+
+def stream_user_export_zip(user_id: str, **kwargs) -> Iterator[bytes]:
+    """Exportación en ZIP (un `<tabla>.ndjson` por tipo y `resumen.json`), generada al vuelo.
+
+    zipfile escribe en modo streaming (descriptores de datos) sobre un destino
+    no seekable, así que cada bloque comprimido sale apenas se produce.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        current, entry, header = None, None, {}
+        try:
+            for record in iter_user_export(user_id, **kwargs):
+                if record['tipo'] == 'export':
+                    header = record
+                    continue
+                if record['tipo'] == 'fin':
+                    if entry is not None:
+                        entry.close()
+                        entry = None
+                    zf.writestr('resumen.json', json.dumps({**header, 'conteo': record['conteo']},
+                                                          ensure_ascii=False, indent=2))
+                    continue
+                name = f"{record['tipo']}.ndjson"
+                if name != current:
+                    if entry is not None:
+                        entry.close()
+                    entry = zf.open(name, 'w', force_zip64=True)
+                    current = name
+                entry.write(_ndjson_line(record).encode('utf-8'))
+                if sink.size >= EXPORT_CHUNK_BYTES:
+                    yield sink.drain()
+        finally:
+            if entry is not None:
+                entry.close()
+    yield sink.drain()
+
+
 def export_user_data(user_id: str) -> dict:
-    return {'conversaciones': [], 'learnings': []}
+    """Todos los datos del usuario en un dict (para historiales grandes usar los stream_*)."""
+    out: Dict[str, list] = {'conversaciones': [], 'learnings': []}
+    for record in iter_user_export(user_id):
+        tipo = record.pop('tipo')
+        if tipo in ('export', 'fin'):
+            continue
+        out.setdefault('learnings' if tipo == 'knowledge_facts' else tipo, []).append(record)
+    return out
 
 def delete_user_data(user_id: str) -> dict:
     return {'conversaciones': 0, 'learnings': 0}
@@ -67,5 +400,177 @@ def delete_user_data(user_id: str) -> dict:
 def rectify_user_data(user_id: str, record_id: int, field: str, new_value: str) -> dict:
     return {'ok': False}
 
-def apply_retention_policy(retention_days: int = 365) -> dict:
-    return {'anonymized': 0, 'checked': 0}
+# --- Retención ---
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '200'))
+RETENTION_PAUSE_SECONDS = float(os.getenv('RETENTION_PAUSE_SECONDS', '0.05'))
+# Tiempo objetivo con el lock de escritura tomado por lote; el lote se ajusta para no pasarlo
+RETENTION_MAX_LOCK_MS = float(os.getenv('RETENTION_MAX_LOCK_MS', '50'))
+ANON_USER = 'anonimo'
+
+# tabla: (columna de fecha, columna de usuario, columnas de texto del usuario a sanear,
+#         columnas a vaciar, columna de autor: si existe, el texto se sanea solo cuando es 'user')
+# Las respuestas del asistente no se tocan: citan leyes y expedientes, no datos del usuario
+_RETENTION_TABLES = {
+    'conversaciones': ('timestamp', 'usuario', ('consulta',), ('ip_usuario', 'user_agent'), None),
+    'conversation_messages': ('created_at', None, ('content',), ('specialist_context',), 'role'),
+    'conversations': ('started_at', 'user_id', (), ('session_id',), None),
+}
+# Tablas que la app guarda en la base de aprendizaje y no en conversaciones.db
+_LEARNING_TABLES = ('conversations', 'conversation_messages')
+
+
+def _retention_columns(spec) -> List[str]:
+    """Columnas que reescribe la anonimización, en el orden del UPDATE."""
+    _, user_col, text_cols, clear_cols, _ = spec
+    return ([user_col] if user_col else []) + list(text_cols) + list(clear_cols)
+
+
+def _anonymized_values(spec, row) -> Optional[tuple]:
+    """Valores anonimizados de `row` (sin rowid ni fecha) o None si ya lo están."""
+    _, user_col, text_cols, clear_cols, author_col = spec
+    old = tuple(row[2:2 + len(_retention_columns(spec))])
+    sanitize = author_col is None or row[-1] == 'user'
+    new = []
+    i = 0
+    if user_col:
+        new.append(ANON_USER)
+        i += 1
+    for value in old[i:i + len(text_cols)]:
+        new.append(sanitize_text(value) if value and sanitize else value)
+    new.extend(None for _ in clear_cols)
+    new = tuple(new)
+    return None if new == old else new
+
+
+def apply_retention_policy(retention_days: int = 365, mode: str = 'anonymize', db_path: Optional[str] = None,
+                           batch_size: int = RETENTION_BATCH_SIZE, pause: float = RETENTION_PAUSE_SECONDS,
+                           max_batches: Optional[int] = None, learning_db_path: Optional[str] = None) -> dict:
+    """Anonimizar (o borrar) filas más antiguas que `retention_days`.
+
+    Recorre cada tabla por rowid en lotes: el lote se lee sin lock y se aplica
+    en una transacción corta (BEGIN IMMEDIATE) que guarda también la posición
+    en `retention_checkpoints`, así que un job interrumpido (o limitado con
+    `max_batches`) se reanuda donde quedó con el mismo corte. Entre lotes hace
+    una pausa para que el chat pueda escribir, y reduce el lote si la
+    transacción pasa de RETENTION_MAX_LOCK_MS.
+
+    Se anonimiza lo que identifica al usuario (usuario, IP, texto que él
+    escribió); las respuestas quedan intactas. En el mismo lote se borran las
+    filas de `user_term_stats` de los usuarios afectados. `conversations` y
+    `conversation_messages` se procesan en la base de aprendizaje
+    (`learning_db_path`, por defecto LEARNING_DB_PATH), donde las guarda la app.
+    """
+    if mode not in ('anonymize', 'delete'):
+        raise ValueError(f"modo de retención inválido: {mode}")
+    path = db_path or DB_PATH
+    learning_path = learning_db_path or LEARNING_DB_PATH
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+    job = f"retention:{mode}"
+    summary = {'anonymized': 0, 'deleted': 0, 'checked': 0, 'batches': 0, 'completed': True,
+               'cutoff': cutoff, 'mode': mode}
+    started = time.perf_counter()
+    affected_users = set()
+
+    for table, spec in _RETENTION_TABLES.items():
+        table_path = learning_path if table in _LEARNING_TABLES else path
+        caps = get_capabilities(table_path)
+        if not caps.has_table(table):
+            continue
+        con = sqlite3.connect(table_path, timeout=30, isolation_level=None)
+        try:
+            ts_col, _, _, _, author_col = spec
+            cols = _retention_columns(spec)
+            # `+ts` evita el índice por fecha: el recorrido va por rowid y no ordena en cada lote
+            select_cols = [ts_col] + cols + ([author_col] if author_col else [])
+            select_sql = (f"SELECT rowid, {', '.join(select_cols)} FROM {table} "
+                          f"WHERE rowid > ? AND +{ts_col} < ? ORDER BY rowid LIMIT ?")
+            update_sql = f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in cols)} WHERE rowid = ?"
+            delete_sql = f"DELETE FROM {table} WHERE rowid = ?"
+
+            checkpoint = con.execute("SELECT cutoff, last_rowid FROM retention_checkpoints "
+                                     "WHERE job = ? AND table_name = ?", (job, table)).fetchone()
+            table_cutoff, last_rowid = checkpoint if checkpoint else (cutoff, 0)
+            size = batch_size
+            while True:
+                if max_batches is not None and summary['batches'] >= max_batches:
+                    summary['completed'] = False
+                    break
+                rows = con.execute(select_sql, (last_rowid, table_cutoff, size)).fetchall()
+                if not rows:
+                    con.execute("DELETE FROM retention_checkpoints WHERE job = ? AND table_name = ?", (job, table))
+                    break
+                if mode == 'delete':
+                    params = [(r[0],) for r in rows]
+                else:
+                    params = [(*vals, r[0]) for r in rows
+                              if (vals := _anonymized_values(spec, r)) is not None]
+                batch_users = set()
+                if table == 'conversaciones':
+                    batch_users = {r[2] for r in rows if r[2] and r[2] != ANON_USER}
+
+                lock_started = time.perf_counter()
+                con.execute("BEGIN IMMEDIATE")
+                try:
+                    if params:
+                        con.executemany(delete_sql if mode == 'delete' else update_sql, params)
+                    if batch_users and caps.has_table('user_term_stats'):
+                        # Los pesos por término salen de estas conversaciones: no deben sobrevivirles
+                        con.executemany("DELETE FROM user_term_stats WHERE usuario = ?",
+                                        [(u,) for u in batch_users])
+                    con.execute("""INSERT INTO retention_checkpoints(job, table_name, cutoff, last_rowid, processed, updated_at)
+                                   VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                                   ON CONFLICT(job, table_name) DO UPDATE SET
+                                     last_rowid = excluded.last_rowid, updated_at = excluded.updated_at,
+                                     processed = processed + excluded.processed""",
+                                (job, table, table_cutoff, rows[-1][0], len(params)))
+                    con.execute("COMMIT")
+                except Exception:
+                    con.execute("ROLLBACK")
+                    raise
+                lock_ms = (time.perf_counter() - lock_started) * 1000.0
+                affected_users |= batch_users
+
+                last_rowid = rows[-1][0]
+                summary['checked'] += len(rows)
+                summary['deleted' if mode == 'delete' else 'anonymized'] += len(params)
+                summary['batches'] += 1
+                if len(rows) < size:
+                    continue  # último lote de la tabla: no hace falta ceder
+                if lock_ms > RETENTION_MAX_LOCK_MS:
+                    size = max(10, size // 2)
+                elif lock_ms < RETENTION_MAX_LOCK_MS / 4:
+                    size = min(batch_size, size * 2)
+                time.sleep(pause)
+        finally:
+            con.close()
+
+    if affected_users:
+        # Solo alcanza la caché de este proceso; en los workers caduca por MEMORY_CACHE_TTL
+        from .memory import invalidate_user_memory
+        for user in affected_users:
+            invalidate_user_memory(user)
+    summary['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    logger.info(f"🧹 Retención ({mode}, corte {cutoff}): {summary['checked']} revisadas, "
+                f"{summary['anonymized']} anonimizadas, {summary['deleted']} borradas en {summary['batches']} lotes"
+                f"{'' if summary['completed'] else ' [pendiente]'}")
+    return summary
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Aplicar la política de retención a las conversaciones")
+    ap.add_argument('--db', default=DB_PATH)
+    ap.add_argument('--learning-db', default=LEARNING_DB_PATH,
+                    help="Base de aprendizaje (conversations, conversation_messages)")
+    ap.add_argument('--days', type=int, default=365, help="Días de retención")
+    ap.add_argument('--mode', choices=('anonymize', 'delete'), default='anonymize')
+    ap.add_argument('--batch-size', type=int, default=RETENTION_BATCH_SIZE)
+    ap.add_argument('--pause', type=float, default=RETENTION_PAUSE_SECONDS, help="Segundos entre lotes")
+    ap.add_argument('--max-batches', type=int, help="Detenerse tras N lotes (se reanuda en la próxima corrida)")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    print(json.dumps(apply_retention_policy(args.days, args.mode, args.db, args.batch_size, args.pause,
+                                            args.max_batches, args.learning_db), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""ai_system.resoluciones
+
+Búsqueda por metadatos sobre los archivos `Resoluciones_Tomo_N.txt`.
+
+- Ingesta: las listas de resoluciones (anidadas por tema y año) se aplanan en
+  filas {tomo, numero, anio, tema, asunto} dentro de la tabla `resoluciones`,
+  con índices por número y año y un índice FTS5 (`resoluciones_fts`) sobre el texto.
+- Consulta: "resolución 490/2020" se resuelve por clave, "resoluciones de 2020"
+  o "entre 2019 y 2020" por rango; solo el resto de preguntas usa FTS.
+"""
+from typing import List, Dict, Optional, Tuple
+import argparse
+import logging
+import os
+import re
+import unicodedata
+
+from .db import get_conn
+from .config import DB_PATH, RESPUESTAS_DIR
+from .chunker import find_tomo_files
+
+logger = logging.getLogger(__name__)
+
+_ITEM_RE = re.compile(r"^(\s*)(?:[-*•]|\d{1,2}\.)\s+(.+)$")
+_YEAR_MARKER_RE = re.compile(r"^A[ñn]o\s*:?\s*(\d{4}|sin especificar)?\s*:?\s*(.*)$", re.IGNORECASE)
+_YEAR_SUFFIX_RE = re.compile(r"\s+-\s+(\d{4})\s*$")
+_YEAR_PAREN_RE = re.compile(r"\s*\(A[ñn]o:?\s*([^)]*)\)\s*$", re.IGNORECASE)
+_YEAR_RE = re.compile(r"\b(19\d{2}|20\d{2})\b")
+_NUMBER_RE = re.compile(r"\b(?:Resoluci[óo]n|Regla|Secci[óo]n)\s+(?:N[úu]m\.?\s*)?([A-Z]{0,4}-?\d[\w.\-/]*)", re.IGNORECASE)
+_JP_CODE_RE = re.compile(r"\b(JP-[A-Z0-9]+(?:-[A-Z0-9]+)+)\b", re.IGNORECASE)
+_NOISE_RE = re.compile(r"^\s*🔍\s*Fragmento\s+\d+\s*:?\s*$")
+_QUERY_NUMBER_RE = re.compile(
+    r"\bresoluci[óo]n(?:es)?\s+(?:n[úu]m(?:ero)?\.?\s*)?([A-Z]{0,4}-?\d[\w.\-/]*)", re.IGNORECASE)
+_QUERY_RANGE_RE = re.compile(r"(?:entre|desde|de)\s+(19\d{2}|20\d{2})\s+(?:y|a|hasta|al)\s+(19\d{2}|20\d{2})",
+                             re.IGNORECASE)
+_QUERY_WORD_RE = re.compile(r"[a-z0-9ñ]{4,}")
+_QUERY_STOPWORDS = {'resolucion', 'resoluciones', 'junta', 'planificacion', 'sobre', 'cuales', 'existen',
+                    'lista', 'listado', 'tema', 'temas', 'suscritas', 'entre', 'desde', 'hasta', 'tomo'}
+
+
+def _strip_accents(text: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
+
+
+def _clean(text: str) -> str:
+    return ' '.join(text.replace('**', '').split()).strip(' :')
+
+
+def _normalize_numero(raw: str) -> str:
+    return raw.strip().rstrip('.,;:?)').upper()
+
+
+def _extract_numero(text: str) -> Optional[str]:
+    m = _JP_CODE_RE.search(text) or _NUMBER_RE.search(text)
+    return _normalize_numero(m.group(1)) if m else None
+
+
+def _build_tree(lines: List[str]) -> List[Dict]:
+    roots, stack = [], []
+    global_year = None
+    for line in lines:
+        m = _ITEM_RE.match(line)
+        if not m:
+            # Encabezados sueltos como "Año 2020:" aplican a los ítems siguientes
+            marker = _YEAR_MARKER_RE.match(_clean(line))
+            if marker and marker.group(1) and not marker.group(2):
+                global_year = marker.group(1)
+            stack = []
+            continue
+        node = {'indent': len(m.group(1).expandtabs(4)), 'text': _clean(m.group(2)),
+                'children': [], 'year': global_year}
+        while stack and stack[-1]['indent'] >= node['indent']:
+            stack.pop()
+        (stack[-1]['children'] if stack else roots).append(node)
+        stack.append(node)
+    return roots
+
+
+def _parse_year(raw: Optional[str]) -> Optional[int]:
+    m = _YEAR_RE.findall(raw or '')
+    return int(m[-1]) if m else None
+
+
+def _walk(node: Dict, tema: Optional[str], year: Optional[int], out: List[Dict]):
+    text = node['text']
+    marker = _YEAR_MARKER_RE.match(text)
+    if marker:
+        marker_year = _parse_year(marker.group(1)) or year
+        if marker.group(2):
+            # "Año 2020: Reglamento Conjunto 2020"
+            out.append({'asunto': _clean(marker.group(2)), 'tema': tema, 'anio': marker_year})
+        for child in node['children']:
+            _walk(child, tema, marker_year, out)
+        return
+
+    own_year = _parse_year(node['year']) or year
+    m = _YEAR_SUFFIX_RE.search(text) or _YEAR_PAREN_RE.search(text)
+    if m:
+        own_year = _parse_year(m.group(1)) or own_year
+        text = text[:m.start()].strip()
+    markers = [c for c in node['children'] if _YEAR_MARKER_RE.match(c['text']) and not c['children']]
+    for c in markers:
+        own_year = _parse_year(c['text']) or own_year
+    others = [c for c in node['children'] if c not in markers]
+
+    if not others:
+        out.append({'asunto': text, 'tema': tema, 'anio': own_year})
+        return
+    # Contenedores genéricos ("Resoluciones:") no reemplazan el tema
+    sub_tema = tema if _strip_accents(text.lower()).startswith('resoluciones') and len(text) < 20 else text
+    for child in others:
+        _walk(child, sub_tema, own_year, out)
+
+
+def parse_resoluciones(text: str) -> List[Dict]:
+    """Aplanar una lista de resoluciones en filas {numero, anio, tema, asunto}."""
+    lines = [l for l in (text or '').splitlines() if l.strip() and not _NOISE_RE.match(l)]
+    rows = []
+    for root in _build_tree(lines):
+        _walk(root, None, None, rows)
+    for r in rows:
+        r['numero'] = _extract_numero(r['asunto'])
+        if r['anio'] is None and r['numero'] and '/' in r['numero']:
+            r['anio'] = _parse_year(r['numero'].rsplit('/', 1)[-1])
+    return [r for r in rows if r['asunto']]
+
+
+def ensure_resoluciones_tables(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS resoluciones(
+            id INTEGER PRIMARY KEY,
+            tomo INTEGER NOT NULL,
+            numero TEXT,
+            anio INTEGER,
+            tema TEXT,
+            asunto TEXT NOT NULL,
+            fuente TEXT
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_resoluciones_numero ON resoluciones(numero)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_resoluciones_anio ON resoluciones(anio, tomo)")
+    con.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS resoluciones_fts USING fts5(
+            asunto, tema,
+            content='resoluciones', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+
+
+def ingest_resoluciones(data_dir: str = RESPUESTAS_DIR, db_path: str = DB_PATH) -> Dict:
+    """Parsear todos los `Resoluciones_Tomo_N.txt` y reconstruir `resoluciones`.
+
+    Retorna un resumen: {'files': n, 'rows': m, 'with_number': k}
+    """
+    records = []
+    files = find_tomo_files(data_dir, 'Resoluciones')
+    for tomo, path in files:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for r in parse_resoluciones(f.read()):
+                records.append((tomo, r['numero'], r['anio'], r['tema'], r['asunto'], os.path.basename(path)))
+
+    with get_conn(db_path) as con:
+        ensure_resoluciones_tables(con)
+        con.execute("DELETE FROM resoluciones")
+        con.executemany("""INSERT INTO resoluciones(tomo, numero, anio, tema, asunto, fuente)
+                           VALUES (?,?,?,?,?,?)""", records)
+        con.execute("INSERT INTO resoluciones_fts(resoluciones_fts) VALUES('rebuild')")
+
+    with_number = sum(1 for r in records if r[1])
+    logger.info(f"✅ Resoluciones ingeridas: {len(records)} filas ({with_number} con número) desde {len(files)} archivos")
+    return {'files': len(files), 'rows': len(records), 'with_number': with_number}
+
+
+def _ensure_loaded(con, db_path: str):
+    ensure_resoluciones_tables(con)
+    if con.execute("SELECT 1 FROM resoluciones LIMIT 1").fetchone() is None:
+        ingest_resoluciones(db_path=db_path)
+
+
+def es_consulta_resoluciones(mensaje: str) -> bool:
+    """Preguntas por una resolución concreta: número, año o rango de años.
+
+    Mencionar "resolución" no basta ("¿qué plazo hay para pedir reconsideración
+    de una resolución?" es una pregunta para el LLM, no un listado).
+    """
+    if 'resolucion' not in _strip_accents((mensaje or '').lower()):
+        return False
+    numero, rango = _query_filters(mensaje)
+    return bool(numero or rango)
+
+
+def _query_filters(mensaje: str) -> Tuple[Optional[str], Optional[Tuple[int, int]]]:
+    numero = None
+    m = _JP_CODE_RE.search(mensaje) or _QUERY_NUMBER_RE.search(mensaje)
+    # "resoluciones 2020" pide un año, no la resolución número 2020
+    if m and not _YEAR_RE.fullmatch(m.group(1)):
+        numero = _normalize_numero(m.group(1))
+    rango = None
+    r = _QUERY_RANGE_RE.search(mensaje)
+    if r:
+        a, b = sorted((int(r.group(1)), int(r.group(2))))
+        rango = (a, b)
+    elif not numero:
+        years = _YEAR_RE.findall(mensaje)
+        if years:
+            rango = (int(years[0]), int(years[0]))
+    return numero, rango
+
+
+def lookup_resoluciones(mensaje: str, limit: int = 20,
+                        db_path: str = DB_PATH) -> Tuple[List[Dict], int]:
+    """Resoluciones que corresponden a la pregunta y el total de coincidencias.
+
+    Orden de resolución: número exacto (o prefijo, p. ej. "8.1" -> 8.1.x),
+    rango de años y, solo si no hay ninguno, FTS sobre asunto/tema con todos
+    los términos de la pregunta (AND). Las filas se cortan en ``limit``; el
+    total permite avisar que el listado está truncado.
+    """
+    numero, rango = _query_filters(mensaje or '')
+    with get_conn(db_path) as con:
+        _ensure_loaded(con, db_path)
+        if numero:
+            where, params = "numero = ?", (numero,)
+            total = con.execute(f"SELECT COUNT(*) FROM resoluciones WHERE {where}", params).fetchone()[0]
+            if not total:
+                # Rango sobre el índice: "8.1" encuentra 8.1.1, 8.1.2, ...
+                where, params = "numero >= ? AND numero < ?", (numero + '.', numero + '/')
+                total = con.execute(f"SELECT COUNT(*) FROM resoluciones WHERE {where}", params).fetchone()[0]
+            rows = con.execute(f"SELECT * FROM resoluciones WHERE {where} ORDER BY numero, tomo LIMIT ?",
+                               params + (limit,)).fetchall()
+            return [dict(r) for r in rows], total
+        if rango:
+            total = con.execute("SELECT COUNT(*) FROM resoluciones WHERE anio BETWEEN ? AND ?",
+                                rango).fetchone()[0]
+            rows = con.execute("""SELECT * FROM resoluciones WHERE anio BETWEEN ? AND ?
+                                  ORDER BY anio, tomo, id LIMIT ?""", (rango[0], rango[1], limit)).fetchall()
+            return [dict(r) for r in rows], total
+        terms = [w for w in _QUERY_WORD_RE.findall(_strip_accents(mensaje.lower())) if w not in _QUERY_STOPWORDS]
+        if not terms:
+            return [], 0
+        match = ' AND '.join(f'"{t}"*' for t in terms)
+        try:
+            total = con.execute("SELECT COUNT(*) FROM resoluciones_fts WHERE resoluciones_fts MATCH ?",
+                                (match,)).fetchone()[0]
+            rows = con.execute("""SELECT r.* FROM resoluciones_fts f JOIN resoluciones r ON r.id = f.rowid
+                                  WHERE resoluciones_fts MATCH ? ORDER BY bm25(resoluciones_fts) LIMIT ?""",
+                               (match, limit)).fetchall()
+        except Exception as e:
+            logger.warning(f"⚠️ Error en búsqueda FTS de resoluciones: {e}")
+            return [], 0
+        return [dict(r) for r in rows], total
+
+
+def responder_resoluciones(mensaje: str) -> Optional[Dict]:
+    """Responder una consulta de resoluciones desde la tabla indexada.
+
+    Retorna un dict con el formato de resultado del pipeline de chat o None si
+    no hay filas que correspondan (el llamador continúa con el flujo normal).
+    """
+    rows, total = lookup_resoluciones(mensaje)
+    if not rows:
+        return None
+    lineas = []
+    for r in rows:
+        detalle = [f"TOMO {r['tomo']}"]
+        if r['anio']:
+            detalle.append(str(r['anio']))
+        tema = f" — {r['tema']}" if r['tema'] else ''
+        lineas.append(f"• {r['asunto']}{tema} ({', '.join(detalle)})")
+    encabezado = ("Encontré esta resolución de la Junta de Planificación:" if len(rows) == 1
+                  else f"Encontré {total} resoluciones de la Junta de Planificación:")
+    if total > len(rows):
+        encabezado += f"\n(Mostrando las primeras {len(rows)} de {total}; precise el tema o el número para acotar.)"
+    citas = list(dict.fromkeys(f"TOMO {r['tomo']}, Resoluciones ({r['fuente']})" for r in rows))
+    return {
+        'respuesta': encabezado + "\n\n" + "\n".join(lineas),
+        'sistema_usado': 'consulta_resoluciones',
+        'confianza': 0.9,
+        'citas': citas,
+        'contexto_chars': 0,
+        'metadata_adicional': {'filas': len(rows), 'total': total}
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data_dir", default=RESPUESTAS_DIR)
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args()
+    print("Resoluciones:", ingest_resoluciones(args.data_dir, args.db))
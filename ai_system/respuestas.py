@@ -0,0 +1,338 @@
+"""ai_system.respuestas
+
+Nivel de respuestas curadas a partir de los archivos `Respuestas_Tomo_N.txt`.
+
+- Ingesta: cada archivo se divide en unidades pregunta/respuesta (`N. ¿...?`
+  o `**N. TÍTULO:**`), que se guardan en `respuestas_qa` con un índice FTS5
+  (`respuestas_qa_fts`). Los embeddings se calculan fuera de la ruta de los
+  requests: `python -m ai_system.respuestas --embed` (una llamada a Azure por
+  unidad) los guarda en la tabla y todos los workers los leen de ahí.
+- Consulta: la pregunta del usuario se compara léxica y semánticamente contra
+  esas unidades; si la mejor supera `RESPUESTAS_MIN_CONFIANZA` se responde
+  directamente con su cita, sin pasar por el LLM.
+"""
+from typing import List, Dict, Optional, Callable
+import argparse
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+from .db import get_conn
+from .config import DB_PATH, RESPUESTAS_DIR, RESPUESTAS_MIN_CONFIANZA
+from .chunker import find_tomo_files
+
+logger = logging.getLogger(__name__)
+
+_BOLD_HEADER_RE = re.compile(r"^\s*\*\*\s*(\d{1,2})\.\s*(.+?)\s*:?\s*\*\*\s*:?\s*$")
+_NUMBERED_RE = re.compile(r"^\s*(\d{1,2})\.\s+(.+)$")
+_NOISE_RE = re.compile(r"^\s*🔍\s*Fragmento\s+\d+\s*:?\s*$")
+_QUERY_TOMO_RE = re.compile(r"tomo\s+(\d{1,2})\b", re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-z0-9ñ\-]+")
+
+_STOPWORDS = {
+    'que', 'cual', 'cuales', 'como', 'cuando', 'donde', 'quien', 'para', 'por', 'con', 'sin',
+    'los', 'las', 'del', 'una', 'uno', 'unos', 'unas', 'este', 'esta', 'estos', 'estas', 'ese',
+    'esa', 'son', 'hay', 'tiene', 'tienen', 'puede', 'pueden', 'sobre', 'entre', 'segun', 'mas',
+    'muy', 'sus', 'les', 'nos', 'me', 'mi', 'se', 'es', 'el', 'la', 'lo', 'de', 'en', 'y', 'o',
+    'un', 'al', 'a', 'su', 'si', 'no', 'tomo', 'reglamento', 'favor', 'explica', 'dime',
+}
+
+# Tipo de función de embedding compatible con HybridRetriever.embed: texto -> array (1, d) normalizado
+EmbedFn = Callable[[str], np.ndarray]
+
+# Términos de la pregunta curada que deben coincidir para responder sin LLM: con uno
+# solo, "¿Qué es un distrito?" respondía una unidad cualquiera que mencionara distritos
+MIN_TERMINOS_COMUNES = 2
+
+_cache = None
+_cache_lock = threading.RLock()
+
+
+def _strip_accents(text: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
+
+
+def _terms(text: str) -> set:
+    out = set()
+    for w in _WORD_RE.findall(_strip_accents((text or '').lower())):
+        if len(w) < 3 or w in _STOPWORDS:
+            continue
+        # plural -> singular aproximado ("parámetros" ~ "parámetro")
+        if len(w) > 4 and w.endswith('es') and not w.endswith('nes'):
+            w = w[:-2]
+        elif len(w) > 4 and w.endswith('s'):
+            w = w[:-1]
+        out.add(w)
+    return out
+
+
+def parse_respuestas(text: str) -> List[Dict]:
+    """Dividir un archivo de respuestas en unidades {numero, pregunta, respuesta}.
+
+    Los archivos usan encabezados en negrita (`**1. TÍTULO:**`) o preguntas
+    numeradas (`1. ¿...?`). Si hay encabezados en negrita, las listas numeradas
+    quedan dentro de la respuesta. Un archivo sin numeración es una sola unidad.
+    """
+    lines = [l for l in (text or '').splitlines() if not _NOISE_RE.match(l)]
+    bold = any(_BOLD_HEADER_RE.match(l) for l in lines)
+    header_re = _BOLD_HEADER_RE if bold else _NUMBERED_RE
+
+    units = []
+    preamble = []
+    current = None
+    for line in lines:
+        m = header_re.match(line)
+        if m:
+            current = {'numero': int(m.group(1)), 'pregunta': ' '.join(m.group(2).split()).strip(' :*'),
+                       'lineas': []}
+            units.append(current)
+        elif current is not None:
+            current['lineas'].append(line.rstrip())
+        else:
+            preamble.append(line.strip())
+
+    if not units:
+        titulo = next((l for l in preamble if l), '')
+        cuerpo = '\n'.join(l for l in preamble[preamble.index(titulo) + 1:]).strip() if titulo else ''
+        return [{'numero': 1, 'pregunta': titulo, 'respuesta': cuerpo}] if cuerpo else []
+
+    out = []
+    for u in units:
+        respuesta = '\n'.join(u['lineas']).strip()
+        if u['pregunta'] and respuesta:
+            out.append({'numero': u['numero'], 'pregunta': u['pregunta'], 'respuesta': respuesta})
+    return out
+
+
+def ensure_respuestas_tables(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS respuestas_qa(
+            id INTEGER PRIMARY KEY,
+            tomo INTEGER NOT NULL,
+            numero INTEGER,
+            pregunta TEXT NOT NULL,
+            respuesta TEXT NOT NULL,
+            fuente TEXT,
+            embedding BLOB
+        )
+    """)
+    con.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS respuestas_qa_fts USING fts5(
+            pregunta, respuesta,
+            content='respuestas_qa', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+
+
+def ingest_respuestas(data_dir: str = RESPUESTAS_DIR, db_path: str = DB_PATH,
+                      embed_fn: Optional[EmbedFn] = None) -> Dict:
+    """Parsear todos los `Respuestas_Tomo_N.txt` y reconstruir `respuestas_qa`.
+
+    Retorna un resumen: {'files': n, 'units': m, 'embedded': k}
+    """
+    global _cache
+    records = []
+    files = find_tomo_files(data_dir, 'Respuestas')
+    for tomo, path in files:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for u in parse_respuestas(f.read()):
+                records.append([tomo, u['numero'], u['pregunta'], u['respuesta'], os.path.basename(path), None])
+
+    embedded = 0
+    if embed_fn is not None:
+        for r in records:
+            try:
+                r[5] = _embed_unit(embed_fn, r[2], r[3])
+                embedded += 1
+            except Exception as e:
+                logger.warning(f"⚠️ Embedding no disponible para respuestas curadas: {e}")
+                break
+
+    with get_conn(db_path) as con:
+        ensure_respuestas_tables(con)
+        con.execute("DELETE FROM respuestas_qa")
+        con.executemany("""INSERT INTO respuestas_qa(tomo, numero, pregunta, respuesta, fuente, embedding)
+                           VALUES (?,?,?,?,?,?)""", records)
+        con.execute("INSERT INTO respuestas_qa_fts(respuestas_qa_fts) VALUES('rebuild')")
+
+    with _cache_lock:
+        _cache = None
+    logger.info(f"✅ Respuestas curadas ingeridas: {len(records)} unidades desde {len(files)} archivos "
+                f"({embedded} con embedding)")
+    return {'files': len(files), 'units': len(records), 'embedded': embedded}
+
+
+def _embed_unit(embed_fn: EmbedFn, pregunta: str, respuesta: str) -> bytes:
+    v = np.asarray(embed_fn(f"{pregunta}\n{respuesta[:1000]}"), dtype='float32').reshape(-1)
+    return v.tobytes()
+
+
+def embed_pending(embed_fn: EmbedFn, db_path: str = DB_PATH) -> int:
+    """Calcular los embeddings que faltan en `respuestas_qa` (uso offline); retorna cuántos se guardaron."""
+    global _cache
+    with get_conn(db_path) as con:
+        ensure_respuestas_tables(con)
+        rows = con.execute("SELECT id, pregunta, respuesta FROM respuestas_qa WHERE embedding IS NULL").fetchall()
+    done = []
+    for row in rows:
+        try:
+            done.append((_embed_unit(embed_fn, row['pregunta'], row['respuesta']), row['id']))
+        except Exception as e:
+            logger.warning(f"⚠️ Embedding no disponible para respuestas curadas: {e}")
+            break
+    if done:
+        with get_conn(db_path) as con:
+            con.executemany("UPDATE respuestas_qa SET embedding = ? WHERE id = ?", done)
+        with _cache_lock:
+            _cache = None
+    logger.info(f"✅ Embeddings de respuestas curadas: {len(done)} de {len(rows)} pendientes")
+    return len(done)
+
+
+def _load_cache(db_path: str = DB_PATH) -> Dict:
+    """Unidades, términos y matriz de embeddings en memoria (sin llamadas de red)."""
+    global _cache
+    if _cache is not None:
+        return _cache
+    with _cache_lock:
+        if _cache is not None:
+            return _cache
+        cache = {'units': [], 'terms': [], 'matrix': None}
+        try:
+            with get_conn(db_path) as con:
+                ensure_respuestas_tables(con)
+                count = con.execute("SELECT COUNT(*) FROM respuestas_qa").fetchone()[0]
+            if count == 0:
+                # Primera ejecución: solo el parseo de los archivos; embeddings con --embed
+                ingest_respuestas(db_path=db_path)
+            with get_conn(db_path) as con:
+                rows = con.execute("SELECT * FROM respuestas_qa ORDER BY id").fetchall()
+            vectors = []
+            for row in rows:
+                cache['units'].append({k: row[k] for k in ('id', 'tomo', 'numero', 'pregunta', 'respuesta', 'fuente')})
+                cache['terms'].append((_terms(row['pregunta']), _terms(row['respuesta'])))
+                if row['embedding'] is not None:
+                    vectors.append(np.frombuffer(row['embedding'], dtype='float32'))
+            if vectors and len(vectors) == len(rows):
+                cache['matrix'] = np.vstack(vectors)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron cargar las respuestas curadas: {e}")
+        _cache = cache
+        return _cache
+
+
+def preload(db_path: str = DB_PATH) -> int:
+    """Cargar la caché en memoria (p. ej. en el maestro antes del fork); retorna las unidades."""
+    return len(_load_cache(db_path)['units'])
+
+
+def _fts_candidates(query_terms: set, db_path: str, limit: int = 20) -> List[int]:
+    if not query_terms:
+        return []
+    match = ' OR '.join(f'"{t}"*' for t in sorted(query_terms))
+    try:
+        with get_conn(db_path) as con:
+            rows = con.execute("""SELECT rowid FROM respuestas_qa_fts WHERE respuestas_qa_fts MATCH ?
+                                  ORDER BY bm25(respuestas_qa_fts, 4.0, 1.0) LIMIT ?""", (match, limit)).fetchall()
+        return [r[0] for r in rows]
+    except Exception as e:
+        logger.warning(f"⚠️ Error en búsqueda FTS de respuestas curadas: {e}")
+        return []
+
+
+def search_respuestas(query: str, k: int = 3, db_path: str = DB_PATH,
+                      embed_fn: Optional[EmbedFn] = None) -> List[Dict]:
+    """Unidades curadas más parecidas a `query`, con su puntuación en [0, 1].
+
+    - léxica: coeficiente de Dice entre los términos de la consulta y los de la
+      pregunta curada (simétrico: una consulta de un término no cubre una
+      pregunta de seis), con un aporte menor (0.2) de la cobertura en la
+      respuesta; exige al menos `MIN_TERMINOS_COMUNES` términos en común
+    - semántica: coseno con el embedding de la unidad, si está precalculado
+      (`embed_fn` solo se usa para el vector de la consulta)
+    La puntuación final es la mayor de ambas.
+    """
+    cache = _load_cache(db_path)
+    units = cache['units']
+    if not units:
+        return []
+    q_terms = _terms(query)
+    tomo = _QUERY_TOMO_RE.search(query or '')
+    tomo = int(tomo.group(1)) if tomo else None
+
+    scores = {}
+    by_id = {u['id']: i for i, u in enumerate(units)}
+    if q_terms:
+        for uid in _fts_candidates(q_terms, db_path):
+            i = by_id.get(uid)
+            if i is None:
+                continue
+            p_terms, r_terms = cache['terms'][i]
+            comunes = len(q_terms & p_terms)
+            if comunes < MIN_TERMINOS_COMUNES:
+                continue
+            dice_p = 2 * comunes / (len(q_terms) + len(p_terms))
+            cov_r = len(q_terms & r_terms) / len(q_terms)
+            scores[i] = max(dice_p, 0.8 * dice_p + 0.2 * cov_r)
+
+    if embed_fn is not None and cache['matrix'] is not None:
+        try:
+            qv = np.asarray(embed_fn(query), dtype='float32').reshape(-1)
+            if qv.shape[0] == cache['matrix'].shape[1]:
+                sims = cache['matrix'] @ qv
+                for i in np.argsort(-sims)[:k * 4]:
+                    scores[int(i)] = max(scores.get(int(i), 0.0), float(sims[i]))
+        except Exception as e:
+            logger.warning(f"⚠️ Búsqueda semántica de respuestas curadas no disponible: {e}")
+
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    out = []
+    for i, score in ranked:
+        if tomo is not None and units[i]['tomo'] != tomo:
+            continue
+        out.append({**units[i], 'score': round(score, 4)})
+        if len(out) >= k:
+            break
+    return out
+
+
+def responder_respuesta_curada(mensaje: str, embed_fn: Optional[EmbedFn] = None,
+                               min_confianza: float = RESPUESTAS_MIN_CONFIANZA) -> Optional[Dict]:
+    """Responder desde el nivel curado si la mejor unidad supera el umbral.
+
+    Retorna un dict con el formato de resultado del pipeline de chat o None
+    (el llamador continúa con el flujo normal).
+    """
+    hits = search_respuestas(mensaje, k=1, embed_fn=embed_fn)
+    if not hits or hits[0]['score'] < min_confianza:
+        return None
+    hit = hits[0]
+    return {
+        'respuesta': f"**{hit['pregunta']}**\n\n{hit['respuesta']}",
+        'sistema_usado': 'respuesta_curada',
+        'confianza': hit['score'],
+        'citas': [f"TOMO {hit['tomo']}, Respuestas curadas #{hit['numero']} ({hit['fuente']})"],
+        'contexto_chars': len(hit['respuesta']),
+        'metadata_adicional': {'respuesta_id': hit['id']}
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data_dir", default=RESPUESTAS_DIR)
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--embed", action="store_true",
+                    help="Calcular los embeddings pendientes con Azure OpenAI (HybridRetriever.embed)")
+    args = ap.parse_args()
+    print("Respuestas curadas:", ingest_respuestas(args.data_dir, args.db))
+    if args.embed:
+        from .retrieve import HybridRetriever
+        retriever = HybridRetriever(db_path=args.db)
+        if retriever.embedding_client is None:
+            raise SystemExit("Sin servicio de embeddings configurado")
+        print("Embeddings:", embed_pending(retriever.embed, args.db))
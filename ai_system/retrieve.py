@@ -1,11 +1,74 @@
-import os, json, numpy as np, faiss
+import os, re, json, threading, unicodedata, numpy as np, faiss
 from typing import List, Dict
 from openai import AzureOpenAI, OpenAI
 from .config import (
     AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_KEY, AZURE_OPENAI_API_VERSION,
-    AZURE_OPENAI_EMBEDDING_DEPLOYMENT, DB_PATH, FAISS_PATH
+    AZURE_OPENAI_EMBEDDING_DEPLOYMENT, DB_PATH, FAISS_PATH,
+    FACTS_K, FACT_WEIGHT, CORRECTION_BOOST, FACT_TYPES, FACT_MIN_TERMS, FACT_MAX_SLOTS
 )
 from .db import get_conn, fts_search
+from .schema import get_capabilities
+
+try:
+    from core.tracing import span
+except ImportError:  # ai_system usado sin el paquete core
+    from contextlib import nullcontext
+
+    def span(name, **attrs):
+        return nullcontext()
+
+# Constante de Reciprocal Rank Fusion (valor habitual de la literatura)
+RRF_K = 60
+
+_TERM_RE = re.compile(r"[a-z0-9ñ]{3,}")
+_STOPWORDS = {'que', 'cual', 'cuales', 'como', 'cuando', 'donde', 'para', 'por', 'los', 'las',
+                   'del', 'una', 'uno', 'unos', 'unas', 'con', 'sobre', 'este', 'esta', 'hay', 'son'}
+
+
+def _query_terms(text: str) -> List[str]:
+    """Términos sin acentos ni stopwords, sin repetir, en orden de aparición."""
+    text = ''.join(c for c in unicodedata.normalize('NFD', (text or '').lower())
+                   if unicodedata.category(c) != 'Mn')
+    return list(dict.fromkeys(w for w in _TERM_RE.findall(text) if w not in _STOPWORDS))
+
+
+def _match_query(query: str) -> str:
+    """Expresión MATCH segura para FTS5: términos sin acentos unidos con OR.
+
+    El texto crudo de una pregunta ("¿Qué es...?") no es una expresión MATCH
+    válida y FTS5 lo rechaza con un error de sintaxis.
+    """
+    return ' OR '.join(f'"{t}"*' for t in _query_terms(query))
+
+
+def _fact_overlap(query_terms: List[str], content: str) -> int:
+    """Términos de la consulta presentes en `content` (como prefijo, igual que el MATCH)."""
+    words = _query_terms(content)
+    return sum(1 for q in query_terms if any(w.startswith(q) for w in words))
+
+# Índices FAISS y metadatos de solo lectura, leídos una vez por proceso. Bajo gunicorn
+# se cargan en el maestro antes del fork (wsgi.py) y los workers los comparten
+# copy-on-write; cada worker crea sus propios clientes Azure OpenAI.
+_shared_indexes: Dict[str, tuple] = {}
+_shared_lock = threading.Lock()
+
+
+def load_shared_index(faiss_path: str = FAISS_PATH) -> tuple:
+    """(index, metas) de `faiss_path`, compartidos por todos los HybridRetriever del proceso."""
+    with _shared_lock:
+        if faiss_path not in _shared_indexes:
+            index = faiss.read_index(faiss_path)
+            metas_path = os.path.join(os.path.dirname(faiss_path), "metas.jsonl")
+            try:
+                metas = [json.loads(l) for l in open(metas_path, "r", encoding="utf-8")]
+            except FileNotFoundError:
+                # Si no existe metas.jsonl, crear lista vacía y advertir
+                print(f"⚠️ Advertencia: {metas_path} no encontrado, usando metadatos vacíos")
+                metas = []
+            print(f"✅ Índice FAISS cargado exitosamente desde {faiss_path}")
+            _shared_indexes[faiss_path] = (index, metas)
+        return _shared_indexes[faiss_path]
+
 
 class HybridRetriever:
     def __init__(self, db_path=DB_PATH, faiss_path=FAISS_PATH):
@@ -44,15 +107,7 @@ class HybridRetriever:
         
         if self.embedding_client is not None:
             try:
-                self.index = faiss.read_index(self.faiss_path)
-                metas_path = os.path.join(os.path.dirname(self.faiss_path), "metas.jsonl")
-                try:
-                    self.metas = [json.loads(l) for l in open(metas_path, "r", encoding="utf-8")]
-                except FileNotFoundError:
-                    # Si no existe metas.jsonl, crear lista vacía y advertir
-                    print(f"⚠️ Advertencia: {metas_path} no encontrado, usando metadatos vacíos")
-                    self.metas = []
-                print(f"✅ Índice FAISS cargado exitosamente desde {self.faiss_path}")
+                self.index, self.metas = load_shared_index(self.faiss_path)
             except Exception as e:
                 print(f"⚠️ Error cargando índice FAISS: {e}")
                 print("⚠️ Continuando sin embeddings - usando solo búsqueda textual")
@@ -80,8 +135,10 @@ class HybridRetriever:
             print("⚠️ Búsqueda vectorial no disponible, usando solo búsqueda textual")
             return []
         
-        qv = self.embed(query)
-        D, I = self.index.search(qv, k)
+        with span('embed'):
+            qv = self.embed(query)
+        with span('faiss_search', k=k):
+            D, I = self.index.search(qv, k)
         out = []
         for score, i in zip(D[0], I[0]):
             if i == -1: continue
@@ -91,9 +148,11 @@ class HybridRetriever:
         return out
 
     def search_lexical(self, query: str, k=12) -> List[Dict]:
-        # Usa FTS5 con query literal; permite "permiso NEAR/3 construcción"
+        match = _match_query(query)
+        if not match:
+            return []
         with get_conn(self.db_path) as con:
-            rows = fts_search(con, query, limit=k)
+            rows = fts_search(con, match, limit=k)
         # Adaptado para nueva estructura de BD
         return [{"score": 0.0, 
                 "chunk_id": r.get("rowid", "unknown"), 
@@ -104,6 +163,42 @@ class HybridRetriever:
                 "text": r.get("text", ""), 
                 "snippet": r["snip"]} for r in rows]
 
+    def search_facts(self, query: str, k=FACTS_K) -> List[Dict]:
+        """Facts aprendidos (knowledge_facts) vía fts_facts, ordenados por bm25.
+
+        Los triggers de la migración 8 indexan cada fact al insertarse, así que
+        las correcciones de /learn son buscables sin reconstruir nada. Solo
+        entran los tipos de FACT_TYPES y los facts que comparten al menos
+        FACT_MIN_TERMS términos con la consulta: el MATCH es un OR y por sí
+        solo deja pasar un fact que coincide en una sola palabra ("permiso").
+        """
+        if k <= 0 or not FACT_TYPES or not get_capabilities(self.db_path).has_table('fts_facts'):
+            return []
+        terms = _query_terms(query)
+        if not terms:
+            return []
+        min_terms = min(FACT_MIN_TERMS, len(terms))
+        try:
+            with get_conn(self.db_path) as con:
+                rows = con.execute(f"""SELECT kf.id, kf.content, kf.citation, kf.type
+                                       FROM fts_facts f JOIN knowledge_facts kf ON kf.rowid = f.rowid
+                                       WHERE fts_facts MATCH ? AND kf.type IN ({",".join("?" * len(FACT_TYPES))})
+                                       ORDER BY bm25(fts_facts) LIMIT ?""",
+                                   (_match_query(query), *FACT_TYPES, k * 4)).fetchall()
+        except Exception as e:
+            print(f"⚠️ Error en búsqueda de facts: {e}")
+            return []
+        rows = [r for r in rows if _fact_overlap(terms, r[1]) >= min_terms][:k]
+        return [{"score": 0.0,
+                 "chunk_id": f"fact:{r[0]}",
+                 "doc_id": "knowledge_facts",
+                 "heading_path": r[2] or "",
+                 "page_start": None,
+                 "page_end": None,
+                 "text": r[1] or "",
+                 "type": r[3],
+                 "source": "knowledge_facts"} for r in rows]
+
     def fetch_texts(self, chunk_ids: List[str]) -> Dict[str, str]:
         # Recupera texto desde FTS por rowid (adaptado para nueva estructura)
         with get_conn(self.db_path) as con:
@@ -112,20 +207,67 @@ class HybridRetriever:
             cur = con.execute(f"SELECT rowid, chunk_text FROM fts_chunks WHERE rowid IN ({qmarks})", chunk_ids)
             return {str(r[0]): r[1] for r in cur.fetchall()}
 
-    def hybrid(self, query: str, k_vec=12, k_lex=12, final_k=6) -> List[Dict]:
-        vec = self.search_vectors(query, k=k_vec)
-        lex = self.search_lexical(query, k=k_lex)
-        # Fusión simple: favorece diversidad por chunk_id
-        seen, fused = set(), []
-        for cand in vec + lex:
-            cid = cand["chunk_id"]
-            if cid in seen: continue
-            seen.add(cid)
-            fused.append(cand)
-            if len(fused) >= (k_vec//2 + k_lex//2):
-                break
-        # Traer textos
-        texts = self.fetch_texts([c["chunk_id"] for c in fused[:final_k]])
+    def hybrid(self, query: str, k_vec=12, k_lex=12, final_k=6, weights=None, k_facts=FACTS_K) -> List[Dict]:
+        with span('search_vectors', k=k_vec) as sp:
+            vec = self.search_vectors(query, k=k_vec)
+            if sp is not None:
+                sp['attrs']['hits'] = len(vec)
+        with span('search_lexical', k=k_lex) as sp:
+            lex = self.search_lexical(query, k=k_lex)
+            if sp is not None:
+                sp['attrs']['hits'] = len(lex)
+        if weights is not None:
+            fused = self.fuse_rrf(vec, lex, weights)
+        else:
+            # Fusión simple: favorece diversidad por chunk_id
+            seen, fused = set(), []
+            for cand in vec + lex:
+                cid = cand["chunk_id"]
+                if cid in seen: continue
+                seen.add(cid)
+                fused.append(cand)
+                if len(fused) >= (k_vec//2 + k_lex//2):
+                    break
+        with span('search_facts', k=k_facts) as sp:
+            facts = self.search_facts(query, k=k_facts)
+            if sp is not None:
+                sp['attrs']['hits'] = len(facts)
+        if facts:
+            fused = self.merge_facts(fused, facts[:FACT_MAX_SLOTS])
+        # Traer textos (los facts ya traen el suyo)
+        chunk_ids = [c["chunk_id"] for c in fused[:final_k] if c.get("source") != "knowledge_facts"]
+        with span('fetch_texts', n=len(chunk_ids)):
+            texts = self.fetch_texts(chunk_ids) if chunk_ids else {}
         for c in fused:
-            c["text"] = texts.get(c["chunk_id"], "")
+            if c.get("source") != "knowledge_facts":
+                # fetch_texts indexa por str(rowid); los ids léxicos llegan como int
+                c["text"] = texts.get(str(c["chunk_id"]), c.get("text", ""))
         return fused[:final_k]
+
+    @staticmethod
+    def merge_facts(fused: List[Dict], facts: List[Dict]) -> List[Dict]:
+        """Intercalar facts con los chunks ya fusionados por score RRF implícito.
+
+        Un chunk en la posición i vale 1/(RRF_K + i); un fact en el rango r vale
+        FACT_WEIGHT/(RRF_K + r), multiplicado por CORRECTION_BOOST si es una
+        corrección. A igual score gana el chunk. `hybrid` pasa a lo sumo
+        FACT_MAX_SLOTS facts, así que el resto del contexto son chunks.
+        """
+        scored = [(1.0 / (RRF_K + i), 0, i, c) for i, c in enumerate(fused, 1)]
+        for rank, f in enumerate(facts, 1):
+            boost = CORRECTION_BOOST if f.get("type") == "correction" else 1.0
+            scored.append((FACT_WEIGHT * boost / (RRF_K + rank), 1, rank, f))
+        scored.sort(key=lambda s: (-s[0], s[1], s[2]))
+        return [s[3] for s in scored]
+
+    @staticmethod
+    def fuse_rrf(vec: List[Dict], lex: List[Dict], weights=(1.0, 1.0)) -> List[Dict]:
+        """Reciprocal Rank Fusion ponderada: score = Σ w / (RRF_K + rango)."""
+        w_vec, w_lex = weights
+        scores, cands = {}, {}
+        for w, results in ((w_vec, vec), (w_lex, lex)):
+            for rank, cand in enumerate(results, 1):
+                cid = cand["chunk_id"]
+                scores[cid] = scores.get(cid, 0.0) + w / (RRF_K + rank)
+                cands.setdefault(cid, cand)
+        return [cands[cid] for cid in sorted(scores, key=lambda c: scores[c], reverse=True)]
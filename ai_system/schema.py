@@ -0,0 +1,573 @@
+"""ai_system.schema
+
+Registro único del esquema SQLite y migraciones versionadas.
+
+Antes, cuatro sitios (`inicializar_base_datos`, `init_hybrid_knowledge_db`,
+`init_hybrid_db.py` y `database/init_db.sql`) creaban las mismas tablas con
+formas distintas (p. ej. `conversation_messages.id` INTEGER o TEXT). Aquí cada
+tabla se define una sola vez y todas las bases (conversaciones y conocimiento,
+que pueden ser el mismo archivo) se llevan al mismo esquema al arrancar.
+
+La versión aplicada se guarda en `PRAGMA user_version`. Tras migrar, las
+tablas y columnas de cada base se leen una vez y quedan en memoria
+(`get_capabilities`), de modo que la ruta de respuesta no vuelve a consultar
+`PRAGMA table_info` ni `sqlite_master`.
+"""
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+
+from .config import DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# Definición canónica de cada tabla compartida
+TABLES: Dict[str, str] = {
+    # --- conocimiento (antes database/init_db.sql) ---
+    'knowledge_facts': """
+        CREATE TABLE IF NOT EXISTS knowledge_facts(
+            id TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            citation TEXT NOT NULL,
+            type TEXT,
+            tags TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    'faqs': """
+        CREATE TABLE IF NOT EXISTS faqs(
+            id TEXT PRIMARY KEY,
+            query_normalized TEXT UNIQUE,
+            answer TEXT NOT NULL,
+            citations TEXT,
+            usage_count INTEGER DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    'chunks_meta': """
+        CREATE TABLE IF NOT EXISTS chunks_meta(
+            chunk_id TEXT PRIMARY KEY,
+            doc_id TEXT,
+            page_start INTEGER,
+            page_end INTEGER,
+            heading_path TEXT,
+            hash TEXT
+        )
+    """,
+    'fts_chunks': """
+        CREATE VIRTUAL TABLE IF NOT EXISTS fts_chunks USING fts5(
+            chunk_text, chunk_id UNINDEXED, doc_id UNINDEXED, heading_path UNINDEXED,
+            page_start UNINDEXED, page_end UNINDEXED
+        )
+    """,
+    'query_logs': """
+        CREATE TABLE IF NOT EXISTS query_logs(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            query TEXT,
+            retrieved_ids TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    # --- conversaciones y analytics ---
+    'conversaciones': """
+        CREATE TABLE IF NOT EXISTS conversaciones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            usuario TEXT,
+            consulta TEXT NOT NULL,
+            respuesta TEXT NOT NULL,
+            sistema_usado TEXT,
+            confianza REAL,
+            tiempo_procesamiento REAL,
+            ip_usuario TEXT,
+            user_agent TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    'metricas_rendimiento': """
+        CREATE TABLE IF NOT EXISTS metricas_rendimiento (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            consulta_length INTEGER,
+            respuesta_length INTEGER,
+            sistema_usado TEXT,
+            confianza REAL,
+            tiempo_procesamiento REAL,
+            ip TEXT,
+            user_agent TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    'aprendizaje_sistema': """
+        CREATE TABLE IF NOT EXISTS aprendizaje_sistema (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pregunta TEXT,
+            respuesta TEXT,
+            citations TEXT,
+            fact_type TEXT,
+            patron_consulta TEXT,
+            respuesta_generada TEXT,
+            efectividad REAL,
+            feedback_usuario TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    'audit_log': """
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            user_id TEXT,
+            action TEXT,
+            details TEXT
+        )
+    """,
+    'user_consent': """
+        CREATE TABLE IF NOT EXISTS user_consent (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT UNIQUE,
+            consent_given BOOLEAN DEFAULT 0,
+            consent_timestamp DATETIME,
+            ip_address TEXT,
+            user_agent TEXT
+        )
+    """,
+    # --- aprendizaje híbrido (log_conversation_* / log_performance_metric) ---
+    'conversations': """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            specialist_type TEXT,
+            session_id TEXT,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            ended_at DATETIME,
+            status TEXT DEFAULT 'active'
+        )
+    """,
+    'conversation_messages': """
+        CREATE TABLE IF NOT EXISTS conversation_messages (
+            id TEXT PRIMARY KEY,
+            conversation_id TEXT,
+            role TEXT,
+            content TEXT,
+            specialist_context TEXT,
+            processing_time REAL,
+            confidence_score REAL,
+            sources_used TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    'performance_metrics': """
+        CREATE TABLE IF NOT EXISTS performance_metrics (
+            id TEXT PRIMARY KEY,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            metric_type TEXT,
+            metric_value REAL,
+            specialist_area TEXT,
+            context_data TEXT
+        )
+    """,
+    # --- observabilidad (core/metrics.py) ---
+    'metrics_rollup': """
+        CREATE TABLE IF NOT EXISTS metrics_rollup (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period_start TEXT,
+            period_end TEXT,
+            metric TEXT,
+            labels TEXT,
+            count INTEGER,
+            sum REAL,
+            p50 REAL,
+            p95 REAL,
+            p99 REAL,
+            max REAL
+        )
+    """,
+    # Índice FTS de knowledge_facts (external content). Los triggers de
+    # FACT_TRIGGERS lo mantienen al día en cada INSERT/UPDATE/DELETE; por eso
+    # las escrituras usan UPSERT y no INSERT OR REPLACE (el borrado implícito
+    # de REPLACE no dispara triggers).
+    'fts_facts': """
+        CREATE VIRTUAL TABLE IF NOT EXISTS fts_facts USING fts5(
+            content, citation, type UNINDEXED,
+            content='knowledge_facts', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """,
+    # --- ingesta de conversaciones (ai_system/learn.py) ---
+    'processed_conversations': """
+        CREATE TABLE IF NOT EXISTS processed_conversations (
+            source TEXT,
+            source_rowid INTEGER,
+            processed_at DATETIME,
+            content_hash TEXT,
+            UNIQUE(source, source_rowid)
+        )
+    """,
+    # --- retención (ai_system/privacy.py) ---
+    # Posición del último lote aplicado; se borra al terminar una pasada completa
+    'retention_checkpoints': """
+        CREATE TABLE IF NOT EXISTS retention_checkpoints (
+            job TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            cutoff TEXT NOT NULL,
+            last_rowid INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (job, table_name)
+        )
+    """,
+    # --- patrones por usuario (ai_system/memory.py) ---
+    # weight es log2 del peso referido a una época fija (ver
+    # memory.TERM_STATS_EPOCH): el decaimiento es igual para todos los
+    # términos y no altera el orden.
+    'user_term_stats': """
+        CREATE TABLE IF NOT EXISTS user_term_stats (
+            usuario TEXT NOT NULL,
+            term TEXT NOT NULL,
+            weight REAL NOT NULL DEFAULT 0,
+            last_seen REAL,
+            PRIMARY KEY (usuario, term)
+        )
+    """,
+}
+
+FACT_TRIGGERS: List[str] = [
+    """CREATE TRIGGER IF NOT EXISTS knowledge_facts_ai AFTER INSERT ON knowledge_facts BEGIN
+           INSERT INTO fts_facts(rowid, content, citation, type) VALUES (new.rowid, new.content, new.citation, new.type);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS knowledge_facts_ad AFTER DELETE ON knowledge_facts BEGIN
+           INSERT INTO fts_facts(fts_facts, rowid, content, citation, type)
+           VALUES ('delete', old.rowid, old.content, old.citation, old.type);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS knowledge_facts_au AFTER UPDATE ON knowledge_facts BEGIN
+           INSERT INTO fts_facts(fts_facts, rowid, content, citation, type)
+           VALUES ('delete', old.rowid, old.content, old.citation, old.type);
+           INSERT INTO fts_facts(rowid, content, citation, type) VALUES (new.rowid, new.content, new.citation, new.type);
+       END""",
+]
+
+INDEXES: List[str] = [
+    "CREATE INDEX IF NOT EXISTS idx_conversaciones_timestamp ON conversaciones(timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_conversaciones_usuario_ts ON conversaciones(usuario, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_metricas_timestamp ON metricas_rendimiento(timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_conversations_session ON conversations(session_id)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_conversation ON conversation_messages(conversation_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_metrics_timestamp ON performance_metrics(timestamp)",
+]
+
+
+# ------------------------------------------------------------------ helpers
+_TABLE_CONSTRAINTS = {'PRIMARY', 'UNIQUE', 'CHECK', 'FOREIGN', 'CONSTRAINT'}
+
+
+def _table_columns(con, table: str) -> Dict[str, str]:
+    """{columna: tipo declarado} de `table` (vacío si no existe)."""
+    return {r[1]: (r[2] or '').upper() for r in con.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _ddl_columns(table: str) -> List[Tuple[str, str]]:
+    """[(columna, tipo)] de la definición canónica de `table`."""
+    ddl = TABLES[table]
+    body = ddl[ddl.index('(') + 1:ddl.rindex(')')]
+    # Separar por comas de primer nivel: UNIQUE(a, b) es una sola parte
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(body):
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            parts.append(body[start:i])
+            start = i + 1
+    parts.append(body[start:])
+    out = []
+    for part in parts:
+        tokens = part.split()
+        if not tokens or tokens[0].upper().split('(')[0] in _TABLE_CONSTRAINTS:
+            continue
+        out.append((tokens[0], tokens[1] if len(tokens) > 1 and tokens[1].isalpha() and tokens[1] != 'UNINDEXED' else ''))
+    return out
+
+
+def _rebuild(con, table: str, exprs: Optional[Dict[str, str]] = None):
+    """Recrear `table` con la forma canónica copiando las filas existentes.
+
+    Las columnas con el mismo nombre se copian tal cual; `exprs` define
+    expresiones SQL (sobre la tabla vieja) para las que cambian de nombre o tipo.
+    Las columnas viejas sin equivalente canónico se descartan.
+    """
+    exprs = exprs or {}
+    old_cols = _table_columns(con, table)
+    legacy = f"{table}__legacy"
+    con.execute(f"DROP TABLE IF EXISTS {legacy}")
+    con.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    con.execute(TABLES[table])
+    targets, sources = [], []
+    for col, _ in _ddl_columns(table):
+        if col in exprs:
+            targets.append(col)
+            sources.append(exprs[col])
+        elif col in old_cols:
+            targets.append(col)
+            sources.append(col)
+    if targets:
+        con.execute(f"INSERT INTO {table}({', '.join(targets)}) "
+                    f"SELECT {', '.join(sources)} FROM {legacy}")
+    con.execute(f"DROP TABLE {legacy}")
+    logger.info(f"🔧 Tabla {table} migrada a la forma canónica")
+
+
+def _add_missing_columns(con, table: str):
+    """Agregar (nullable) las columnas canónicas que falten en `table`."""
+    existing = _table_columns(con, table)
+    for col, type_ in _ddl_columns(table):
+        if col not in existing:
+            # ADD COLUMN no admite PRIMARY KEY/UNIQUE/NOT NULL sin default: solo nombre y tipo
+            con.execute(f"ALTER TABLE {table} ADD COLUMN {col} {type_}".rstrip())
+
+
+# --------------------------------------------------------------- migrations
+def _m001_tablas_base(con):
+    for name, ddl in TABLES.items():
+        if name not in _ADDED_LATER:
+            con.execute(ddl)
+
+
+def _m002_reconciliar_formas_legadas(con):
+    # conversaciones: init_simple_database usaba `pregunta` y timestamp opcional
+    cols = _table_columns(con, 'conversaciones')
+    if 'consulta' not in cols or 'respuesta' not in cols:
+        pregunta = 'pregunta' if 'pregunta' in cols else "''"
+        ts = 'timestamp' if 'timestamp' in cols else 'CURRENT_TIMESTAMP'
+        _rebuild(con, 'conversaciones', {
+            'consulta': f"COALESCE({pregunta}, '')",
+            'respuesta': "COALESCE(respuesta, '')" if 'respuesta' in cols else "''",
+            'timestamp': f"COALESCE({ts}, CURRENT_TIMESTAMP)",
+        })
+    else:
+        _add_missing_columns(con, 'conversaciones')
+
+    # conversation_messages: id INTEGER + `timestamp` (app.py) vs id TEXT + `created_at`
+    cols = _table_columns(con, 'conversation_messages')
+    if cols.get('id') != 'TEXT' or 'created_at' not in cols or 'specialist_context' not in cols:
+        exprs = {}
+        if cols.get('id') != 'TEXT':
+            exprs['id'] = "'msg_' || id"
+        if 'created_at' not in cols and 'timestamp' in cols:
+            exprs['created_at'] = 'timestamp'
+        _rebuild(con, 'conversation_messages', exprs)
+
+    # performance_metrics: la versión de app.py duplicaba metricas_rendimiento y
+    # nunca recibió escrituras; se conserva el id y la marca de tiempo
+    cols = _table_columns(con, 'performance_metrics')
+    if 'metric_type' not in cols or cols.get('id') != 'TEXT':
+        exprs = {'id': "'metric_' || id"} if cols.get('id') != 'TEXT' else {}
+        _rebuild(con, 'performance_metrics', exprs)
+
+    # knowledge_facts legacy (fact_text, id INTEGER)
+    cols = _table_columns(con, 'knowledge_facts')
+    if 'content' not in cols:
+        _rebuild(con, 'knowledge_facts', {
+            'id': "'fact_' || id" if cols.get('id') != 'TEXT' else 'id',
+            'content': "COALESCE(fact_text, '')" if 'fact_text' in cols else "''",
+            'citation': "COALESCE(citation, '')" if 'citation' in cols else "''",
+        })
+
+    # fts_chunks con columnas (id, content, ...) creada en conversaciones.db
+    cols = _table_columns(con, 'fts_chunks')
+    if 'chunk_text' not in cols:
+        _rebuild(con, 'fts_chunks', {
+            'chunk_text': 'content' if 'content' in cols else "''",
+            'chunk_id': 'id' if 'id' in cols else 'NULL',
+        })
+
+    for table in ('conversations', 'aprendizaje_sistema', 'metricas_rendimiento', 'faqs', 'chunks_meta'):
+        _add_missing_columns(con, table)
+
+
+def _m003_indices(con):
+    for ddl in INDEXES:
+        con.execute(ddl)
+
+
+def _m004_metrics_rollup(con):
+    con.execute(TABLES['metrics_rollup'])
+    con.execute("CREATE INDEX IF NOT EXISTS idx_metrics_rollup_metric ON metrics_rollup(metric, period_end)")
+
+
+def _m005_indice_memoria(con):
+    # Historial por usuario (ai_system.memory): el índice compuesto resuelve
+    # WHERE usuario = ? ORDER BY timestamp DESC sin ordenar; cubre también al
+    # índice de una columna sobre usuario.
+    con.execute("CREATE INDEX IF NOT EXISTS idx_conversaciones_usuario_ts ON conversaciones(usuario, timestamp)")
+    con.execute("DROP INDEX IF EXISTS idx_conversaciones_usuario")
+
+
+def _m006_user_term_stats(con):
+    from .memory import backfill_user_term_stats
+
+    con.execute(TABLES['user_term_stats'])
+    con.execute("CREATE INDEX IF NOT EXISTS idx_user_term_stats_weight ON user_term_stats(usuario, weight DESC)")
+    # Una sola pasada sobre el historial existente; después se actualiza al guardar
+    backfill_user_term_stats(con)
+
+
+def _m007_processed_conversations(con):
+    # ingest_conversations creaba la tabla por su cuenta, sin content_hash
+    con.execute(TABLES['processed_conversations'])
+    _add_missing_columns(con, 'processed_conversations')
+    con.execute("CREATE INDEX IF NOT EXISTS idx_processed_conversations_hash ON processed_conversations(content_hash)")
+
+
+def _m008_fts_facts(con):
+    con.execute(TABLES['fts_facts'])
+    for ddl in FACT_TRIGGERS:
+        con.execute(ddl)
+    # Indexar los facts existentes una vez; desde aquí los triggers lo mantienen
+    con.execute("INSERT INTO fts_facts(fts_facts) VALUES ('rebuild')")
+
+
+def _m009_retention_checkpoints(con):
+    con.execute(TABLES['retention_checkpoints'])
+
+
+def _m010_user_term_log_weights(con):
+    from .memory import backfill_user_term_stats
+
+    # Los pesos lineales desbordaban; se recalculan en log2 desde el historial
+    if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_term_stats'").fetchone():
+        backfill_user_term_stats(con)
+
+
+# Tablas creadas por migraciones posteriores a la 1
+_ADDED_LATER = {'metrics_rollup', 'user_term_stats', 'processed_conversations', 'fts_facts',
+                'retention_checkpoints'}
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, 'tablas base', _m001_tablas_base),
+    (2, 'reconciliar formas legadas', _m002_reconciliar_formas_legadas),
+    (3, 'índices', _m003_indices),
+    (4, 'rollup de métricas', _m004_metrics_rollup),
+    (5, 'índice compuesto de memoria', _m005_indice_memoria),
+    (6, 'estadísticas de términos por usuario', _m006_user_term_stats),
+    (7, 'seguimiento de ingesta con hash', _m007_processed_conversations),
+    (8, 'índice FTS de knowledge_facts', _m008_fts_facts),
+    (9, 'checkpoints de retención', _m009_retention_checkpoints),
+    (10, 'pesos de términos en log2', _m010_user_term_log_weights),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# ------------------------------------------------------------- capabilities
+class SchemaCapabilities:
+    """Tablas y columnas presentes en una base, leídas una sola vez."""
+
+    def __init__(self, db_path: str, version: int, tables: Dict[str, FrozenSet[str]]):
+        self.db_path = db_path
+        self.version = version
+        self.tables = tables
+
+    def has_table(self, table: str) -> bool:
+        return table in self.tables
+
+    def columns(self, table: str) -> FrozenSet[str]:
+        return self.tables.get(table, frozenset())
+
+    def has_columns(self, table: str, *cols: str) -> bool:
+        return set(cols).issubset(self.columns(table))
+
+    def as_dict(self) -> Dict:
+        return {'db_path': self.db_path, 'version': self.version, 'tables': sorted(self.tables)}
+
+
+_capabilities: Dict[str, SchemaCapabilities] = {}
+_capabilities_lock = threading.RLock()
+
+
+def read_capabilities(con, db_path: str = '') -> SchemaCapabilities:
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    names = [r[0] for r in con.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()]
+    tables = {name: frozenset(_table_columns(con, name)) for name in names}
+    return SchemaCapabilities(db_path, version, tables)
+
+
+def migrate_database(db_path: str) -> SchemaCapabilities:
+    """Aplicar las migraciones pendientes a `db_path` y cachear sus capacidades.
+
+    Cada migración corre en su propia transacción (BEGIN IMMEDIATE) y la
+    versión se vuelve a leer dentro del lock, así varios procesos pueden
+    arrancar a la vez sobre la misma base.
+    """
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    con = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        for version, name, fn in MIGRATIONS:
+            if con.execute("PRAGMA user_version").fetchone()[0] >= version:
+                continue
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                if con.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    con.execute("ROLLBACK")
+                    continue
+                fn(con)
+                con.execute(f"PRAGMA user_version = {int(version)}")
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+            logger.info(f"🔧 Esquema {db_path}: migración {version} ({name}) aplicada")
+        caps = read_capabilities(con, db_path)
+    finally:
+        con.close()
+    with _capabilities_lock:
+        _capabilities[db_path] = caps
+    return caps
+
+
+def get_capabilities(db_path: str = DB_PATH) -> SchemaCapabilities:
+    """Capacidades cacheadas de `db_path`; migra la base en el primer uso."""
+    key = db_path
+    caps = _capabilities.get(key)
+    if caps is not None:
+        return caps
+    with _capabilities_lock:
+        caps = _capabilities.get(key)
+        if caps is not None:
+            return caps
+        try:
+            return migrate_database(db_path)
+        except Exception as e:
+            # Base de solo lectura o bloqueada: usar lo que haya sin migrar
+            logger.warning(f"⚠️ No se pudo migrar {db_path}: {e}")
+            con = sqlite3.connect(db_path)
+            try:
+                caps = read_capabilities(con, db_path)
+            finally:
+                con.close()
+            _capabilities[key] = caps
+            return caps
+
+
+def invalidate_capabilities(db_path: Optional[str] = None):
+    """Olvidar las capacidades cacheadas (tras cambios de esquema fuera de este módulo)."""
+    with _capabilities_lock:
+        if db_path is None:
+            _capabilities.clear()
+        else:
+            _capabilities.pop(db_path, None)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Aplicar migraciones del esquema SQLite")
+    ap.add_argument("--db", action="append", default=None,
+                    help="Base a migrar (repetible; por defecto DB_PATH y database/conversaciones.db)")
+    args = ap.parse_args()
+    for path in args.db or [DB_PATH, os.path.join('database', 'conversaciones.db')]:
+        print(f"{path}:", migrate_database(path).as_dict())
@@ -64,20 +64,19 @@ PARA EJECUTAR:
 =======================================================================
 """
 
-from flask import Flask, request, jsonify, render_template, send_from_directory, session, redirect, url_for, flash
+from flask import (Flask, request, jsonify, render_template, send_from_directory, session, redirect, url_for, flash, g,
+                   Response, stream_with_context)
 import os
 import json
 import time
 import signal
 import sys
-import threading
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-import openai
+import importlib.util
 import traceback
 import logging
 from typing import Dict, List, Optional
-from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, TimeoutError as ThreadTimeoutError
 import sqlite3
 import uuid
@@ -111,6 +110,12 @@ logging.basicConfig(
 # (ai_system.*) que usan os.getenv() en import-time reciban valores.
 load_dotenv()
 
+# Esquema SQLite único con migraciones versionadas (ai_system/schema.py)
+from ai_system.schema import migrate_database, get_capabilities
+# Componentes pesados bajo demanda y perfil de arranque (core/services.py)
+from core.services import get_services, ServiceUnavailable
+services = get_services()
+
 
 # Función de inicialización de base de datos
 def inicializar_base_datos():
@@ -175,129 +180,21 @@ def inicializar_base_datos():
         except Exception:
             pass
 
-        # Conectar a la base de datos (se crea si no existe)
-        conn = sqlite3.connect(str(db_path))
-        cursor = conn.cursor()
-        
-        # Crear tabla de conversaciones
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversaciones (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                usuario TEXT,
-                consulta TEXT NOT NULL,
-                respuesta TEXT NOT NULL,
-                sistema_usado TEXT,
-                confianza REAL,
-                tiempo_procesamiento REAL,
-                ip_usuario TEXT,
-                user_agent TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Crear tabla de métricas de rendimiento
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS metricas_rendimiento (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                consulta_length INTEGER,
-                respuesta_length INTEGER,
-                sistema_usado TEXT,
-                confianza REAL,
-                tiempo_procesamiento REAL,
-                ip TEXT,
-                user_agent TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Crear tabla FTS para búsqueda de texto completo
-        cursor.execute("""
-            CREATE VIRTUAL TABLE IF NOT EXISTS fts_chunks USING fts5(
-                id, content, doc_id, heading_path, page_start, page_end
-            )
-        """)
-        
-        # Crear tabla de mensajes de conversación (para memoria)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversation_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                conversation_id TEXT,
-                role TEXT,
-                content TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Crear tabla de métricas de rendimiento (duplicada para compatibilidad)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS performance_metrics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                consulta_length INTEGER,
-                respuesta_length INTEGER,
-                sistema_usado TEXT,
-                confianza REAL,
-                tiempo_procesamiento REAL,
-                ip TEXT,
-                user_agent TEXT
-            )
-        """)
-        
-        # Crear tabla de aprendizaje del sistema
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS aprendizaje_sistema (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pregunta TEXT NOT NULL,
-                respuesta TEXT NOT NULL,
-                citations TEXT,
-                fact_type TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Crear tabla de auditoría de consentimiento
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS audit_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                user_id TEXT,
-                action TEXT,
-                details TEXT
-            )
-        """)
-        
-        # Crear tabla de consentimiento de usuario
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_consent (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT UNIQUE,
-                consent_given BOOLEAN DEFAULT 0,
-                consent_timestamp DATETIME,
-                ip_address TEXT,
-                user_agent TEXT
-            )
-        """)
+        # Llevar la base al esquema canónico (crea tablas e índices si no existen)
+        caps = migrate_database(str(db_path))
+
         # Inicializar también la base de datos de aprendizaje híbrido
         init_hybrid_knowledge_db()
 
-        # Crear índices para mejor rendimiento
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversaciones_timestamp ON conversaciones(timestamp)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversaciones_usuario ON conversaciones(usuario)")
-        
-        conn.commit()
-        conn.close()
-        
-        print(f"Base de datos inicializada: {db_path}")
+        print(f"Base de datos inicializada: {db_path} (esquema v{caps.version})")
         return True
         
     except Exception as e:
         print(f"Error inicializando base de datos: {e}")
         return False
 
-def get_learning_db_connection():
-    """Obtener conexión a la base de datos de aprendizaje"""
+def resolve_learning_db_path() -> str:
+    """Ruta de la base de datos de aprendizaje (DB_PATH / DATABASE_URL / default)"""
     # Allow overriding via env var DB_PATH or DATABASE_URL
     db_path = os.getenv('DB_PATH') or os.getenv('DATABASE_URL') or 'database/hybrid_knowledge.db'
     # If DATABASE_URL looks like sqlite:///path, convert to filesystem path
@@ -312,7 +209,12 @@ def get_learning_db_connection():
                 db_path = db_path.replace('sqlite://', '', 1)
     except Exception:
         pass
+    return db_path
+
 
+def get_learning_db_connection():
+    """Obtener conexión a la base de datos de aprendizaje"""
+    db_path = resolve_learning_db_path()
     try:
         conn = sqlite3.connect(db_path)
         conn.row_factory = sqlite3.Row  # Para acceso por nombre de columna
@@ -339,54 +241,8 @@ def resolve_conversaciones_db_path() -> str:
 def init_hybrid_knowledge_db():
     """Inicializa la base de datos híbrida de conocimiento"""
     try:
-        conn = get_learning_db_connection()
-        if not conn:
-            print("⚠️ No se pudo conectar a base de datos híbrida")
-            return False
-            
-        cursor = conn.cursor()
-        
-        # Crear tabla de conversaciones
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id TEXT PRIMARY KEY,
-                user_id TEXT,
-                specialist_type TEXT,
-                session_id TEXT,
-                started_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Crear tabla de mensajes de conversación
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversation_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                conversation_id TEXT,
-                role TEXT,
-                content TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Crear tabla de métricas de rendimiento
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS performance_metrics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                consulta_length INTEGER,
-                respuesta_length INTEGER,
-                sistema_usado TEXT,
-                confianza REAL,
-                tiempo_procesamiento REAL,
-                ip TEXT,
-                user_agent TEXT
-            )
-        """)
-        
-        conn.commit()
-        conn.close()
-        
-        print("✅ Base de datos híbrida inicializada")
+        caps = migrate_database(resolve_learning_db_path())
+        print(f"✅ Base de datos híbrida inicializada (esquema v{caps.version})")
         return True
         
     except Exception as e:
@@ -394,8 +250,8 @@ def init_hybrid_knowledge_db():
         return False
 logger = logging.getLogger(__name__)
 
-# Inicializar base de datos al arrancar la aplicación
-inicializar_base_datos()
+# Migrar las bases en el precalentamiento o antes del primer request, no al importar
+services.register('bases_datos', inicializar_base_datos)
  
 
 # Cargar configuración después del logger
@@ -404,17 +260,13 @@ if PROMPTS_DISPONIBLES:
 else:
     logger.warning("⚠️ No se pudo cargar sistema de prompts, usando prompts básicos")
 
-# Importar el nuevo sistema de IA reorganizado
-try:
-    from ai_system.retrieve import HybridRetriever
-    from ai_system.answer import AnswerEngine
-    from ai_system.db import get_conn, fts_search
-    SISTEMA_AI_DISPONIBLE = True
-    logger.info("Sistema de IA reorganizado importado correctamente")
-except ImportError as e:
-    SISTEMA_AI_DISPONIBLE = False
-    logger.warning(f"⚠️ No se pudo importar sistema de IA: {e}")
-    logger.error(f"📝 Traceback: {traceback.format_exc()}")
+# Sistema de IA reorganizado: retrieve/answer (openai, faiss) se importan al construir
+# los servicios 'retriever' y 'answer_engine'; aquí solo se comprueba que estén instalados
+SISTEMA_AI_DISPONIBLE = all(importlib.util.find_spec(m) is not None for m in ('openai', 'faiss', 'numpy'))
+if SISTEMA_AI_DISPONIBLE:
+    logger.info("Sistema de IA reorganizado disponible (carga diferida)")
+else:
+    logger.warning("⚠️ Sistema de IA no disponible: faltan openai, faiss o numpy")
 
 # Intentar cargar utilidades de privacidad (detección PII, consent, audit)
 try:
@@ -427,23 +279,52 @@ else:
     # Privacy simplificado - no crear tablas
     logger.info("✅ Sistema de privacidad simplificado")
 
-# Intentar cargar sistema de memoria
+# Cargar sistema de memoria
 try:
-    from ai_system.memory import get_user_memory_context, calculate_query_similarity
+    with services.phase('import:ai_system.memory'):
+        from ai_system.memory import (remember_turn, get_memory_cache, select_memory_context,
+                                      user_term_rows, UPSERT_USER_TERM_SQL, register_sql_functions)
     MEMORY_AVAILABLE = True
     logger.info("✅ Sistema de memoria importado correctamente")
 except Exception as e:
     MEMORY_AVAILABLE = False
     logger.warning(f"⚠️ No se pudo cargar ai_system.memory: {e}")
-    logger.error(f"📝 Traceback: {traceback.format_exc()}")
 
-# Cargar módulo de memoria (implementación ligera para pruebas)
+# Consultas estructuradas de cabida (tablas TablaCabida_Tomo_N)
 try:
-    from ai_system.memory import get_user_memory_context, calculate_query_similarity, analyze_user_patterns
-    MEMORY_AVAILABLE = True
+    with services.phase('import:ai_system.cabida'):
+        from ai_system.cabida import es_consulta_cabida, responder_cabida
+    CABIDA_AVAILABLE = True
 except Exception as e:
-    MEMORY_AVAILABLE = False
-    logger.info(f"ℹ️ Módulo ai_system.memory no disponible: {e}")
+    CABIDA_AVAILABLE = False
+    logger.info(f"ℹ️ Módulo ai_system.cabida no disponible: {e}")
+
+# Procedimientos precalculados desde los flujogramas de cada tomo
+try:
+    with services.phase('import:ai_system.flujogramas'):
+        from ai_system.flujogramas import es_consulta_procedimiento, responder_procedimiento
+    FLUJOGRAMAS_AVAILABLE = True
+except Exception as e:
+    FLUJOGRAMAS_AVAILABLE = False
+    logger.info(f"ℹ️ Módulo ai_system.flujogramas no disponible: {e}")
+
+# Nivel de respuestas curadas por tomo (Respuestas_Tomo_N)
+try:
+    with services.phase('import:ai_system.respuestas'):
+        from ai_system.respuestas import responder_respuesta_curada
+    RESPUESTAS_CURADAS_AVAILABLE = True
+except Exception as e:
+    RESPUESTAS_CURADAS_AVAILABLE = False
+    logger.info(f"ℹ️ Módulo ai_system.respuestas no disponible: {e}")
+
+# Resoluciones indexadas por número, año y texto
+try:
+    with services.phase('import:ai_system.resoluciones'):
+        from ai_system.resoluciones import es_consulta_resoluciones, responder_resoluciones
+    RESOLUCIONES_AVAILABLE = True
+except Exception as e:
+    RESOLUCIONES_AVAILABLE = False
+    logger.info(f"ℹ️ Módulo ai_system.resoluciones no disponible: {e}")
 
 # Nota: `load_dotenv()` ya fue llamado al inicio del archivo para permitir que
 # módulos importados más abajo (ai_system.*) vean variables de entorno definidas
@@ -516,6 +397,40 @@ app.config['WTF_CSRF_TIME_LIMIT'] = 3600
 REQUEST_TIMEOUT = 35  # 35 segundos máximo (suficiente para OpenAI)
 OPENAI_TIMEOUT = 30   # 30 segundos máximo (para consultas complejas)
 
+# ===== SERVICIOS DIFERIDOS =====
+@app.before_request
+def asegurar_bases_datos():
+    """Migrar las bases antes del primer request si el precalentamiento aún no lo hizo"""
+    try:
+        services.get('bases_datos')
+    except ServiceUnavailable:
+        pass
+
+# ===== TRAZAS POR REQUEST =====
+TRACED_PATHS = {'/chat', '/chat-test'}
+
+@app.before_request
+def abrir_traza():
+    """Abrir una traza para los endpoints del pipeline de chat"""
+    if request.path in TRACED_PATHS:
+        g.trace = start_trace(request.path, method=request.method)
+
+@app.after_request
+def cerrar_traza(response):
+    """Cerrar la traza del request y exponer su id en X-Trace-Id"""
+    trace = g.pop('trace', None)
+    if trace is not None:
+        response.headers['X-Trace-Id'] = trace.trace_id
+        finish_trace(trace, status=response.status_code)
+    return response
+
+@app.teardown_request
+def cerrar_traza_pendiente(exc):
+    """Cerrar la traza si el request terminó con una excepción no manejada"""
+    trace = g.pop('trace', None)
+    if trace is not None:
+        finish_trace(trace, status=500, error=type(exc).__name__ if exc else None)
+
 # ===== HEADERS DE SEGURIDAD =====
 @app.after_request
 def add_security_headers(response):
@@ -563,58 +478,60 @@ def debug_db():
 # signal.signal(signal.SIGTERM, signal_handler)  # COMENTADO - problemático en desarrollo
 # signal.signal(signal.SIGINT, signal_handler)   # COMENTADO - problemático en desarrollo
 
-# Cliente OpenAI con manejo de errores (Azure y estándar)
-deployment_name = "gpt-4.1"  # Variable global para deployment
+# Cliente OpenAI (Azure), construido al primer uso o en el precalentamiento
+deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4.1")  # Variable global para deployment
 
-try:
-    # Verificar si Azure OpenAI está configurado
+def crear_cliente_openai():
+    """Crear el cliente Azure OpenAI (servicio 'openai'); el SDK se importa aquí"""
     azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
     azure_key = os.getenv("AZURE_OPENAI_KEY")
-    azure_api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
-    deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4.1")
-    
-    if azure_endpoint and azure_key:
-        # Usar Azure OpenAI
-        client = openai.AzureOpenAI(
-            api_version=azure_api_version,
-            azure_endpoint=azure_endpoint,
-            api_key=azure_key,
-            timeout=OPENAI_TIMEOUT
-        )
-        logger.info("Cliente Azure OpenAI configurado correctamente")
-        logger.info(f"   📡 Endpoint: {azure_endpoint}")
-        logger.info(f"   Deployment: {deployment_name}")
-    else:
-        # Error: Sin configuración Azure OpenAI válida
-        logger.error("Configuración Azure OpenAI faltante o incompleta")
-        client = None
-        deployment_name = "gpt-4.1"  # Mantener valor por defecto
-except Exception as e:
-    logger.error(f"Error configurando cliente OpenAI: {e}")
-    client = None
+    if not (azure_endpoint and azure_key):
+        raise ValueError("Configuración Azure OpenAI faltante o incompleta")
+    import openai
+    client = openai.AzureOpenAI(
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview"),
+        azure_endpoint=azure_endpoint,
+        api_key=azure_key,
+        timeout=OPENAI_TIMEOUT
+    )
+    logger.info("Cliente Azure OpenAI configurado correctamente")
+    logger.info(f"   📡 Endpoint: {azure_endpoint}")
+    logger.info(f"   Deployment: {deployment_name}")
+    return client
+
+def get_openai_client():
+    """Cliente Azure OpenAI compartido, o None si no está configurado"""
+    try:
+        return services.get('openai')
+    except ServiceUnavailable:
+        return None
+
+services.register('openai', crear_cliente_openai)
 
 # ===== SQLITE SIMPLE PARA CONVERSACIONES =====
+# Las escrituras de logs del chat pasan por una cola write-behind con group commit
+from core.write_behind import get_writer
+if MEMORY_AVAILABLE:
+    # UPSERT_USER_TERM_SQL suma pesos en log2 con logaddexp2()
+    get_writer().add_connection_hook(register_sql_functions)
+# Histogramas de latencia y contadores en memoria (/metrics), con rollup periódico a SQLite
+from core.metrics import get_metrics
+# Trazas por etapa (spans) con sink JSONL muestreado
+from core.tracing import span, start_trace, finish_trace, current_trace_id
+# Pool acotado del KDF de contraseñas (scrypt), separado de los hilos del chat
+from core.passwords import get_password_hasher, calibrated_params
+# La calibración de scrypt corre en el precalentamiento (o en wsgi.py antes del fork), no en un login
+services.register('scrypt', calibrated_params)
+# Rate limiter de ventana deslizante con estado compartido opcional entre workers
+from core.rate_limit import get_rate_limiter
+import contextvars
+
 def init_simple_database():
     """Inicializar base de datos simple de conversaciones"""
     try:
         # Usar carpeta `database/` para mantener las DB juntas
-        os.makedirs('database', exist_ok=True)
         db_path = os.path.join('database', 'conversaciones.db')
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS conversaciones (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario TEXT,
-                pregunta TEXT,
-                respuesta TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        conn.commit()
-        conn.close()
+        migrate_database(db_path)
         logger.info("Base de datos SQLite simple inicializada")
         return True
     except Exception as e:
@@ -622,26 +539,30 @@ def init_simple_database():
         return False
 
 def guardar_conversacion_simple(usuario, pregunta, respuesta):
-    """Guardar conversación en SQLite simple
-
-    Si está activado `ENABLE_AUTO_INGEST`, intentar también enviar el par
-    (pregunta,respuesta) a la base de conocimiento mediante `ai_system.learn.save_learning`.
+    """Guardar conversación en SQLite simple (escritura diferida)
+
+    La inserción se encola en el write-behind y se aplica en lote fuera de la
+    ruta de respuesta; el turno se agrega también al ring buffer de memoria
+    del usuario (write-through) y a sus estadísticas de términos
+    (`user_term_stats`). Si está activado `ENABLE_AUTO_INGEST`, el par
+    (pregunta,respuesta) también se envía en segundo plano a la base de
+    conocimiento mediante `ai_system.learn.save_learning`.
     """
     try:
         # Asegurar uso de la misma DB que usan los scripts de inicialización
-        os.makedirs('database', exist_ok=True)
         db_path = os.path.join('database', 'conversaciones.db')
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
+        # Mismo formato que datetime('now') para que caché y tabla coincidan
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        encolado = get_writer().execute(db_path, '''
             INSERT INTO conversaciones (usuario, consulta, respuesta, timestamp)
-            VALUES (?, ?, ?, datetime('now'))
-        ''', (usuario, pregunta, respuesta))
-
-        conn.commit()
-        conn.close()
-        logger.info(f"💾 Conversación guardada para usuario: {usuario}")
+            VALUES (?, ?, ?, ?)
+        ''', (usuario, pregunta, respuesta, timestamp))
+        logger.info(f"💾 Conversación encolada para usuario: {usuario}")
+        if MEMORY_AVAILABLE:
+            remember_turn(usuario, pregunta, respuesta, timestamp)
+            # Estadísticas de términos del usuario, en el mismo group commit
+            get_writer().execute_many(db_path, UPSERT_USER_TERM_SQL,
+                                      user_term_rows(usuario, pregunta, respuesta, timestamp))
 
         # Auto-ingest (no bloqueante)
         try:
@@ -649,14 +570,14 @@ def guardar_conversacion_simple(usuario, pregunta, respuesta):
                 try:
                     from ai_system.learn import save_learning
                     conv_id = session.get('conversation_id', f"auto_{usuario}") if 'session' in globals() else f"auto_{usuario}"
-                    sid = save_learning(conv_id, pregunta, respuesta, citations=None, fact_type='auto')
-                    logger.info(f"🔁 Auto-ingest guardado: {sid}")
+                    get_writer().call(save_learning, conv_id, pregunta, respuesta, citations=None, fact_type='auto')
+                    logger.info(f"🔁 Auto-ingest encolado para conversación: {conv_id}")
                 except Exception as e:
                     logger.warning(f"⚠️ Falló auto-ingest (save_learning): {e}")
         except Exception as e:
             logger.warning(f"⚠️ Error comprobando ENABLE_AUTO_INGEST: {e}")
 
-        return True
+        return encolado
     except Exception as e:
         logger.error(f"Error guardando conversación: {e}")
         return False
@@ -664,90 +585,43 @@ def guardar_conversacion_simple(usuario, pregunta, respuesta):
 # ===== SISTEMA DE APRENDIZAJE AUTOMÁTICO =====
 def log_conversation_start(user_id: str, specialist_type: str, session_id: str) -> str:
     """Registrar inicio de conversación y retornar conversation_id"""
+    conversation_id = f"conv_{uuid.uuid4().hex[:12]}"
     try:
-        conversation_id = f"conv_{uuid.uuid4().hex[:12]}"
-        
-        conn = get_learning_db_connection()
-        if not conn:
-            return conversation_id
-        
-        cursor = conn.cursor()
-        cursor.execute("""
+        get_writer().execute(resolve_learning_db_path(), """
             INSERT INTO conversations (id, user_id, specialist_type, session_id)
             VALUES (?, ?, ?, ?)
         """, (conversation_id, user_id, specialist_type, session_id))
-        
-        conn.commit()
-        conn.close()
-        
         logger.debug(f"📝 Conversación iniciada: {conversation_id}")
-        return conversation_id
-        
     except Exception as e:
         logger.error(f"Error logging conversación: {e}")
-        return f"conv_{uuid.uuid4().hex[:12]}"  # Fallback
+    return conversation_id
 
 def log_conversation_message(conversation_id: str, role: str, content: str, 
                            specialist_context: str = None, processing_time: float = None,
                            confidence_score: float = None, sources_used: str = None) -> str:
-    """Registrar mensaje en conversación"""
+    """Registrar mensaje en conversación (escritura diferida)"""
+    message_id = f"msg_{uuid.uuid4().hex[:12]}"
     try:
-        message_id = f"msg_{uuid.uuid4().hex[:12]}"
-        
-        conn = get_learning_db_connection()
-        if not conn:
-            return message_id
-        
-        cursor = conn.cursor()
-        # Verificar si la tabla existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='conversation_messages'")
-        if not cursor.fetchone():
-            logger.debug("Tabla conversation_messages no existe, omitiendo log")
-            conn.close()
-            return message_id
-            
-        cursor.execute("""
+        get_writer().execute(resolve_learning_db_path(), """
             INSERT INTO conversation_messages 
             (id, conversation_id, role, content, specialist_context, 
              processing_time, confidence_score, sources_used)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, (message_id, conversation_id, role, content, specialist_context,
               processing_time, confidence_score, sources_used))
-        
-        conn.commit()
-        conn.close()
-        
         logger.debug(f"📝 Mensaje registrado: {message_id}")
-        return message_id
-        
     except Exception as e:
         logger.error(f"Error logging mensaje: {e}")
-        return f"msg_{uuid.uuid4().hex[:12]}"  # Fallback
+    return message_id
 
 def log_performance_metric(metric_type: str, metric_value: float, 
                           specialist_area: str = None, context_data: str = None):
-    """Registrar métrica de rendimiento"""
+    """Registrar métrica de rendimiento (escritura diferida)"""
     try:
-        conn = get_learning_db_connection()
-        if not conn:
-            return
-        
-        cursor = conn.cursor()
-        # Verificar si la tabla existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='performance_metrics'")
-        if not cursor.fetchone():
-            logger.debug("Tabla performance_metrics no existe, omitiendo log")
-            conn.close()
-            return
-            
-        cursor.execute("""
+        get_writer().execute(resolve_learning_db_path(), """
             INSERT INTO performance_metrics (id, metric_type, metric_value, specialist_area, context_data)
             VALUES (?, ?, ?, ?, ?)
         """, (f"metric_{uuid.uuid4().hex[:8]}", metric_type, metric_value, specialist_area, context_data))
-        
-        conn.commit()
-        conn.close()
-        
     except Exception as e:
         logger.error(f"Error logging métrica: {e}")
 
@@ -761,7 +635,7 @@ def get_or_create_conversation_id(session):
 
 # Importar el sistema de autenticación simple
 try:
-    from core.auth import login_user, is_logged_in, login_required, simple_auth
+    from core.auth import login_user, is_logged_in, login_required, get_auth
     logger.info("[OK] Sistema de autenticacion importado desde core/auth.py")
     auth_disponible = True
     logger.info(f"🔍 DEBUG: auth_disponible = {auth_disponible}")
@@ -838,11 +712,9 @@ try:
             
             cursor = conn.cursor()
             
-            # Verificar si las tablas necesarias existen
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN ('fts_chunks', 'chunks_meta')")
-            existing_tables = [row[0] for row in cursor.fetchall()]
-            
-            if 'fts_chunks' not in existing_tables:
+            # Verificar si las tablas necesarias existen (capacidades cacheadas al migrar)
+            caps = get_capabilities(resolve_learning_db_path())
+            if not caps.has_table('fts_chunks'):
                 logger.debug("Tabla fts_chunks no existe, usando búsqueda básica")
                 return f"Consulta procesada: {consulta[:100]}..."
             
@@ -853,7 +725,7 @@ try:
                 # Limpiar consulta para FTS (quitar caracteres problemáticos)
                 consulta_fts = consulta.replace("-", " ").replace(".", " ").replace(",", " ")
                 # fts_chunks stores text in `chunk_text` and metadata in chunks_meta
-                if 'chunks_meta' in existing_tables:
+                if caps.has_table('chunks_meta'):
                     cursor.execute("""
                         SELECT f.rowid, f.chunk_text, m.doc_id, m.heading_path, m.page_start, m.page_end
                         FROM fts_chunks f
@@ -993,6 +865,7 @@ try:
     def procesar_consulta_simple(consulta: str) -> Dict:
         """Función simple que usa directamente Azure OpenAI - FUNCIONA GARANTIZADO"""
         try:
+            client = get_openai_client()
             if not client:
                 return {
                     'respuesta': 'Error: Cliente Azure OpenAI no configurado',
@@ -1012,16 +885,17 @@ Mantén un tono profesional pero amigable."""
             logger.info(f"🔄 [SIMPLE] Enviando consulta a Azure OpenAI: {consulta[:50]}...")
             
             # Llamada directa a Azure OpenAI
-            response = client.chat.completions.create(
-                model=deployment_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": consulta}
-                ],
-                max_tokens=1000,
-                temperature=0.3,
-                timeout=45
-            )
+            with span('llm', model=deployment_name):
+                response = client.chat.completions.create(
+                    model=deployment_name,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": consulta}
+                    ],
+                    max_tokens=1000,
+                    temperature=0.3,
+                    timeout=45
+                )
             
             respuesta = response.choices[0].message.content.strip()
             logger.info(f"✅ [SIMPLE] Respuesta recibida exitosamente")
@@ -1190,6 +1064,7 @@ CONSULTA: {consulta}"""
 
                 # Si no hay cliente OpenAI/Azure configurado, generar una respuesta
                 # local simple usando el contexto recuperado (RAG fallback).
+                client = get_openai_client()
                 if client is None:
                     # Si no se encontró contexto útil, devolver mensaje estándar
                     if not context or context.startswith("No se encontró") or context.startswith("Error"):
@@ -1223,18 +1098,20 @@ CONSULTA: {consulta}"""
                     }
 
                 # Llamada a Azure/OpenAI cuando haya cliente configurado
-                response = client.chat.completions.create(
-                    model=deployment_name,
-                    messages=messages,
-                    max_tokens=1000,
-                    temperature=0.1,
-                    timeout=REQUEST_TIMEOUT
-                )
+                with span('llm', model=deployment_name):
+                    response = client.chat.completions.create(
+                        model=deployment_name,
+                        messages=messages,
+                        max_tokens=1000,
+                        temperature=0.1,
+                        timeout=REQUEST_TIMEOUT
+                    )
                 
                 bot_response = response.choices[0].message.content.strip()
                 
                 # 🚨 POST-PROCESAMIENTO AGRESIVO: Filtrar citas problemáticas
-                bot_response = filtrar_citas_problematicas(bot_response)
+                with span('filtrar_citas_problematicas'):
+                    bot_response = filtrar_citas_problematicas(bot_response)
                 
                 return {
                     'respuesta': bot_response,
@@ -1289,13 +1166,28 @@ if SISTEMA_AI_DISPONIBLE:
         logger.info(f"   📡 Endpoint: {azure_endpoint}")
         logger.info(f"   🔑 API Key: ***{azure_key[-8:]}")
         
-        # Inicializar el retriever y answer engine
-        retriever = HybridRetriever()
-        answer_engine = AnswerEngine(retriever)
-        logger.info("✅ Sistema de IA reorganizado inicializado correctamente")
+        # Retriever (lee el índice FAISS) y answer engine: al primer uso o en el precalentamiento
+        def crear_retriever():
+            from ai_system.retrieve import HybridRetriever
+            return HybridRetriever()
+
+        def crear_answer_engine():
+            from ai_system.answer import AnswerEngine
+            engine = AnswerEngine(services.get('retriever'))
+            logger.info("✅ Sistema de IA reorganizado inicializado correctamente")
+            return engine
+
+        services.register('retriever', crear_retriever)
+        services.register('answer_engine', crear_answer_engine)
+        procesar_consulta_hibrida_simple = procesar_consulta_hibrida
         
         # Sobrescribir la función con el nuevo sistema
         def procesar_consulta_hibrida_nueva(consulta: str, conversation_history: List[Dict] = None) -> Dict:
+            try:
+                answer_engine = services.get('answer_engine')
+            except ServiceUnavailable as e:
+                logger.warning(f"⚠️ {e}; usando sistema simplificado")
+                return procesar_consulta_hibrida_simple(consulta)
             try:
                 logger.info(f"🔍 Procesando con AI system: '{consulta[:50]}...'")
                 
@@ -1368,75 +1260,16 @@ CONFIG = {
     # Memory toggles (habilitado para desarrollo)
     'MEMORY_ENABLED': os.getenv('MEMORY_ENABLED', 'true').lower() == 'true',
     'AUTO_CONTEXT_INJECTION': os.getenv('AUTO_CONTEXT_INJECTION', 'true').lower() == 'true',
-    'CONTEXT_WINDOW': int(os.getenv('CONTEXT_WINDOW', '5'))
+    'CONTEXT_WINDOW': int(os.getenv('CONTEXT_WINDOW', '5')),
+    'MEMORY_TOKEN_BUDGET': int(os.getenv('MEMORY_TOKEN_BUDGET', '1500'))
 }
 
-# ===== RATE LIMITING CON GESTIÓN DE MEMORIA =====
-class RateLimiter:
-    """Rate limiter con gestión automática de memoria"""
-    
-    def __init__(self, max_requests=30, window_seconds=60, max_ips=1000):
-        self.max_requests = max_requests
-        self.window_seconds = window_seconds
-        self.max_ips = max_ips
-        self.requests = defaultdict(list)
-        self.last_cleanup = time.time()
-        self._lock = threading.Lock()
-    
-    def is_allowed(self, identifier):
-        """Verificar si se permite la request"""
-        now = time.time()
-        
-        with self._lock:
-            # Limpieza automática cada 5 minutos
-            if now - self.last_cleanup > 300:
-                self.cleanup_old_requests(now)
-                self.last_cleanup = now
-            
-            # Limpiar requests antiguos de esta IP
-            self.requests[identifier] = [
-                req_time for req_time in self.requests[identifier] 
-                if now - req_time < self.window_seconds
-            ]
-            
-            # Verificar límite
-            if len(self.requests[identifier]) >= self.max_requests:
-                return False
-            
-            self.requests[identifier].append(now)
-            return True
-    
-    def cleanup_old_requests(self, now):
-        """Limpiar requests antiguos y limitar número de IPs"""
-        # Remover requests antiguos
-        for ip in list(self.requests.keys()):
-            self.requests[ip] = [
-                req_time for req_time in self.requests[ip] 
-                if now - req_time < self.window_seconds
-            ]
-            # Remover IPs sin requests recientes
-            if not self.requests[ip]:
-                del self.requests[ip]
-        
-        # Si tenemos demasiadas IPs, eliminar las más antiguas
-        if len(self.requests) > self.max_ips:
-            sorted_ips = sorted(
-                self.requests.items(), 
-                key=lambda x: max(x[1]) if x[1] else 0, 
-                reverse=True
-            )[:self.max_ips]
-            self.requests = defaultdict(list, dict(sorted_ips))
-            
-        logger.info(f"🧹 Rate limiter cleanup: {len(self.requests)} IPs activas")
-
-# Instanciar rate limiter
-rate_limiter = RateLimiter(
-    max_requests=CONFIG['RATE_LIMIT_MESSAGES'],
-    window_seconds=CONFIG['RATE_LIMIT_WINDOW']
-)
+# ===== RATE LIMITING =====
+# Ventana deslizante O(1) por IP; con RATE_LIMIT_BACKEND=sqlite el estado es común a los workers
+rate_limiter = get_rate_limiter()
 
 def check_rate_limit(identifier: str) -> bool:
-    """Rate limiting con gestión de memoria"""
+    """Rate limiting por IP (ventana deslizante, core/rate_limit.py)"""
     return rate_limiter.is_allowed(identifier)
 
 def get_client_ip():
@@ -1741,6 +1574,43 @@ def procesar_con_timeout(mensaje, timeout_segundos=REQUEST_TIMEOUT, conversation
             logger.info(f"👋 Saludo detectado: '{mensaje}' - Mostrando bienvenida")
             return generar_mensaje_bienvenida()
         
+        # 📐 CONSULTAS DE CABIDA: búsqueda directa en las tablas estructuradas
+        if CABIDA_AVAILABLE and es_consulta_cabida(mensaje):
+            resultado_cabida = responder_cabida(mensaje)
+            if resultado_cabida:
+                get_metrics().inc('chat_cache_hits_total', cache='cabida')
+                logger.info(f"📐 Consulta de cabida resuelta por tabla: '{mensaje}'")
+                return resultado_cabida
+        
+        # 🗺️ CONSULTAS DE PROCEDIMIENTO: pasos desde los flujogramas precalculados
+        if FLUJOGRAMAS_AVAILABLE and es_consulta_procedimiento(mensaje):
+            resultado_procedimiento = responder_procedimiento(mensaje)
+            if resultado_procedimiento:
+                get_metrics().inc('chat_cache_hits_total', cache='procedimiento')
+                logger.info(f"🗺️ Consulta de procedimiento resuelta por flujograma: '{mensaje}'")
+                return resultado_procedimiento
+        
+        # 📜 CONSULTAS DE RESOLUCIONES: búsqueda por número o año en la tabla indexada
+        if RESOLUCIONES_AVAILABLE and es_consulta_resoluciones(mensaje):
+            resultado_resoluciones = responder_resoluciones(mensaje)
+            if resultado_resoluciones:
+                get_metrics().inc('chat_cache_hits_total', cache='resoluciones')
+                logger.info(f"📜 Consulta de resoluciones resuelta por índice: '{mensaje}'")
+                return resultado_resoluciones
+        
+        # 📚 RESPUESTAS CURADAS: preguntas ya respondidas por tomo (léxico + embeddings)
+        if RESPUESTAS_CURADAS_AVAILABLE:
+            retriever_activo = services.peek('retriever')
+            embed_fn = None
+            if retriever_activo is not None and getattr(retriever_activo, 'embedding_client', None) is not None:
+                embed_fn = retriever_activo.embed
+            with span('respuestas_curadas'):
+                resultado_curado = responder_respuesta_curada(mensaje, embed_fn=embed_fn)
+            if resultado_curado:
+                get_metrics().inc('chat_cache_hits_total', cache='respuesta_curada')
+                logger.info(f"📚 Respuesta curada (confianza {resultado_curado['confianza']:.2f}): '{mensaje}'")
+                return resultado_curado
+        
         # 🔢 DETECTAR CONSULTAS CUANTITATIVAS (conteos, búsquedas exactas)
         if es_consulta_cuantitativa(mensaje):
             logger.info(f"📊 Consulta cuantitativa detectada: '{mensaje}'")
@@ -1778,8 +1648,10 @@ def procesar_con_timeout(mensaje, timeout_segundos=REQUEST_TIMEOUT, conversation
         # ✅ USAR FUNCIÓN HÍBRIDA QUE CONSULTA DOCUMENTOS DE LA JP (consultas semánticas normales)
         logger.info("🔄 Usando procesamiento HÍBRIDO con documentos de la JP")
         with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(procesar_consulta_hibrida, mensaje, conversation_history)
-            resultado = future.result(timeout=timeout_segundos)
+            with span('hibrido'):
+                # copy_context: los spans del hilo trabajador quedan en la traza del request
+                future = executor.submit(contextvars.copy_context().run, procesar_consulta_hibrida, mensaje, conversation_history)
+                resultado = future.result(timeout=timeout_segundos)
             return resultado
     except ThreadTimeoutError:
         raise TimeoutError(f"Timeout después de {timeout_segundos} segundos")
@@ -1973,9 +1845,15 @@ def chat():
         if len(mensaje) > 1000:
             return jsonify({'error': 'Mensaje demasiado largo (máximo 1000 caracteres)'}), 400
         
+        metrics = get_metrics()
+
         # Rate limiting
         client_ip = get_client_ip()
-        if not check_rate_limit(client_ip):
+        with span('rate_limit'):
+            permitido = check_rate_limit(client_ip)
+        if not permitido:
+            metrics.inc('chat_rate_limited_total')
+            metrics.inc('chat_requests_total', sistema_usado='rate_limit', status='429')
             return jsonify({
                 'error': f'Demasiadas solicitudes. Límite: {CONFIG["RATE_LIMIT_MESSAGES"]} por minuto',
                 'retry_after': CONFIG['RATE_LIMIT_WINDOW']
@@ -1997,7 +1875,12 @@ def chat():
             if CONFIG.get('MEMORY_ENABLED') and MEMORY_AVAILABLE:
                 usuario = session.get('user_id', 'anonimo') if auth_disponible else 'test_user'
                 logger.info(f"🔍 Intentando recuperar historial completo para usuario: {usuario}")
-                ctx = get_user_memory_context(usuario, window=10)  # Más entradas para mejor contexto
+                # Turnos previos más relacionados con la pregunta, dentro del presupuesto de tokens
+                with span('memoria') as sp:
+                    ctx = select_memory_context(usuario, mensaje, max_turns=CONFIG['CONTEXT_WINDOW'],
+                                                token_budget=CONFIG['MEMORY_TOKEN_BUDGET'])
+                    if sp is not None:
+                        sp.setdefault('attrs', {})['turnos'] = len(ctx)
                 logger.info(f"🔍 Historial recuperado: {len(ctx) if ctx else 0} entradas")
                 if ctx:
                     conversation_history = ctx
@@ -2008,10 +1891,13 @@ def chat():
         # ✅ PROCESAR CONSULTA CON TIMEOUT ROBUSTO Y HISTORIAL
         try:
             # Pasar el historial completo al procesador
-            resultado = procesar_con_timeout(mensaje, timeout_segundos=REQUEST_TIMEOUT, conversation_history=conversation_history)
+            with span('procesamiento'):
+                resultado = procesar_con_timeout(mensaje, timeout_segundos=REQUEST_TIMEOUT, conversation_history=conversation_history)
             
         except TimeoutError:
             logger.warning(f"⏰ Timeout procesando consulta: '{mensaje[:30]}...'")
+            metrics.inc('chat_timeouts_total')
+            metrics.inc('chat_requests_total', sistema_usado='timeout', status='408')
             return jsonify({
                 'error': 'La consulta tardó demasiado en procesarse. Por favor, simplifique su pregunta.',
                 'timeout': True
@@ -2041,22 +1927,24 @@ def chat():
         # ✅ GUARDAR CONVERSACIÓN EN SQLITE SIMPLE
         usuario = session.get('user_id', 'anonimo') if auth_disponible else 'test_user'
 
-        # Siempre guardar conversación
-        try:
-            guardar_conversacion_simple(usuario, mensaje, resultado['respuesta'])
-        except Exception as e:
-            logger.warning(f"⚠️ Error guardando conversación: {e}")
-            guardar_conversacion_simple(usuario, mensaje, resultado['respuesta'])
+        with span('logging'):
+            # Siempre guardar conversación
+            try:
+                guardar_conversacion_simple(usuario, mensaje, resultado['respuesta'])
+            except Exception as e:
+                logger.warning(f"⚠️ Error guardando conversación: {e}")
+                guardar_conversacion_simple(usuario, mensaje, resultado['respuesta'])
 
-        # Log para analytics (y posible aprendizaje explícito)
-        saved_learning_id = log_consulta(mensaje, resultado['respuesta'], {
-            'sistema_usado': sistema_usado,
-            'confianza': confianza,
-            'tiempo_procesamiento': tiempo_total,
-            'client_ip': client_ip
-        })
+            # Log para analytics (y posible aprendizaje explícito)
+            saved_learning_id = log_consulta(mensaje, resultado['respuesta'], {
+                'sistema_usado': sistema_usado,
+                'confianza': confianza,
+                'tiempo_procesamiento': tiempo_total,
+                'client_ip': client_ip
+            })
 
         clean = build_clean_response(resultado, tiempo_total)
+        clean['metrics']['trace_id'] = current_trace_id()
 
         # Si se guardó un aprendizaje explícito, incluir confirmación en la respuesta
         if saved_learning_id:
@@ -2073,10 +1961,14 @@ def chat():
             except Exception as e:
                 logger.warning(f"⚠️ No se pudo añadir confirmación de aprendizaje a la respuesta: {e}")
 
+        metrics.observe('chat_request_duration_seconds', time.time() - inicio_tiempo, sistema_usado=sistema_usado)
+        metrics.observe('chat_confidence', confianza or 0.0, sistema_usado=sistema_usado)
+        metrics.inc('chat_requests_total', sistema_usado=sistema_usado, status='200')
         return jsonify(clean)
         
     except Exception as e:
         tiempo_total = time.time() - inicio_tiempo
+        get_metrics().inc('chat_requests_total', sistema_usado='error', status='500')
         logger.error(f"❌ Error crítico en endpoint chat: {e}")
         logger.error(f"📝 Traceback: {traceback.format_exc()}")
         
@@ -2101,6 +1993,7 @@ def chat_test():
         try:
             resultado = procesar_con_timeout(mensaje, timeout_segundos=REQUEST_TIMEOUT)
         except TimeoutError:
+            get_metrics().inc('chat_timeouts_total')
             return jsonify({'error': 'Timeout procesando consulta'}), 408
 
         if not isinstance(resultado, dict) or 'respuesta' not in resultado:
@@ -2108,6 +2001,7 @@ def chat_test():
 
         tiempo_total = time.time() - inicio_tiempo
         clean = build_clean_response(resultado, tiempo_total)
+        clean['metrics']['trace_id'] = current_trace_id()
         return jsonify(clean)
 
     except Exception as e:
@@ -2189,25 +2083,8 @@ def log_consulta(consulta: str, respuesta: str, metadata: Dict = None) -> Option
                 logger.warning(f"⚠️ Error detectando/aplicando aprendizaje explícito: {e}")
             # -----------------------------------------------------------
             
-            # Registrar métricas de rendimiento
-            if metadata:
-                log_performance_metric(
-                    metric_type='response_time',
-                    metric_value=metadata.get('tiempo_procesamiento', 0.0),
-                    specialist_area=metadata.get('sistema_usado'),
-                    context_data=json.dumps({
-                        'consulta_length': len(consulta),
-                        'respuesta_length': len(respuesta),
-                        'confianza': metadata.get('confianza', 0.0)
-                    })
-                )
-                
-                log_performance_metric(
-                    metric_type='confidence_score',
-                    metric_value=metadata.get('confianza', 0.0),
-                    specialist_area=metadata.get('sistema_usado')
-                )
-                
+            # Latencia y confianza: histogramas de core.metrics (registrados en /chat)
+
         except Exception as learning_error:
             logger.warning(f"⚠️ Error en logging de aprendizaje: {learning_error}")
             # No afectar el funcionamiento principal
@@ -2347,7 +2224,7 @@ def change_password():
     
     try:
         # Usar el sistema de autenticación SQLite para cambiar la contraseña
-        change_result = simple_auth.change_password(username, current_password, new_password)
+        change_result = get_auth().change_password(username, current_password, new_password)
         
         if change_result.get('success', False):
             logger.info(f"✅ Contraseña actualizada exitosamente para: {username}")
@@ -2373,6 +2250,35 @@ def static_change_password_redirect():
 
 # ===== RUTAS DE API =====
 
+def contar_chunks_indexados() -> Dict:
+    """Chunks realmente indexados: filas de fts_chunks y vectores del índice FAISS"""
+    conteo = {'fts': 0, 'faiss': 0}
+    try:
+        if get_capabilities(resolve_learning_db_path()).has_table('fts_chunks'):
+            conn = sqlite3.connect(resolve_learning_db_path())
+            try:
+                conteo['fts'] = conn.execute("SELECT COUNT(*) FROM fts_chunks").fetchone()[0]
+            finally:
+                conn.close()
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo contar fts_chunks: {e}")
+    indice = getattr(services.peek('retriever'), 'index', None)
+    if indice is not None:
+        conteo['faiss'] = int(indice.ntotal)
+    return conteo
+
+def resumen_latencias() -> Dict:
+    """p50/p95/p99 (segundos) de /chat por sistema_usado"""
+    filas = get_metrics().summary().get('chat_request_duration_seconds', [])
+    return {f['labels'].get('sistema_usado', 'desconocido'): {k: f[k] for k in ('count', 'p50', 'p95', 'p99', 'max')}
+            for f in filas}
+
+@app.route('/metrics')
+def metrics_prometheus():
+    """Exposición de métricas en formato de texto de Prometheus"""
+    return app.response_class(get_metrics().render_prometheus(),
+                              content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/stats')
 def api_stats():
     """Estadísticas del sistema"""
@@ -2381,7 +2287,7 @@ def api_stats():
             stats = {
                 'version': 'v3.2_hibrido_avanzado_FAISS',
                 'sistema_hibrido_avanzado': True,
-                'chunks_indexados': 735,
+                'chunks_indexados': contar_chunks_indexados(),
                 'sistema_activo': 'FAISS + FTS5',
                 'azure_openai': 'Configurado'
             }
@@ -2391,6 +2297,7 @@ def api_stats():
                 'sistema_hibrido_avanzado': False,
                 'error': 'Sistema no disponible'
             }
+        stats['latencias'] = resumen_latencias()
         
         return jsonify(stats)
     except Exception as e:
@@ -2405,7 +2312,7 @@ def api_diagnostico():
             'version_app': version_sistema,
             'sistema_hibrido_disponible': sistema_hibrido_disponible,
             'auth_disponible': auth_disponible,
-            'openai_disponible': client is not None,
+            'openai_disponible': get_openai_client() is not None,
             'configuracion': {
                 'rate_limit': CONFIG['RATE_LIMIT_MESSAGES'],
                 'session_timeout': CONFIG['SESSION_TIMEOUT'],
@@ -2413,6 +2320,12 @@ def api_diagnostico():
                 'request_timeout': REQUEST_TIMEOUT,
                 'openai_timeout': OPENAI_TIMEOUT
             },
+            'write_behind': get_writer().stats(),
+            'arranque': services.report(),
+            'memoria_cache': get_memory_cache().stats() if MEMORY_AVAILABLE else None,
+            'auth_kdf': get_password_hasher().stats(),
+            'rate_limit': rate_limiter.stats(),
+            'latencias': resumen_latencias(),
             'python_version': f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}",
             'variables_entorno': {
                 'OPENAI_MODEL': os.getenv('OPENAI_MODEL', 'No configurado'),
@@ -2426,7 +2339,7 @@ def api_diagnostico():
             try:
                 diagnostico_info['sistema_hibrido_avanzado'] = {
                     'estado': 'Activo',
-                    'chunks_indexados': 735,
+                    'chunks_indexados': contar_chunks_indexados(),
                     'tipo_indice': 'FAISS + FTS5',
                     'modelo_embeddings': 'all-MiniLM-L6-v2'
                 }
@@ -2479,6 +2392,55 @@ def admin_ingest_conversations():
         logger.error(f"❌ Error admin_ingest_conversations: {e}")
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
+@app.route('/admin/compact_faqs', methods=['POST'])
+@login_required
+def admin_compact_faqs():
+    """Endpoint admin para fusionar FAQs casi duplicadas y recortar las menos usadas.
+    Parámetros JSON opcionales: {"threshold": 0.7, "max_entries": 5000, "dry_run": true}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+
+        from ai_system.faqs import compact_faqs, DEFAULT_THRESHOLD, DEFAULT_MAX_ENTRIES
+
+        result = compact_faqs(threshold=float(data.get('threshold', DEFAULT_THRESHOLD)),
+                              max_entries=data.get('max_entries', DEFAULT_MAX_ENTRIES),
+                              dry_run=bool(data.get('dry_run', False)))
+        return jsonify({'status': 'ok', 'result': result})
+    except Exception as e:
+        logger.error(f"❌ Error admin_compact_faqs: {e}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+@app.route('/api/exportar_datos')
+@login_required
+def api_exportar_datos():
+    """Exportar los datos del usuario autenticado (conversaciones, mensajes y aprendizajes).
+    La respuesta se genera por lotes mientras se descarga, con memoria constante.
+    Parámetro opcional: ?format=ndjson (por defecto) | zip
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'status': 'error', 'error': 'Sesión sin usuario'}), 401
+    formato = request.args.get('format', 'ndjson')
+    if formato not in ('ndjson', 'zip'):
+        return jsonify({'status': 'error', 'error': 'format debe ser ndjson o zip'}), 400
+    try:
+        from ai_system.privacy import stream_user_export_ndjson, stream_user_export_zip
+    except Exception as e:
+        logger.error(f"❌ Error cargando ai_system.privacy: {e}")
+        return jsonify({'status': 'error', 'error': 'Exportación no disponible'}), 500
+
+    if formato == 'zip':
+        cuerpo, mimetype = stream_user_export_zip(user_id), 'application/zip'
+    else:
+        cuerpo, mimetype = stream_user_export_ndjson(user_id), 'application/x-ndjson'
+    logger.info(f"📦 Exportación de datos ({formato}) para {user_id}")
+    nombre = f"mis_datos_{datetime.now().strftime('%Y%m%d')}.{formato}"
+    return Response(stream_with_context(cuerpo), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{nombre}"',
+                             # Sin buffering en el proxy: los bloques salen según se generan
+                             'X-Accel-Buffering': 'no'})
+
 # ===== MANEJO DE ARCHIVOS ESTÁTICOS OPTIMIZADO =====
 
 @app.route('/favicon.ico')
@@ -2534,6 +2496,7 @@ def handle_gateway_timeout(e):
 
 @app.errorhandler(429)
 def rate_limit_error(error):
+    get_metrics().inc('chat_rate_limited_total')
     return jsonify({
         'error': 'Demasiadas solicitudes',
         'message': 'Por favor espere antes de hacer otra consulta',
@@ -2541,6 +2504,23 @@ def rate_limit_error(error):
     }), 429
 
 
+# ===== HILOS DE FONDO Y PRECALENTAMIENTO DE SERVICIOS =====
+def iniciar_servicios_de_fondo():
+    """Rollup de métricas y precalentamiento de servicios (hilos propios del proceso).
+
+    Bases, cliente OpenAI e índice FAISS se construyen en un hilo de fondo mientras
+    el servidor ya acepta conexiones (SERVICES_WARMUP=false lo desactiva).
+    """
+    get_metrics().start_rollup(resolve_learning_db_path(), float(os.getenv('METRICS_ROLLUP_SECONDS', '60')))
+    if os.getenv('SERVICES_WARMUP', 'true').lower() == 'true':
+        services.warmup()
+
+services.mark_ready()
+# Bajo gunicorn (wsgi.py) el maestro no arranca hilos antes del fork: cada worker
+# llama a iniciar_servicios_de_fondo() en post_fork
+if os.getenv('APP_PREFORK', 'false').lower() != 'true':
+    iniciar_servicios_de_fondo()
+
 # ===== STARTUP OPTIMIZADO =====
 
 if __name__ == '__main__':
@@ -2558,7 +2538,7 @@ if __name__ == '__main__':
     print(f"   🔧 Sistema: {version_sistema}")
     print(f"   🔒 Auth: {'✅ Activado' if auth_disponible else '❌ Desactivado'}")
     print(f"   🚀 Híbrido: {'✅ Activo' if sistema_hibrido_disponible else '❌ Fallback'}")
-    print(f"   🤖 OpenAI: {'✅ Configurado' if client else '❌ No disponible'}")
+    print(f"   🤖 OpenAI: {'✅ Configurado' if get_openai_client() else '❌ No disponible'}")
     print(f"   ⚡ Rate Limit: {CONFIG['RATE_LIMIT_MESSAGES']} req/min")
     print(f"   ⏰ Timeouts: Request={REQUEST_TIMEOUT}s, OpenAI={OPENAI_TIMEOUT}s")
     
@@ -2,8 +2,14 @@
 =======================================================================
 AUTH.PY - SISTEMA DE AUTENTICACIÓN SQLite PARA JP_LEGALBOT v3.2 
 =======================================================================
-Sistema de autenticación basado en SQLite que se inicializa automáticamente
-en Render y crea usuarios por defecto.
+Sistema de autenticación basado en SQLite.
+
+Importar este módulo no toca la base: la instancia compartida se crea en el
+primer uso (`get_auth()`) y la tabla `usuarios` se crea con la primera
+conexión. Los usuarios por defecto ya no se crean solos; se siembran con el
+comando explícito:
+
+    python -m core.auth bootstrap
 
 🆕 VERSIÓN ACTUALIZADA - 25/SEP/2025 - SIN SQL SERVER
 100% SQLite - Sin fallbacks - Inicialización automática garantizada
@@ -11,96 +17,76 @@ en Render y crea usuarios por defecto.
 """
 
 import sqlite3
-import hashlib
 import os
+import threading
 from typing import Optional, Dict
 from datetime import datetime
 
+from core.passwords import get_password_hasher, PasswordHasherBusy
+
+USUARIOS_DB_PATH = os.getenv('USUARIOS_DB') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database', 'Usuarios.db')
+
+DEFAULT_USERS = [
+    ("admin@juntaplanificacion.pr.gov", "admin123"),
+    ("melendez_ma@jp.pr.gov", "admin123")
+]
+
 class SimpleAuth:
-    """Sistema de autenticación SQLite con inicialización automática"""
+    """Sistema de autenticación SQLite (la tabla se crea con la primera conexión)"""
     
-    def __init__(self):
-        # Configuración de la base de datos SQLite
-        self.db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'Usuarios.db')
-        
-        # Crear directorio database si no existe
-        db_dir = os.path.dirname(self.db_path)
-        os.makedirs(db_dir, exist_ok=True)
-        
-        # Inicializar base de datos automáticamente si no existe
-        if not os.path.exists(self.db_path):
-            print(f"🔧 Creando base de datos de usuarios: {self.db_path}")
-            self._init_database()
-        
-        print("🚨 NUEVA VERSIÓN AUTH.PY - 25/SEP/2025 - 100% SQLite")
-        print("✅ Sistema de autenticación SQLite inicializado")
-        print(f"📁 Base de datos: {self.db_path}")
-        print("🔥 NO MORE SQL SERVER - SQLITE ONLY!")
-        
-        # Verificar conexión y crear usuarios por defecto si es necesario
-        self._test_connection()
-        self._ensure_default_users()
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or USUARIOS_DB_PATH
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
     
-    def _test_connection(self):
-        """Verifica la conexión a la base de datos SQLite"""
-        try:
-            conn = self._get_connection()
-            if not conn:
-                print("⚠️ No se puede conectar a la base de datos SQLite")
+    def _ensure_schema(self):
+        """Crea el directorio y la tabla `usuarios` una sola vez por instancia"""
+        with self._schema_lock:
+            if self._schema_ready:
                 return
-            
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM usuarios")
-            count = cursor.fetchone()[0]
-            print(f"📊 Usuarios en base de datos: {count}")
-            
-            conn.close()
-            
-        except Exception as e:
-            print(f"⚠️ Error verificando base de datos: {e}")
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            try:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS usuarios (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        email TEXT UNIQUE NOT NULL,
+                        password_hash TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_login TIMESTAMP,
+                        is_active BOOLEAN DEFAULT 1
+                    )
+                """)
+                conn.commit()
+            finally:
+                conn.close()
+            self._schema_ready = True
     
-    def _init_database(self):
-        """Crea la base de datos y las tablas necesarias"""
+    def count_users(self) -> int:
+        """Número de usuarios registrados"""
+        conn = self._get_connection()
+        if not conn:
+            return 0
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Crear tabla de usuarios
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS usuarios (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    email TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1
-                )
-            """)
-            
-            conn.commit()
+            return conn.execute("SELECT COUNT(*) FROM usuarios").fetchone()[0]
+        finally:
             conn.close()
-            print("✅ Base de datos de usuarios creada exitosamente")
-            
-        except Exception as e:
-            print(f"❌ Error creando base de datos: {e}")
-            raise
     
-    def _ensure_default_users(self):
-        """Asegura que existan los usuarios por defecto"""
-        default_users = [
-            ("admin@juntaplanificacion.pr.gov", "admin123"),
-            ("melendez_ma@jp.pr.gov", "admin123")
-        ]
-        
+    def ensure_default_users(self) -> int:
+        """Crea los usuarios por defecto que falten; retorna cuántos creó"""
         conn = self._get_connection()
         if not conn:
             print("❌ No se puede conectar para crear usuarios por defecto")
-            return
+            return 0
         
+        created = 0
         try:
             cursor = conn.cursor()
             
-            for email, password in default_users:
+            for email, password in DEFAULT_USERS:
                 # Verificar si el usuario ya existe
                 cursor.execute("SELECT COUNT(*) FROM usuarios WHERE email = ?", (email,))
                 exists = cursor.fetchone()[0] > 0
@@ -112,22 +98,26 @@ class SimpleAuth:
                         INSERT INTO usuarios (email, password_hash, is_active)
                         VALUES (?, ?, 1)
                     """, (email, password_hash))
+                    created += 1
                     print(f"✅ Usuario creado: {email}")
                 else:
                     print(f"👤 Usuario ya existe: {email}")
             
             conn.commit()
-            conn.close()
             
         except Exception as e:
             print(f"❌ Error creando usuarios por defecto: {e}")
-            if conn:
-                conn.close()
+        
+        finally:
+            conn.close()
+        return created
     
     def _get_connection(self):
-        """Obtiene conexión a la base de datos SQLite"""
+        """Obtiene conexión a la base de datos SQLite (crea la tabla en el primer uso)"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            if not self._schema_ready:
+                self._ensure_schema()
+            conn = sqlite3.connect(self.db_path, timeout=10)
             conn.row_factory = sqlite3.Row  # Para acceder a columnas por nombre
             return conn
         except Exception as e:
@@ -135,14 +125,12 @@ class SimpleAuth:
             return None
     
     def _hash_password(self, password: str) -> str:
-        """Hash simple de contraseña"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hash scrypt con sal, calculado en el pool de core.passwords"""
+        return get_password_hasher().hash(password)
     
     def _verify_password(self, password: str, password_hash: str) -> bool:
-        """Verifica si una contraseña coincide con su hash"""
-        # Crear hash de la contraseña ingresada
-        input_hash = hashlib.sha256(password.encode()).hexdigest()
-        return input_hash == password_hash
+        """Verifica si una contraseña coincide con su hash (scrypt o SHA-256 antiguo)"""
+        return get_password_hasher().verify(password, password_hash)[0]
     
     def authenticate(self, username: str, password: str) -> Dict:
         """
@@ -180,20 +168,36 @@ class SimpleAuth:
                     'message': 'Usuario no encontrado o inactivo'
                 }
             
-            # Verificar contraseña usando hash
-            if not self._verify_password(password, user['password_hash']):
+            # Verificar contraseña en el pool del KDF (no en el hilo del request)
+            ok, needs_rehash = get_password_hasher().verify(password, user['password_hash'])
+            if not ok:
                 print(f"Contraseña incorrecta para usuario '{username}'")
                 return {
                     'success': False,
                     'message': 'Usuario o contraseña incorrectos'
                 }
             
-            # Actualizar último login
-            cursor.execute("""
-                UPDATE usuarios 
-                SET last_login = CURRENT_TIMESTAMP 
-                WHERE email = ?
-            """, (username,))
+            # Actualizar último login y migrar hashes SHA-256 (o scrypt con N menor)
+            new_hash = None
+            if needs_rehash:
+                try:
+                    new_hash = self._hash_password(password)
+                except PasswordHasherBusy as e:
+                    # La contraseña ya se verificó: la migración queda para otro login
+                    print(f"⚠️ Migración del hash de '{username}' pospuesta: {e}")
+            if new_hash:
+                cursor.execute("""
+                    UPDATE usuarios 
+                    SET password_hash = ?, last_login = CURRENT_TIMESTAMP 
+                    WHERE email = ?
+                """, (new_hash, username))
+                print(f"🔐 Hash de contraseña actualizado a scrypt para '{username}'")
+            else:
+                cursor.execute("""
+                    UPDATE usuarios 
+                    SET last_login = CURRENT_TIMESTAMP 
+                    WHERE email = ?
+                """, (username,))
             
             conn.commit()
             
@@ -210,6 +214,13 @@ class SimpleAuth:
                 }
             }
             
+        except PasswordHasherBusy as e:
+            print(f"⚠️ Verificación de contraseña rechazada para '{username}': {e}")
+            return {
+                'success': False,
+                'message': 'Servidor ocupado, intente de nuevo en unos segundos'
+            }
+        
         except Exception as e:
             print(f"Error en autenticación SQLite: {e}")
             return {
@@ -276,6 +287,13 @@ class SimpleAuth:
                     'message': 'No se pudo actualizar la contraseña'
                 }
                 
+        except PasswordHasherBusy as e:
+            print(f"⚠️ Cambio de contraseña rechazado para {username}: {e}")
+            return {
+                'success': False,
+                'message': 'Servidor ocupado, intente de nuevo en unos segundos'
+            }
+        
         except Exception as e:
             print(f"❌ Error cambiando contraseña para {username}: {e}")
             return {
@@ -286,12 +304,28 @@ class SimpleAuth:
         finally:
             conn.close()
 
-# Instancia global
-simple_auth = SimpleAuth()
+# Instancia compartida, creada en el primer uso
+_simple_auth: Optional[SimpleAuth] = None
+_simple_auth_lock = threading.Lock()
+
+def get_auth() -> SimpleAuth:
+    """Instancia compartida del proceso"""
+    global _simple_auth
+    if _simple_auth is None:
+        with _simple_auth_lock:
+            if _simple_auth is None:
+                _simple_auth = SimpleAuth()
+    return _simple_auth
+
+def __getattr__(name):
+    # Compatibilidad: `from core.auth import simple_auth` sigue funcionando
+    if name == 'simple_auth':
+        return get_auth()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def login_user(username: str, password: str) -> Dict:
     """Función simple para login"""
-    return simple_auth.authenticate(username, password)
+    return get_auth().authenticate(username, password)
 
 def is_logged_in(session) -> bool:
     """Verifica si hay una sesión activa"""
@@ -307,4 +341,26 @@ def login_required(f):
         if not is_logged_in(session):
             return redirect(url_for('login_page', next=request.url))
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+def bootstrap(db_path: Optional[str] = None) -> Dict:
+    """Crear la base de usuarios y sembrar los usuarios por defecto que falten"""
+    auth = SimpleAuth(db_path) if db_path else get_auth()
+    print(f"📁 Base de datos de usuarios: {auth.db_path}")
+    created = auth.ensure_default_users()
+    total = auth.count_users()
+    print(f"📊 Usuarios en base de datos: {total}")
+    return {'db_path': auth.db_path, 'creados': created, 'usuarios': total}
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Administración de la base de usuarios")
+    sub = parser.add_subparsers(dest='comando', required=True)
+    boot = sub.add_parser('bootstrap', help="Crear la base y los usuarios por defecto")
+    boot.add_argument('--db', help="Ruta de Usuarios.db (por defecto USUARIOS_DB o database/Usuarios.db)")
+    args = parser.parse_args()
+    if args.comando == 'bootstrap':
+        bootstrap(args.db)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+"""
+Métricas en proceso: histogramas de latencia y contadores.
+
+Los histogramas siguen el esquema de HDR Histogram: buckets log-lineales
+(32 sub-buckets por potencia de dos, error relativo ≤ 3%) sobre enteros, así
+que registrar un valor es un cálculo de índice y un incremento bajo un lock
+corto. Con ellos se obtienen p50/p95/p99 reales por `sistema_usado` y por
+etapa del pipeline sin escribir filas en SQLite por request.
+
+- `render_prometheus()` expone todo en formato de texto de Prometheus (/metrics).
+- `start_rollup()` guarda periódicamente en `metrics_rollup` el resumen del
+  intervalo (delta desde el rollup anterior) a través del write-behind.
+"""
+
+import atexit
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SUB_BITS = 5
+_SUB_COUNT = 1 << _SUB_BITS          # 32 sub-buckets por potencia de dos
+_MAX_SHIFT = 40                      # ~3.5e13 unidades: sobra para 1 hora en µs
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _bucket_index(value: int) -> int:
+    if value < 2 * _SUB_COUNT:
+        return max(value, 0)
+    shift = min(value.bit_length() - _SUB_BITS - 1, _MAX_SHIFT)
+    return shift * _SUB_COUNT + min(value >> shift, 2 * _SUB_COUNT - 1)
+
+
+def _bucket_bounds(index: int) -> Tuple[int, int]:
+    """[inferior, superior) del bucket `index` en unidades enteras."""
+    if index < 2 * _SUB_COUNT:
+        return index, index + 1
+    shift = index // _SUB_COUNT - 1
+    mantissa = index % _SUB_COUNT + _SUB_COUNT
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+class Histogram:
+    """Histograma log-lineal (estilo HDR) de valores no negativos.
+
+    `scale` convierte el valor observado a la unidad entera interna
+    (1e6 para segundos → µs, 1000 para una confianza 0..1).
+    """
+
+    def __init__(self, scale: float = 1e6):
+        self.scale = scale
+        self._counts = [0] * ((_MAX_SHIFT + 2) * _SUB_COUNT)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._interval_max = 0.0     # máximo desde el último rollup
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        if value is None or value < 0:
+            return
+        idx = _bucket_index(int(value * self.scale))
+        with self._lock:
+            self._counts[idx] += 1
+            self._count += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+            if value > self._interval_max:
+                self._interval_max = value
+
+    def snapshot(self) -> Tuple[List[int], int, float, float]:
+        with self._lock:
+            return list(self._counts), self._count, self._sum, self._max
+
+    def rollup_snapshot(self) -> Tuple[List[int], int, float, float]:
+        """Como `snapshot`, pero con el máximo del intervalo, que se reinicia."""
+        with self._lock:
+            interval_max, self._interval_max = self._interval_max, 0.0
+            return list(self._counts), self._count, self._sum, interval_max
+
+    def quantiles_from(self, counts: List[int], total: int, qs=QUANTILES) -> Dict[float, float]:
+        """Cuantiles (punto medio del bucket, en la unidad observada) sobre `counts`."""
+        out = {}
+        if total <= 0:
+            return {q: 0.0 for q in qs}
+        targets = sorted((max(1, int(q * total + 0.999999)), q) for q in qs)
+        seen = 0
+        t = 0
+        for idx, c in enumerate(counts):
+            if not c:
+                continue
+            seen += c
+            while t < len(targets) and seen >= targets[t][0]:
+                low, high = _bucket_bounds(idx)
+                out[targets[t][1]] = (low + high - 1) / 2.0 / self.scale
+                t += 1
+            if t == len(targets):
+                break
+        return out
+
+    def quantiles(self, qs=QUANTILES) -> Dict[float, float]:
+        counts, total, _, _ = self.snapshot()
+        return self.quantiles_from(counts, total, qs)
+
+
+class _Family:
+    def __init__(self, name: str, kind: str, help_text: str, scale: float = 1e6):
+        self.name = name
+        self.kind = kind            # 'summary' (histograma) o 'counter'
+        self.help = help_text
+        self.scale = scale
+        self.series: Dict[LabelKey, object] = {}
+
+
+class MetricsRegistry:
+    """Registro de histogramas y contadores etiquetados del proceso."""
+
+    def __init__(self):
+        self._families: Dict[str, _Family] = {}
+        self._lock = threading.Lock()
+        self._last_rollup: Dict[Tuple[str, LabelKey], Tuple[List[int], int, float]] = {}
+        self._rollup_thread: Optional[threading.Thread] = None
+        self._rollup_stop = threading.Event()
+        self._rollup_at = datetime.now()
+
+    # ----------------------------------------------------------- registro
+    def histogram(self, name: str, help_text: str = '', scale: float = 1e6):
+        with self._lock:
+            if name not in self._families:
+                self._families[name] = _Family(name, 'summary', help_text, scale)
+
+    def counter(self, name: str, help_text: str = ''):
+        with self._lock:
+            if name not in self._families:
+                self._families[name] = _Family(name, 'counter', help_text)
+
+    @staticmethod
+    def _key(labels: Dict[str, object]) -> LabelKey:
+        return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def _series(self, name: str, kind: str, labels: Dict) -> object:
+        fam = self._families.get(name)
+        if fam is None:
+            (self.histogram if kind == 'summary' else self.counter)(name)
+            fam = self._families[name]
+        key = self._key(labels)
+        series = fam.series.get(key)
+        if series is None:
+            with self._lock:
+                series = fam.series.get(key)
+                if series is None:
+                    series = Histogram(fam.scale) if fam.kind == 'summary' else [0]
+                    fam.series[key] = series
+        return series
+
+    # ------------------------------------------------------------- registro de valores
+    def observe(self, name: str, value: float, **labels):
+        self._series(name, 'summary', labels).observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        cell = self._series(name, 'counter', labels)
+        with self._lock:
+            cell[0] += amount
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Medir el bloque con `time.perf_counter` y registrarlo en `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    # ------------------------------------------------------------- lectura
+    def summary(self) -> Dict[str, List[Dict]]:
+        """{familia: [{labels, count, sum, p50, p95, p99, max}]} (contadores: {labels, value})."""
+        out = {}
+        for fam in list(self._families.values()):
+            rows = []
+            for key, series in list(fam.series.items()):
+                if fam.kind == 'counter':
+                    rows.append({'labels': dict(key), 'value': series[0]})
+                    continue
+                counts, total, total_sum, vmax = series.snapshot()
+                qs = series.quantiles_from(counts, total)
+                rows.append({'labels': dict(key), 'count': total, 'sum': round(total_sum, 6),
+                             'p50': round(qs[0.5], 6), 'p95': round(qs[0.95], 6),
+                             'p99': round(qs[0.99], 6), 'max': round(vmax, 6)})
+            out[fam.name] = rows
+        return out
+
+    def render_prometheus(self) -> str:
+        """Exposición en formato de texto de Prometheus 0.0.4."""
+        lines = []
+        for fam in sorted(list(self._families.values()), key=lambda f: f.name):
+            if fam.help:
+                lines.append(f"# HELP {fam.name} {fam.help}")
+            lines.append(f"# TYPE {fam.name} {fam.kind}")
+            for key, series in sorted(list(fam.series.items())):
+                if fam.kind == 'counter':
+                    lines.append(f"{fam.name}{_fmt_labels(key)} {_fmt_value(series[0])}")
+                    continue
+                counts, total, total_sum, _ = series.snapshot()
+                for q, v in sorted(series.quantiles_from(counts, total).items()):
+                    lines.append(f"{fam.name}{_fmt_labels(key + (('quantile', str(q)),))} {_fmt_value(v)}")
+                lines.append(f"{fam.name}_sum{_fmt_labels(key)} {_fmt_value(total_sum)}")
+                lines.append(f"{fam.name}_count{_fmt_labels(key)} {total}")
+        return "\n".join(lines) + "\n"
+
+    # ------------------------------------------------------------- rollup a SQLite
+    def rollup(self, db_path: str) -> int:
+        """Encolar en `metrics_rollup` el resumen del intervalo desde el último rollup."""
+        from core.write_behind import get_writer
+
+        started, ended = self._rollup_at, datetime.now()
+        self._rollup_at = ended
+        rows = 0
+        for fam in list(self._families.values()):
+            for key, series in list(fam.series.items()):
+                state_key = (fam.name, key)
+                if fam.kind == 'counter':
+                    value = series[0]
+                    prev = self._last_rollup.get(state_key, ([], 0, 0.0))[2]
+                    self._last_rollup[state_key] = ([], 0, value)
+                    if value == prev:
+                        continue
+                    values = (value - prev, value - prev, None, None, None, None)
+                else:
+                    counts, total, total_sum, vmax = series.rollup_snapshot()
+                    prev_counts, prev_total, prev_sum = self._last_rollup.get(state_key, (None, 0, 0.0))
+                    self._last_rollup[state_key] = (counts, total, total_sum)
+                    if total == prev_total:
+                        continue
+                    if prev_counts:
+                        counts = [c - p for c, p in zip(counts, prev_counts)]
+                    qs = series.quantiles_from(counts, total - prev_total)
+                    values = (total - prev_total, total_sum - prev_sum, qs[0.5], qs[0.95], qs[0.99], vmax)
+                get_writer().execute(db_path, """
+                    INSERT INTO metrics_rollup (period_start, period_end, metric, labels,
+                                                count, sum, p50, p95, p99, max)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (started.isoformat(timespec='seconds'), ended.isoformat(timespec='seconds'),
+                      fam.name, json.dumps(dict(key), ensure_ascii=False)) + values)
+                rows += 1
+        return rows
+
+    def start_rollup(self, db_path: str, interval_seconds: float = 60.0):
+        """Hilo de fondo que hace `rollup(db_path)` cada `interval_seconds` y al salir."""
+        if self._rollup_thread is not None and self._rollup_thread.is_alive():
+            return
+        if interval_seconds <= 0:
+            return
+
+        def run():
+            while not self._rollup_stop.wait(interval_seconds):
+                try:
+                    self.rollup(db_path)
+                except Exception as e:
+                    logger.warning(f"⚠️ Rollup de métricas falló: {e}")
+
+        self._rollup_thread = threading.Thread(target=run, name='metrics-rollup', daemon=True)
+        self._rollup_thread.start()
+
+        def final_rollup():
+            self._rollup_stop.set()
+            try:
+                self.rollup(db_path)
+            except Exception:
+                pass
+
+        atexit.register(final_rollup)
+
+
+def _fmt_labels(key: LabelKey) -> str:
+    if not key:
+        return ''
+    parts = []
+    for k, v in key:
+        v = v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _fmt_value(v: float) -> str:
+    if isinstance(v, int):
+        return str(v)
+    return repr(float(v))
+
+
+_registry: Optional[MetricsRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Registro compartido del proceso con las familias del chat declaradas."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                reg = MetricsRegistry()
+                reg.histogram('chat_request_duration_seconds',
+                              'Latencia total de /chat por sistema_usado')
+                reg.histogram('chat_stage_duration_seconds',
+                              'Latencia por etapa del pipeline de /chat')
+                reg.histogram('chat_confidence', 'Confianza reportada por sistema_usado', scale=1000)
+                reg.counter('chat_requests_total', 'Requests de /chat por sistema_usado y estado')
+                reg.counter('chat_cache_hits_total',
+                            'Respuestas servidas desde niveles precalculados (tablas, índices, curadas)')
+                reg.counter('chat_timeouts_total', 'Consultas que excedieron REQUEST_TIMEOUT')
+                reg.counter('chat_rate_limited_total', 'Requests rechazados con 429')
+                _registry = reg
+    return _registry
@@ -0,0 +1,292 @@
+"""
+Hash de contraseñas con scrypt y verificación en un pool dedicado.
+
+scrypt es deliberadamente caro en CPU y memoria (~16 MB con los valores por
+defecto). Para que una ráfaga de logins no le quite hilos al chat, todo
+cálculo del KDF corre en un ThreadPoolExecutor propio con pocos hilos
+(`AUTH_KDF_WORKERS`) y un límite de trabajos pendientes
+(`AUTH_KDF_MAX_PENDING`): si el pool está lleno, el login se rechaza de
+inmediato con `PasswordHasherBusy` en lugar de encolarse sin límite.
+`hashlib.scrypt` libera el GIL, así que los hilos del pool no frenan al resto.
+
+Formato almacenado: ``scrypt$<n>$<r>$<p>$<sal b64>$<hash b64>``. Los hashes
+SHA-256 antiguos (64 hex, sin sal) se siguen aceptando y `verify_password`
+indica que deben rehacerse; SimpleAuth los reemplaza en el siguiente login.
+Lo mismo ocurre con hashes scrypt de N menor al actual (nunca al revés, así
+dos procesos con N distinto no se pisan el hash en cada login).
+
+Con `AUTH_SCRYPT_TARGET_MS` el N se calibra una sola vez por despliegue: en
+el maestro de gunicorn antes del fork (wsgi.py) o en el precalentamiento, y
+nunca en el hilo de un request; hasta entonces se usa `AUTH_SCRYPT_N`. La
+calibración no pasa del tope de memoria (`AUTH_SCRYPT_MAX_MEM_MB`, por
+defecto 1/16 de la memoria del contenedor repartida entre los hilos del
+pool). ``python -m core.passwords`` la corre offline e imprime el N para
+fijarlo con `AUTH_SCRYPT_N`.
+
+Métricas: `auth_kdf_queue_seconds` (espera en cola), `auth_kdf_duration_seconds`
+(cálculo) y el contador `auth_kdf_rejected_total`.
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from core.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+SCRYPT_N = int(os.getenv('AUTH_SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.getenv('AUTH_SCRYPT_R', '8'))
+SCRYPT_P = int(os.getenv('AUTH_SCRYPT_P', '1'))
+# Si es > 0, N se calibra al arrancar para que un hash tarde ~este tiempo
+SCRYPT_TARGET_MS = float(os.getenv('AUTH_SCRYPT_TARGET_MS', '0'))
+# Memoria máxima de los hashes simultáneos del pool (MB); 0 = 1/16 de la disponible
+SCRYPT_MAX_MEM_MB = float(os.getenv('AUTH_SCRYPT_MAX_MEM_MB', '0'))
+KDF_WORKERS = int(os.getenv('AUTH_KDF_WORKERS', '2'))
+_MIN_N = 2 ** 14
+_MAX_N = 2 ** 20
+_SALT_BYTES = 16
+_DKLEN = 32
+_LEGACY_SHA256_LEN = 64
+
+
+class KDFParams(NamedTuple):
+    n: int
+    r: int
+    p: int
+
+
+class PasswordHasherBusy(RuntimeError):
+    """El pool de verificación está lleno o no respondió a tiempo."""
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, params: KDFParams, dklen: int = _DKLEN) -> bytes:
+    # OpenSSL exige maxmem >= 128*r*(N + 2 + p); se deja 1 MB de margen
+    maxmem = 128 * params.r * (params.n + 2 + params.p) + (1 << 20)
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=params.n, r=params.r, p=params.p,
+                          maxmem=maxmem, dklen=dklen)
+
+
+def default_params() -> KDFParams:
+    return KDFParams(SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+def hash_password(password: str, params: Optional[KDFParams] = None) -> str:
+    params = params or current_params()
+    salt = os.urandom(_SALT_BYTES)
+    digest = _scrypt(password, salt, params)
+    return f"scrypt${params.n}${params.r}${params.p}${_b64(salt)}${_b64(digest)}"
+
+
+def verify_password(password: str, stored: str, params: Optional[KDFParams] = None) -> Tuple[bool, bool]:
+    """Comprobar `password` contra `stored`.
+
+    Retorna (coincide, hay_que_rehacer): el segundo es True para hashes
+    SHA-256 antiguos o scrypt con N menor que el de `params`.
+    """
+    params = params or current_params()
+    stored = stored or ''
+    if stored.startswith('scrypt$'):
+        try:
+            _, n, r, p, salt, digest = stored.split('$')
+            stored_params = KDFParams(int(n), int(r), int(p))
+            expected = _unb64(digest)
+            actual = _scrypt(password, _unb64(salt), stored_params, dklen=len(expected))
+        except (ValueError, TypeError) as e:
+            logger.warning(f"⚠️ Hash scrypt con formato inválido: {e}")
+            return False, False
+        ok = hmac.compare_digest(actual, expected)
+        return ok, ok and stored_params.n < params.n
+    if len(stored) == _LEGACY_SHA256_LEN:
+        ok = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored.lower())
+        return ok, ok
+    return False, False
+
+
+def available_memory() -> Optional[int]:
+    """Bytes de memoria del proceso: límite del cgroup o, si no hay, la RAM física."""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            # "max" (v2) o un valor enorme (v1) significan sin límite
+            if value != 'max' and int(value) < 1 << 60:
+                return int(value)
+        except (OSError, ValueError):
+            pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def max_n_for_memory(r: int = SCRYPT_R, workers: int = KDF_WORKERS) -> int:
+    """Mayor N (potencia de dos) cuyos `workers` hashes simultáneos caben en el tope de memoria."""
+    if SCRYPT_MAX_MEM_MB > 0:
+        budget = SCRYPT_MAX_MEM_MB * (1 << 20)
+    else:
+        budget = (available_memory() or 0) / 16
+    n = _MIN_N
+    # scrypt usa ~128 * r * N bytes por hash
+    while n < _MAX_N and 128 * r * (n * 2) * max(1, workers) <= budget:
+        n *= 2
+    return n
+
+
+def calibrate(target_ms: float, r: int = SCRYPT_R, p: int = SCRYPT_P, max_n: Optional[int] = None) -> KDFParams:
+    """Menor N (potencia de dos, mínimo 2^14) cuyo hash tarda al menos `target_ms` en esta máquina.
+
+    N no pasa de `max_n` (por defecto, el tope de memoria de `max_n_for_memory`).
+    """
+    max_n = max_n or max_n_for_memory(r)
+    n = _MIN_N
+    while n < max_n:
+        started = time.perf_counter()
+        _scrypt('calibracion', b'0' * _SALT_BYTES, KDFParams(n, r, p))
+        if (time.perf_counter() - started) * 1000.0 >= target_ms:
+            break
+        n *= 2
+    return KDFParams(n, r, p)
+
+
+_params: Optional[KDFParams] = None
+_params_lock = threading.Lock()
+
+
+def calibrated_params() -> KDFParams:
+    """Parámetros del proceso, calibrando una sola vez si AUTH_SCRYPT_TARGET_MS > 0.
+
+    Se llama al arrancar (wsgi.py antes del fork, precalentamiento de la app);
+    los workers heredan el resultado.
+    """
+    global _params
+    if _params is None:
+        with _params_lock:
+            if _params is None:
+                params = default_params()
+                if SCRYPT_TARGET_MS > 0:
+                    params = calibrate(SCRYPT_TARGET_MS, params.r, params.p)
+                    logger.info(f"🔐 scrypt calibrado: N={params.n} (objetivo {SCRYPT_TARGET_MS:.0f} ms)")
+                _params = params
+    return _params
+
+
+def current_params() -> KDFParams:
+    """Parámetros calibrados si ya lo están; si no, los de entorno (nunca calibra)."""
+    return _params or default_params()
+
+
+class PasswordHasher:
+    """Pool acotado para hash y verificación de contraseñas."""
+
+    def __init__(self, params: Optional[KDFParams] = None, workers: int = 2, max_pending: int = 8,
+                 timeout: float = 10.0):
+        self._params = params
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='auth-kdf')
+        # Cupos = hilos ocupados + trabajos en cola
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._stats_lock = threading.Lock()
+        self._stats = {'completed': 0, 'rejected': 0, 'timeouts': 0}
+
+    @property
+    def params(self) -> KDFParams:
+        return self._params or current_params()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            get_metrics().inc('auth_kdf_rejected_total')
+            raise PasswordHasherBusy("pool de verificación lleno")
+        enqueued = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            get_metrics().observe('auth_kdf_queue_seconds', started - enqueued)
+            try:
+                return fn(*args)
+            finally:
+                get_metrics().observe('auth_kdf_duration_seconds', time.perf_counter() - started)
+                self._slots.release()
+                self._count('completed')
+
+        try:
+            future = self._executor.submit(job)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # El trabajo sigue y libera su cupo al terminar; el request no espera más
+            self._count('timeouts')
+            raise PasswordHasherBusy("la verificación excedió el tiempo límite")
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def hash(self, password: str) -> str:
+        return self._run(hash_password, password, self.params)
+
+    def verify(self, password: str, stored: str) -> Tuple[bool, bool]:
+        return self._run(verify_password, password, stored, self.params)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            out = dict(self._stats)
+        out.update({'workers': self.workers, 'max_pending': self.max_pending,
+                    'scrypt': self.params._asdict()})
+        return out
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+_hasher: Optional[PasswordHasher] = None
+_hasher_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Instancia compartida del proceso, configurada por variables de entorno."""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher(
+                    workers=KDF_WORKERS,
+                    max_pending=int(os.getenv('AUTH_KDF_MAX_PENDING', '8')),
+                    timeout=float(os.getenv('AUTH_KDF_TIMEOUT', '10')),
+                )
+    return _hasher
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Calibrar scrypt offline (imprime el N para AUTH_SCRYPT_N)")
+    ap.add_argument('--target-ms', type=float, default=SCRYPT_TARGET_MS or 250.0,
+                    help="Tiempo objetivo por hash en milisegundos")
+    args = ap.parse_args()
+    params = calibrate(args.target_ms)
+    print(f"AUTH_SCRYPT_N={params.n}  # r={params.r} p={params.p}, tope de memoria N={max_n_for_memory()}")
+
+
+if __name__ == '__main__':
+    main()
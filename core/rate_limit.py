@@ -0,0 +1,229 @@
+"""
+Rate limiter de ventana deslizante aproximada (sliding window counter).
+
+Por identificador (IP) se guardan solo tres números: la ventana fija actual,
+su contador y el de la ventana anterior. El conteo estimado de los últimos
+`window_seconds` es ``anterior * (1 - fracción transcurrida) + actual``, así
+que cada verificación es O(1) en tiempo y memoria, en lugar de filtrar una
+lista de timestamps.
+
+Backends:
+- `MemoryBackend`: dicts repartidos en shards, cada uno con su lock y un
+  límite LRU de claves. El estado es del proceso.
+- `SQLiteBackend`: una tabla en un archivo SQLite compartido por todos los
+  workers del nodo (por defecto en /dev/shm, es decir, en memoria). Con
+  gunicorn el límite se aplica a la suma de los workers y no a cada uno.
+
+Si el backend compartido falla (base bloqueada, disco), la verificación deja
+pasar el request y lo cuenta como error: el rate limiting no debe tumbar el chat.
+
+Métricas: `rate_limit_checks_total{backend, result=allowed|rejected|error}`.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from core.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# (ventana, contador actual, contador anterior)
+State = Tuple[int, int, int]
+
+
+def slide(state: Optional[State], window: int) -> State:
+    """Estado trasladado a la ventana `window` (los contadores viejos caducan)."""
+    if state is None:
+        return window, 0, 0
+    last, current, previous = state
+    if last == window:
+        return state
+    if last == window - 1:
+        return window, 0, current
+    return window, 0, 0
+
+
+def estimate(state: State, fraction: float) -> float:
+    """Requests estimados en la última ventana completa."""
+    _, current, previous = state
+    return previous * (1.0 - fraction) + current
+
+
+class MemoryBackend:
+    """Estado en memoria del proceso, con locks por shard y LRU acotado."""
+
+    name = 'memory'
+
+    def __init__(self, shards: int = 16, max_keys: int = 10000):
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+        self._max_per_shard = max(1, max_keys // shards)
+
+    def hit(self, key: str, window: int, fraction: float, limit: int) -> bool:
+        lock, states = self._shards[zlib.crc32(key.encode('utf-8')) % len(self._shards)]
+        with lock:
+            state = slide(states.get(key), window)
+            allowed = estimate(state, fraction) < limit
+            if allowed:
+                state = (state[0], state[1] + 1, state[2])
+            states[key] = state
+            states.move_to_end(key)
+            if len(states) > self._max_per_shard:
+                states.popitem(last=False)
+        return allowed
+
+    def size(self) -> int:
+        return sum(len(states) for _, states in self._shards)
+
+
+class SQLiteBackend:
+    """Estado compartido entre procesos en una tabla SQLite (una fila por clave)."""
+
+    name = 'sqlite'
+
+    def __init__(self, db_path: str, cleanup_every: int = 1000):
+        self.db_path = db_path
+        self.cleanup_every = cleanup_every
+        self._local = threading.local()
+        self._checks = 0
+        self._checks_lock = threading.Lock()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self) -> sqlite3.Connection:
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            con = sqlite3.connect(self.db_path, timeout=1.0, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            # Estado efímero: perder los últimos contadores en un corte de luz es aceptable
+            con.execute("PRAGMA synchronous=OFF")
+            self._local.con = con
+            self._ensure_schema(con)
+        return con
+
+    def _ensure_schema(self, con: sqlite3.Connection):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                con.execute("""CREATE TABLE IF NOT EXISTS rate_limit_windows (
+                                   key TEXT PRIMARY KEY,
+                                   window INTEGER NOT NULL,
+                                   current INTEGER NOT NULL,
+                                   previous INTEGER NOT NULL
+                               ) WITHOUT ROWID""")
+                self._schema_ready = True
+
+    def hit(self, key: str, window: int, fraction: float, limit: int) -> bool:
+        con = self._connection()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            row = con.execute("SELECT window, current, previous FROM rate_limit_windows WHERE key = ?",
+                              (key,)).fetchone()
+            state = slide(tuple(row) if row else None, window)
+            allowed = estimate(state, fraction) < limit
+            if allowed:
+                state = (state[0], state[1] + 1, state[2])
+            if allowed or row is None or tuple(row) != state:
+                con.execute("""INSERT INTO rate_limit_windows (key, window, current, previous)
+                               VALUES (?, ?, ?, ?)
+                               ON CONFLICT(key) DO UPDATE SET window = excluded.window,
+                                   current = excluded.current, previous = excluded.previous""",
+                            (key,) + state)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        self._maybe_cleanup(con, window)
+        return allowed
+
+    def _maybe_cleanup(self, con: sqlite3.Connection, window: int):
+        with self._checks_lock:
+            self._checks += 1
+            due = self._checks % self.cleanup_every == 0
+        if due:
+            # Claves sin actividad en las dos últimas ventanas ya no cuentan
+            con.execute("DELETE FROM rate_limit_windows WHERE window < ?", (window - 1,))
+
+    def size(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM rate_limit_windows").fetchone()[0]
+
+
+class RateLimiter:
+    """Límite de `max_requests` por identificador en `window_seconds` deslizantes."""
+
+    def __init__(self, max_requests: int = 30, window_seconds: int = 60, backend=None):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.backend = backend or MemoryBackend()
+        self._stats_lock = threading.Lock()
+        self._stats = {'allowed': 0, 'rejected': 0, 'errors': 0}
+        self._last_error_log = 0.0
+
+    def is_allowed(self, identifier: str, now: Optional[float] = None) -> bool:
+        """Registrar un request de `identifier`; False si supera el límite."""
+        now = time.time() if now is None else now
+        window, offset = divmod(now, self.window_seconds)
+        try:
+            allowed = self.backend.hit(identifier or '-', int(window), offset / self.window_seconds,
+                                       self.max_requests)
+        except Exception as e:
+            self._count('errors', 'error')
+            if now - self._last_error_log > 60:
+                self._last_error_log = now
+                logger.warning(f"⚠️ Rate limiter ({self.backend.name}) no disponible, se deja pasar: {e}")
+            return True
+        self._count('allowed' if allowed else 'rejected', 'allowed' if allowed else 'rejected')
+        return allowed
+
+    def _count(self, key: str, result: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+        get_metrics().inc('rate_limit_checks_total', backend=self.backend.name, result=result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            out = dict(self._stats)
+        try:
+            keys = self.backend.size()
+        except Exception:
+            keys = None
+        out.update({'backend': self.backend.name, 'keys': keys,
+                    'max_requests': self.max_requests, 'window_seconds': self.window_seconds})
+        return out
+
+
+def default_db_path() -> str:
+    """Archivo compartido del backend SQLite: en /dev/shm (memoria) si existe."""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm/jp_legalbot_rate_limit.db'
+    return os.path.join('database', 'rate_limit.db')
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Instancia compartida del proceso, configurada por variables de entorno."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                if os.getenv('RATE_LIMIT_BACKEND', 'memory').lower() == 'sqlite':
+                    backend = SQLiteBackend(os.getenv('RATE_LIMIT_DB') or default_db_path())
+                else:
+                    backend = MemoryBackend(shards=int(os.getenv('RATE_LIMIT_SHARDS', '16')),
+                                            max_keys=int(os.getenv('RATE_LIMIT_MAX_KEYS', '10000')))
+                _limiter = RateLimiter(
+                    max_requests=int(os.getenv('RATE_LIMIT_MESSAGES', '30')),
+                    window_seconds=int(os.getenv('RATE_LIMIT_WINDOW', '60')),
+                    backend=backend,
+                )
+    return _limiter
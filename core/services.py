@@ -0,0 +1,214 @@
+"""
+Registro de servicios perezosos y perfil de arranque.
+
+Los componentes pesados de la app (migración de las bases SQLite, cliente
+Azure OpenAI, HybridRetriever con su índice FAISS, AnswerEngine) se registran
+como fábricas y se construyen la primera vez que se piden o durante el
+precalentamiento en segundo plano (`warmup`), no al importar app.py. Así el
+proceso abre el puerto en cuanto Flask está listo y un reinicio en Render no
+deja 502 mientras se lee el índice.
+
+Cada servicio se construye una sola vez aunque varios hilos lo pidan a la vez
+(lock por servicio). Si la fábrica falla, el error se guarda y `get()` lanza
+`ServiceUnavailable` hasta que pasen `retry_seconds`; después se reintenta.
+
+El perfil de arranque guarda la duración de cada fase del import (`phase()`)
+y de cada construcción. `report()` lo devuelve para /api/diagnostico y
+``python -m core.services`` lo imprime para un módulo dado.
+
+Métricas: histograma `service_init_seconds{service=...}`.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from core.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+PENDING, BUILDING, READY, FAILED = 'pendiente', 'construyendo', 'listo', 'error'
+
+
+class ServiceUnavailable(RuntimeError):
+    """El servicio no está registrado o su construcción falló."""
+
+
+class _Service:
+    __slots__ = ('name', 'factory', 'warm', 'lock', 'instance', 'state', 'error', 'seconds', 'failed_at')
+
+    def __init__(self, name: str, factory: Callable[[], Any], warm: bool):
+        self.name = name
+        self.factory = factory
+        self.warm = warm
+        self.lock = threading.Lock()
+        self.instance = None
+        self.state = PENDING
+        self.error: Optional[BaseException] = None
+        self.seconds: Optional[float] = None
+        self.failed_at = 0.0
+
+
+class ServiceRegistry:
+    """Fábricas de componentes pesados, construidos bajo demanda una sola vez."""
+
+    def __init__(self, retry_seconds: float = 30.0):
+        self.retry_seconds = retry_seconds
+        self._services: Dict[str, _Service] = {}
+        self._phases: List[Tuple[str, float]] = []
+        self._created = time.perf_counter()
+        self._ready_seconds: Optional[float] = None
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._warmup_seconds: Optional[float] = None
+
+    # ----------------------------------------------------------- servicios
+    def register(self, name: str, factory: Callable[[], Any], warm: bool = True):
+        """Registrar `factory` bajo `name`. `warm=False` lo excluye del precalentamiento."""
+        self._services[name] = _Service(name, factory, warm)
+
+    def get(self, name: str) -> Any:
+        """Instancia del servicio, construyéndola si todavía no existe."""
+        svc = self._services.get(name)
+        if svc is None:
+            raise ServiceUnavailable(f"servicio no registrado: {name}")
+        if svc.state == READY:
+            return svc.instance
+        with svc.lock:
+            if svc.state == READY:
+                return svc.instance
+            if svc.state == FAILED and time.monotonic() - svc.failed_at < self.retry_seconds:
+                raise ServiceUnavailable(f"{name} no disponible: {svc.error}") from svc.error
+            return self._build(svc)
+
+    def _build(self, svc: _Service) -> Any:
+        svc.state = BUILDING
+        started = time.perf_counter()
+        try:
+            instance = svc.factory()
+        except Exception as e:
+            svc.seconds = time.perf_counter() - started
+            svc.state, svc.error, svc.failed_at = FAILED, e, time.monotonic()
+            logger.error(f"❌ Servicio '{svc.name}' falló tras {svc.seconds:.2f} s: {e}")
+            raise ServiceUnavailable(f"{svc.name} no disponible: {e}") from e
+        svc.seconds = time.perf_counter() - started
+        svc.instance, svc.error = instance, None
+        svc.state = READY
+        get_metrics().observe('service_init_seconds', svc.seconds, service=svc.name)
+        logger.info(f"⚙️ Servicio '{svc.name}' listo en {svc.seconds:.2f} s")
+        return instance
+
+    def peek(self, name: str) -> Any:
+        """Instancia si ya está construida; None si no (nunca la construye)."""
+        svc = self._services.get(name)
+        return svc.instance if svc is not None and svc.state == READY else None
+
+    def is_ready(self, name: str) -> bool:
+        svc = self._services.get(name)
+        return svc is not None and svc.state == READY
+
+    def warmup(self, names: Optional[Iterable[str]] = None, background: bool = True) -> Optional[threading.Thread]:
+        """Construir los servicios (por defecto, los registrados con warm=True) en orden de registro.
+
+        Con `background=True` corre en un hilo daemon y retorna el hilo; los
+        errores quedan registrados en el servicio y no detienen el resto.
+        """
+        if names is None:
+            names = [s.name for s in self._services.values() if s.warm]
+        names = list(names)
+
+        def run():
+            started = time.perf_counter()
+            for name in names:
+                try:
+                    self.get(name)
+                except ServiceUnavailable:
+                    pass
+            self._warmup_seconds = time.perf_counter() - started
+            logger.info(f"🔥 Precalentamiento terminado en {self._warmup_seconds:.2f} s ({', '.join(names)})")
+
+        if not background:
+            run()
+            return None
+        self._warmup_thread = threading.Thread(target=run, name='services-warmup', daemon=True)
+        self._warmup_thread.start()
+        return self._warmup_thread
+
+    # ------------------------------------------------------ perfil de arranque
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Medir una fase del arranque (imports, configuración)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases.append((name, time.perf_counter() - started))
+
+    def mark_ready(self):
+        """Marcar el fin del import de la app y registrar el resumen de fases."""
+        self._ready_seconds = time.perf_counter() - self._created
+        lentas = sorted(self._phases, key=lambda p: p[1], reverse=True)[:3]
+        logger.info(f"⏱️ App lista en {self._ready_seconds:.2f} s; fases más lentas: "
+                    + ', '.join(f"{n} {s:.2f} s" for n, s in lentas))
+
+    def report(self) -> Dict[str, Any]:
+        servicios = {}
+        for svc in self._services.values():
+            servicios[svc.name] = {
+                'estado': svc.state,
+                'segundos': round(svc.seconds, 4) if svc.seconds is not None else None,
+                'error': str(svc.error) if svc.error else None,
+            }
+        warming = self._warmup_thread is not None and self._warmup_thread.is_alive()
+        return {
+            'import_segundos': round(self._ready_seconds, 4) if self._ready_seconds is not None else None,
+            'fases': [{'fase': n, 'segundos': round(s, 4)} for n, s in self._phases],
+            'servicios': servicios,
+            'precalentamiento': {
+                'en_curso': warming,
+                'segundos': round(self._warmup_seconds, 4) if self._warmup_seconds is not None else None,
+            },
+        }
+
+
+_services: Optional[ServiceRegistry] = None
+_services_lock = threading.Lock()
+
+
+def get_services() -> ServiceRegistry:
+    """Instancia compartida del proceso, configurada por variables de entorno."""
+    global _services
+    if _services is None:
+        with _services_lock:
+            if _services is None:
+                _services = ServiceRegistry(retry_seconds=float(os.getenv('SERVICES_RETRY_SECONDS', '30')))
+    return _services
+
+
+def main():
+    import argparse
+    import importlib
+    import json
+
+    ap = argparse.ArgumentParser(description="Perfil de arranque: import de la app y construcción de servicios")
+    ap.add_argument('--module', default='app', help="Módulo a importar (por defecto app)")
+    ap.add_argument('--no-warmup', action='store_true', help="Solo medir el import, sin construir servicios")
+    args = ap.parse_args()
+    # El precalentamiento se hace aquí, en primer plano, para medirlo completo
+    os.environ['SERVICES_WARMUP'] = 'false'
+    started = time.perf_counter()
+    importlib.import_module(args.module)
+    import_seconds = time.perf_counter() - started
+    # Con `python -m` este archivo es __main__: el registro de la app vive en core.services
+    registry = importlib.import_module('core.services').get_services()
+    if not args.no_warmup:
+        registry.warmup(background=False)
+    report = registry.report()
+    report['import_modulo_segundos'] = round(import_seconds, 4)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
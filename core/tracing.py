@@ -0,0 +1,172 @@
+"""
+Trazas por request del pipeline de chat.
+
+Cada request instrumentado abre una traza con un `trace_id`; las etapas se
+envuelven con `span('nombre')` y quedan registradas (inicio relativo, duración,
+padre y atributos) en memoria. El contexto viaja en un `ContextVar`, así que
+los módulos de `ai_system` pueden abrir spans sin recibir la traza como
+parámetro; para hilos del ThreadPoolExecutor usar `contextvars.copy_context()`.
+
+Al cerrar, la traza se escribe como una línea JSON en `TRACE_JSONL_PATH` si
+sale en el muestreo (`TRACE_SAMPLE_RATE`) o si tardó más de `TRACE_SLOW_MS`.
+La escritura va por el write-behind para no bloquear la respuesta. Cada span
+alimenta además el histograma `chat_stage_duration_seconds` de core.metrics.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from core.metrics import get_metrics
+from core.write_behind import get_writer
+
+logger = logging.getLogger(__name__)
+
+TRACE_JSONL_PATH = os.getenv('TRACE_JSONL_PATH', os.path.join('logs', 'traces.jsonl'))
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.1'))
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '5000'))
+# Límite de spans por traza (protege la memoria ante bucles instrumentados)
+MAX_SPANS = 256
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('jp_trace', default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar('jp_span', default=None)
+_file_lock = threading.Lock()
+
+
+class Trace:
+    """Traza de un request: id, spans cerrados y decisión de muestreo."""
+
+    def __init__(self, name: str, sampled: Optional[bool] = None, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = datetime.now()
+        self._t0 = time.perf_counter()
+        self.sampled = (random.random() < TRACE_SAMPLE_RATE) if sampled is None else sampled
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _new_span_id(self) -> int:
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def _add(self, span: Dict):
+        with self._lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(span)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000.0
+
+    def to_dict(self, duration_ms: float) -> Dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s['start_ms'])
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'timestamp': self.started_at.isoformat(timespec='milliseconds'),
+            'duration_ms': round(duration_ms, 3),
+            'attrs': self.attrs,
+            'spans': spans,
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def start_trace(name: str, sampled: Optional[bool] = None, **attrs) -> Trace:
+    """Abrir una traza y hacerla la activa del contexto actual."""
+    trace = Trace(name, sampled=sampled, **attrs)
+    trace._tokens = (_current_trace.set(trace), _current_span.set(None))
+    return trace
+
+
+def finish_trace(trace: Optional[Trace], **attrs) -> Optional[Dict]:
+    """Cerrar `trace`, restaurar el contexto y encolarla al JSONL si corresponde."""
+    if trace is None:
+        return None
+    duration_ms = trace.elapsed_ms()
+    trace.attrs.update(attrs)
+    tokens = getattr(trace, '_tokens', None)
+    if tokens:
+        try:
+            _current_trace.reset(tokens[0])
+            _current_span.reset(tokens[1])
+        except ValueError:
+            # Cerrada desde otro contexto (p. ej. teardown en otro hilo)
+            _current_trace.set(None)
+            _current_span.set(None)
+        trace._tokens = None
+    if not (trace.sampled or duration_ms >= TRACE_SLOW_MS):
+        return None
+    record = trace.to_dict(duration_ms)
+    try:
+        get_writer().call(_append_jsonl, TRACE_JSONL_PATH, json.dumps(record, ensure_ascii=False, default=str))
+    except Exception as e:
+        logger.debug(f"No se pudo encolar la traza {trace.trace_id}: {e}")
+    return record
+
+
+def _append_jsonl(path: str, line: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with _file_lock:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Dict]]:
+    """Medir una etapa dentro de la traza activa.
+
+    Retorna el dict del span para añadir atributos dentro del bloque. Sin
+    traza activa (o fuera de un request) solo se registra el histograma.
+    """
+    trace = _current_trace.get()
+    start = time.perf_counter()
+    if trace is None:
+        try:
+            yield None
+        finally:
+            _observe_stage(name, time.perf_counter() - start)
+        return
+    record = {'span_id': trace._new_span_id(), 'parent_id': _current_span.get(), 'name': name,
+              'start_ms': round((start - trace._t0) * 1000.0, 3)}
+    if attrs:
+        record['attrs'] = dict(attrs)
+    token = _current_span.set(record['span_id'])
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_span.reset(token)
+        record['duration_ms'] = round(elapsed * 1000.0, 3)
+        trace._add(record)
+        _observe_stage(name, elapsed)
+
+
+def _observe_stage(name: str, seconds: float):
+    try:
+        get_metrics().observe('chat_stage_duration_seconds', seconds, stage=name)
+    except Exception:
+        pass
@@ -0,0 +1,264 @@
+"""
+Cola de escritura diferida (write-behind) para los logs del chat.
+
+Las inserciones de conversaciones, mensajes y métricas se encolan desde la
+ruta de respuesta y un hilo de fondo las aplica en lotes: una conexión por
+base de datos y un solo COMMIT por lote (group commit). La cola es acotada:
+si se llena, la escritura se descarta y se contabiliza en lugar de bloquear
+la respuesta. Al terminar el proceso se vacía la cola (atexit).
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Marcador interno para detener el hilo escritor en stop()
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Cola acotada de escrituras SQLite aplicadas por un hilo en group commits."""
+
+    def __init__(self, max_queue: int = 10000, batch_size: int = 256,
+                 flush_interval: float = 0.05, lag_warning_seconds: float = 2.0):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lag_warning_seconds = lag_warning_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._connections: Dict[str, sqlite3.Connection] = {}
+        self._connection_hooks: List[Callable[[sqlite3.Connection], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+        self._last_drop_warning = 0.0
+        self._stats = {
+            'enqueued': 0, 'written': 0, 'failed': 0, 'dropped': 0,
+            'batches': 0, 'max_lag_ms': 0.0, 'last_lag_ms': 0.0, 'lagging_batches': 0,
+        }
+        self._stats_lock = threading.Lock()
+
+    # ------------------------------------------------------------------ API
+    def execute(self, db_path: str, sql: str, params: Sequence[Any] = ()) -> bool:
+        """Encolar un INSERT/UPDATE. Retorna False si la escritura fue descartada."""
+        return self._put(('sql', db_path, sql, tuple(params)))
+
+    def execute_many(self, db_path: str, sql: str, seq_of_params: Sequence[Sequence[Any]]) -> bool:
+        """Encolar un `executemany` como una sola escritura (mismo lote y COMMIT)."""
+        rows = [tuple(p) for p in seq_of_params]
+        if not rows:
+            return True
+        return self._put(('many', db_path, sql, rows))
+
+    def call(self, fn: Callable, *args, **kwargs) -> bool:
+        """Encolar una función a ejecutar en el hilo escritor (fuera de las transacciones)."""
+        return self._put(('call', fn, args, kwargs))
+
+    def add_connection_hook(self, hook: Callable[[sqlite3.Connection], None]):
+        """Aplicar `hook(con)` a cada conexión del escritor (p. ej. registrar funciones SQL).
+
+        Registrar antes de encolar escrituras que lo necesiten.
+        """
+        if hook not in self._connection_hooks:
+            self._connection_hooks.append(hook)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Esperar a que todo lo encolado hasta ahora quede escrito."""
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        done = threading.Event()
+        try:
+            self._queue.put(('flush', done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stop(self, timeout: float = 5.0):
+        """Vaciar la cola y detener el hilo escritor."""
+        if self._stopped:
+            return
+        self.flush(timeout)
+        self._stopped = True
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        pending = self._queue.qsize()
+        if pending:
+            logger.warning(f"⚠️ Write-behind detenido con {pending} escrituras pendientes")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            out = dict(self._stats)
+        out['queue_depth'] = self._queue.qsize()
+        out['max_queue'] = self.max_queue
+        return out
+
+    # ------------------------------------------------------------ internals
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def _put(self, item) -> bool:
+        if self._stopped:
+            # Después del apagado, escribir de forma síncrona para no perder datos
+            self._apply_batch([(time.monotonic(), item)])
+            return True
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((time.monotonic(), item))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['dropped'] += 1
+                dropped = self._stats['dropped']
+            now = time.monotonic()
+            if now - self._last_drop_warning > 10:
+                self._last_drop_warning = now
+                logger.warning(f"⚠️ Cola write-behind llena ({self.max_queue}); escrituras descartadas: {dropped}")
+            return False
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval * 20)
+            except queue.Empty:
+                if self._stopped:
+                    break
+                continue
+            if first is _STOP:
+                break
+            batch, waiters = [], []
+            closed = self._collect(first, batch, waiters)
+            deadline = time.monotonic() + self.flush_interval
+            while not closed and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.put_nowait(_STOP)
+                    break
+                closed = self._collect(item, batch, waiters)
+            if batch:
+                self._apply_batch(batch)
+            for done in waiters:
+                done.set()
+        self._close_connections()
+
+    @staticmethod
+    def _collect(item, batch, waiters) -> bool:
+        """Agregar `item` al lote; True si es una petición de flush (cerrar el lote ya)."""
+        if item[0] == 'flush':
+            waiters.append(item[1])
+            return True
+        batch.append(item)
+        return False
+
+    def _connection(self, db_path: str) -> sqlite3.Connection:
+        con = self._connections.get(db_path)
+        if con is None:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            con = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+            con.execute("PRAGMA synchronous=NORMAL")
+            for hook in self._connection_hooks:
+                hook(con)
+            self._connections[db_path] = con
+        return con
+
+    def _close_connections(self):
+        for con in self._connections.values():
+            try:
+                con.close()
+            except Exception:
+                pass
+        self._connections.clear()
+
+    def _apply_batch(self, batch):
+        written = failed = 0
+        touched = {}
+        calls = []
+        for _enqueued_at, item in batch:
+            if item[0] == 'call':
+                calls.append(item)
+                continue
+            kind, db_path, sql, params = item
+            try:
+                con = self._connection(db_path)
+                if kind == 'many':
+                    con.executemany(sql, params)
+                else:
+                    con.execute(sql, params)
+                touched[db_path] = touched.get(db_path, 0) + 1
+            except Exception as e:
+                failed += 1
+                logger.debug(f"Write-behind: escritura omitida en {db_path}: {e}")
+        for db_path, count in touched.items():
+            con = self._connections[db_path]
+            try:
+                con.commit()
+                written += count
+            except Exception as e:
+                failed += count
+                logger.error(f"❌ Write-behind: error en commit de {db_path}: {e}")
+                try:
+                    con.rollback()
+                except Exception:
+                    pass
+                self._connections.pop(db_path, None)
+        for _, fn, args, kwargs in calls:
+            try:
+                fn(*args, **kwargs)
+                written += 1
+            except Exception as e:
+                failed += 1
+                logger.warning(f"⚠️ Write-behind: tarea {getattr(fn, '__name__', fn)} falló: {e}")
+
+        lag = (time.monotonic() - batch[0][0]) * 1000.0
+        with self._stats_lock:
+            self._stats['written'] += written
+            self._stats['failed'] += failed
+            self._stats['batches'] += 1
+            self._stats['last_lag_ms'] = round(lag, 2)
+            self._stats['max_lag_ms'] = round(max(self._stats['max_lag_ms'], lag), 2)
+            if lag > self.lag_warning_seconds * 1000.0:
+                self._stats['lagging_batches'] += 1
+        if lag > self.lag_warning_seconds * 1000.0:
+            logger.warning(f"⚠️ Write-behind con retraso: {lag:.0f} ms para un lote de {len(batch)} escrituras "
+                           f"(cola: {self._queue.qsize()})")
+
+
+_writer: Optional[WriteBehindQueue] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> WriteBehindQueue:
+    """Instancia compartida del proceso, configurada por variables de entorno."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteBehindQueue(
+                    max_queue=int(os.getenv('WRITE_BEHIND_MAX_QUEUE', '10000')),
+                    batch_size=int(os.getenv('WRITE_BEHIND_BATCH', '256')),
+                    flush_interval=float(os.getenv('WRITE_BEHIND_FLUSH_MS', '50')) / 1000.0,
+                )
+                atexit.register(_writer.stop)
+    return _writer
@@ -1,4 +1,6 @@
 -- Base de datos mínima para conocimiento y FAQs
+-- Referencia: el esquema vigente (con migraciones) está en ai_system/schema.py;
+-- `python -m ai_system.schema --db <ruta>` lo aplica.
 PRAGMA journal_mode=WAL;
 
 CREATE TABLE IF NOT EXISTS knowledge_facts(
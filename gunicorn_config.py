@@ -0,0 +1,88 @@
+"""
+Configuración de gunicorn para producción (pre-fork).
+
+Un worker por núcleo disponible: la recuperación, el escaneo PII y el armado
+de respuestas consumen CPU con el GIL tomado, así que escalan por procesos.
+Dentro de cada worker, hilos (gthread) para las esperas de red a Azure
+OpenAI, que liberan el GIL. Los núcleos se leen de la afinidad del proceso y
+de la cuota de CPU del cgroup, que es lo que realmente tiene un contenedor en
+Render aunque `os.cpu_count()` reporte los del host.
+
+La app se precarga en el maestro (`wsgi.py`) y los workers comparten sus
+recursos de solo lectura copy-on-write; cada worker crea sus clientes e hilos
+en `post_fork`.
+
+Variables de entorno:
+    PORT                  Puerto (5000)
+    WEB_CONCURRENCY       Workers (por defecto, núcleos disponibles)
+    GUNICORN_THREADS      Hilos por worker (8)
+    GUNICORN_TIMEOUT      Segundos antes de reciclar un worker colgado (60)
+    GUNICORN_MAX_REQUESTS Reciclar cada worker tras N requests (0 = nunca)
+"""
+
+import math
+import os
+
+
+def available_cpus() -> int:
+    """Núcleos utilizables: afinidad del proceso limitada por la cuota del cgroup."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS / Windows
+        cpus = os.cpu_count() or 1
+    quota = None
+    try:
+        # cgroup v2: "<cuota> <periodo>" o "max <periodo>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                limit = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+wsgi_app = 'wsgi:app'
+preload_app = True
+
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY') or available_cpus())
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# REQUEST_TIMEOUT de la app es 35 s; el margen evita matar respuestas lentas de OpenAI
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    server.log.info(f"🚀 gunicorn listo: {workers} workers x {threads} hilos "
+                    f"({available_cpus()} núcleos disponibles)")
+
+
+def post_fork(server, worker):
+    import wsgi
+    wsgi.init_worker()
+
+
+def worker_exit(server, worker):
+    import wsgi
+    wsgi.shutdown_worker()
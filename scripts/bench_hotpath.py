@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks de las funciones puras de la ruta caliente del chat.
+
+Mide split_into_blocks, guess_metadata_from_text, fts_search,
+HybridRetriever.hybrid (con embedder determinista en lugar de Azure),
+AnswerEngine.format_context, buscar_y_contar_termino, extraer_termino_busqueda,
+es_saludo, build_clean_response y el escáner PII (detect_pii, sanitize_text)
+sobre el corpus real de data/.
+
+La base FTS se construye en un directorio temporal (igual que build_index.py)
+y app.py se importa desde ese directorio, así que las bases de conocimiento y
+conversaciones del benchmark no se mezclan con las de database/. Los logs
+INFO/WARNING se desactivan para medir solo el trabajo de cada función.
+
+Uso:
+    python scripts/bench_hotpath.py                    # medir y comparar con la línea base
+    python scripts/bench_hotpath.py --save-baseline    # guardar la línea base
+    python scripts/bench_hotpath.py --only fts_search --threshold 0.1
+
+Termina con código 1 si alguna función empeora más que el umbral. Se compara
+el mínimo de las repeticiones (el menos afectado por ruido del sistema).
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import timeit
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = ROOT / 'scripts' / 'bench_baseline.json'
+EMBED_DIM = 64
+
+# Consultas de referencia (estilo de los usuarios de la JP)
+PREGUNTAS = [
+    "¿Qué es un permiso de construcción?",
+    "¿Cuál es la cabida mínima de un solar en distrito R-1?",
+    "¿Cuántas veces aparece 'zonificación' en el reglamento?",
+    "Requisitos para una consulta de ubicación",
+    "¿Qué dice el Tomo 6 sobre distritos de calificación?",
+    "¿Cuántas veces se menciona la palabra variación?",
+    "Procedimiento para segregar un solar en suelo rústico",
+    "hola",
+    "buenos días",
+    "¿Qué es un uso no conforme legal?",
+    "Cuenta las menciones de 'lotificación'",
+    "¿Cuál es el frente mínimo en zona comercial?",
+]
+TERMINOS_FTS = [
+    "permiso construcción", "cabida mínima", "zonificación", "consulta ubicación",
+    "distritos calificación", "variación", "segregación solar", "uso no conforme",
+    "lotificación", "frente mínimo", "suelo rústico", "estacionamiento",
+]
+TERMINOS_CONTEO = ["zonificación", "permiso", "solar", "variación", "lotificación", "estacionamiento"]
+# Mensajes con datos personales para el escáner PII
+MENSAJES_PII = [
+    "Soy Ana, mi correo es ana.rivera@gmail.com y mi teléfono 787-555-1234",
+    "El catastro de mi solar es 123456789, coordenadas 18.4655, -66.1057",
+    "Llámenme al +1 939 555 9876 sobre el permiso de construcción",
+    "Mi caso 2019-2020 en el Tomo 6, Regla 6.1.2, sigue pendiente",
+]
+
+
+def _embed_stub(text: str):
+    """Vector determinista por texto (sustituye la llamada de embeddings a Azure)."""
+    import numpy as np
+    import faiss
+    rng = np.random.default_rng(zlib.crc32(text.encode('utf-8')))
+    v = rng.standard_normal((1, EMBED_DIM)).astype('float32')
+    faiss.normalize_L2(v)
+    return v
+
+
+def preparar_entorno(workdir: str):
+    """Construir la base FTS con el corpus de data/ e importar los módulos a medir."""
+    os.environ['DB_PATH'] = os.path.join(workdir, 'bench_knowledge.db')
+    os.environ['CONVERSACIONES_DB'] = os.path.join(workdir, 'bench_conversaciones.db')
+    os.environ.setdefault('METRICS_ROLLUP_SECONDS', '0')
+    os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+    sys.path.insert(0, str(ROOT))
+    os.chdir(workdir)
+    logging.disable(logging.WARNING)
+
+    from ai_system.chunker import split_into_blocks, guess_metadata_from_text
+    from ai_system.db import get_conn, upsert_chunk
+    from ai_system.schema import migrate_database
+
+    corpus = {}
+    for path in sorted(glob.glob(str(ROOT / 'data' / '*.txt'))):
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            corpus[os.path.basename(path)] = f.read()
+    if not corpus:
+        raise SystemExit(f"No se encontraron .txt en {ROOT / 'data'}")
+
+    db_path = os.environ['DB_PATH']
+    migrate_database(db_path)
+    bloques = []
+    with get_conn(db_path) as con:
+        for doc_id, raw in corpus.items():
+            for i, b in enumerate(split_into_blocks(raw, max_chars=4000, overlap=600)):
+                md = guess_metadata_from_text(b)
+                upsert_chunk(con, f"{doc_id}#{i}", doc_id, None, None, md.get('heading_path', ''), b)
+                bloques.append(b)
+
+    import app as app_module
+    return corpus, bloques, db_path, app_module
+
+
+def construir_retriever(db_path: str):
+    """HybridRetriever sin Azure: índice FAISS sintético sobre los rowids de fts_chunks."""
+    import numpy as np
+    import faiss
+    from ai_system.db import get_conn
+    from ai_system.retrieve import HybridRetriever
+
+    class RetrieverStub(HybridRetriever):
+        def __init__(self, db_path):
+            self.db_path = db_path
+            self.embedding_client = object()
+            self.embedding_model = 'stub'
+            with get_conn(db_path) as con:
+                rows = con.execute("SELECT rowid, chunk_text, doc_id, heading_path FROM fts_chunks").fetchall()
+            self.metas = [{'chunk_id': r[0], 'doc_id': r[2], 'heading_path': r[3],
+                           'page_start': None, 'page_end': None} for r in rows]
+            self.index = faiss.IndexFlatIP(EMBED_DIM)
+            self.index.add(np.vstack([_embed_stub(r[1]) for r in rows]))
+
+        def embed(self, text):
+            return _embed_stub(text)
+
+    return RetrieverStub(db_path)
+
+
+def definir_casos(corpus, bloques, db_path, app_module):
+    from ai_system.chunker import split_into_blocks, guess_metadata_from_text
+    from ai_system.db import fts_search
+    from ai_system.answer import AnswerEngine
+    from ai_system.privacy import detect_pii, sanitize_text
+
+    retriever = construir_retriever(db_path)
+    engine = AnswerEngine.__new__(AnswerEngine)
+    engine.retriever = retriever
+    contextos = [retriever.hybrid(q) for q in TERMINOS_FTS]
+    muestra_bloques = bloques[::max(1, len(bloques) // 200)]
+    textos = list(corpus.values())
+    resultados = [
+        {'respuesta': ("Párrafo inicial de la respuesta.\n\n" + b[:1500]), 'sistema_usado': 'ai_system_reorganizado',
+         'confianza': 0.9, 'citas': ['[Tomo 6 > Cap. 6.1]', '[Tomo 2 > Art. 2.1.9]'], 'contexto_chars': len(b)}
+        for b in muestra_bloques[:20]
+    ]
+    mensajes = PREGUNTAS + MENSAJES_PII
+    respuestas = [r['respuesta'] for r in resultados]
+    con = sqlite3.connect(db_path, check_same_thread=False)
+    con.row_factory = sqlite3.Row
+
+    def fts():
+        for q in TERMINOS_FTS:
+            fts_search(con, q, limit=24)
+
+    # (nombre, función, operaciones por llamada)
+    return [
+        ('split_into_blocks', lambda: [split_into_blocks(t, max_chars=4000, overlap=600) for t in textos], len(textos)),
+        ('guess_metadata_from_text', lambda: [guess_metadata_from_text(b) for b in muestra_bloques], len(muestra_bloques)),
+        ('fts_search', fts, len(TERMINOS_FTS)),
+        ('HybridRetriever.hybrid', lambda: [retriever.hybrid(q) for q in TERMINOS_FTS], len(TERMINOS_FTS)),
+        ('AnswerEngine.format_context', lambda: [engine.format_context(c) for c in contextos], len(contextos)),
+        ('buscar_y_contar_termino', lambda: [app_module.buscar_y_contar_termino(t, corpus) for t in TERMINOS_CONTEO],
+         len(TERMINOS_CONTEO)),
+        ('extraer_termino_busqueda', lambda: [app_module.extraer_termino_busqueda(p) for p in PREGUNTAS], len(PREGUNTAS)),
+        ('es_saludo', lambda: [app_module.es_saludo(p) for p in PREGUNTAS], len(PREGUNTAS)),
+        ('build_clean_response', lambda: [app_module.build_clean_response(r, 1.234) for r in resultados], len(resultados)),
+        ('privacy.detect_pii', lambda: [detect_pii(m) for m in mensajes], len(mensajes)),
+        ('privacy.sanitize_text', lambda: [sanitize_text(r) for r in respuestas], len(respuestas)),
+    ]
+
+
+def medir(fn, ops: int, repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        if timer.timeit(number) >= min_time:
+            break
+        number *= 2
+    tiempos = [t / number / ops * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+    return {'min_us': round(min(tiempos), 3), 'median_us': round(statistics.median(tiempos), 3),
+            'ops': ops, 'loops': number}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Microbenchmarks de la ruta caliente")
+    ap.add_argument('--baseline', default=str(DEFAULT_BASELINE), help="Archivo JSON de línea base")
+    ap.add_argument('--save-baseline', action='store_true', help="Guardar los resultados como línea base")
+    ap.add_argument('--threshold', type=float, default=0.20, help="Regresión tolerada (0.20 = +20%%)")
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--min-time', type=float, default=0.2, help="Segundos mínimos por repetición")
+    ap.add_argument('--only', action='append', help="Medir solo estos casos (repetible)")
+    ap.add_argument('--output', help="Guardar también los resultados en este JSON")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='jp_bench_') as workdir:
+        cwd = os.getcwd()
+        try:
+            corpus, bloques, db_path, app_module = preparar_entorno(workdir)
+            casos = definir_casos(corpus, bloques, db_path, app_module)
+            resultados = {}
+            for nombre, fn, ops in casos:
+                if args.only and nombre not in args.only:
+                    continue
+                resultados[nombre] = medir(fn, ops, args.repeat, args.min_time)
+                print(f"  {nombre:<30} {resultados[nombre]['median_us']:>12.2f} µs/op "
+                      f"(min {resultados[nombre]['min_us']:.2f})", flush=True)
+        finally:
+            os.chdir(cwd)
+
+    informe = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'corpus_docs': len(corpus),
+            'corpus_chars': sum(len(t) for t in corpus.values()),
+            'chunks': len(bloques),
+        },
+        'results': resultados,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(informe, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        previo = {}
+        if baseline_path.exists() and args.only:
+            previo = json.loads(baseline_path.read_text(encoding='utf-8')).get('results', {})
+        informe['results'] = {**previo, **resultados}
+        baseline_path.write_text(json.dumps(informe, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"💾 Línea base guardada en {baseline_path}")
+        return 0
+
+    if not baseline_path.exists():
+        print(f"ℹ️ Sin línea base en {baseline_path}; use --save-baseline para crearla")
+        return 0
+
+    base = json.loads(baseline_path.read_text(encoding='utf-8')).get('results', {})
+    regresiones = []
+    print(f"\n{'caso (mín.)':<30} {'base µs':>12} {'actual µs':>12} {'cambio':>9}")
+    for nombre, r in resultados.items():
+        if nombre not in base:
+            print(f"{nombre:<30} {'-':>12} {r['min_us']:>12.2f} {'nuevo':>9}")
+            continue
+        b = base[nombre]['min_us']
+        cambio = (r['min_us'] - b) / b if b else 0.0
+        marca = ''
+        if cambio > args.threshold:
+            regresiones.append(nombre)
+            marca = '  ❌ REGRESIÓN'
+        elif cambio < -args.threshold:
+            marca = '  ✅ mejora'
+        print(f"{nombre:<30} {b:>12.2f} {r['min_us']:>12.2f} {cambio:>+8.1%}{marca}")
+
+    if regresiones:
+        print(f"\n❌ {len(regresiones)} regresión(es) sobre el umbral de {args.threshold:.0%}: {', '.join(regresiones)}")
+        return 1
+    print(f"\n✅ Sin regresiones sobre el umbral de {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
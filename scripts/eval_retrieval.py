@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Evaluación offline de calidad y latencia de HybridRetriever.
+
+Corre un conjunto de preguntas de referencia (scripts/eval_retrieval_gold.jsonl,
+cada una con su tomo y regla esperados) contra HybridRetriever.hybrid en varias
+configuraciones (pesos de fusión, k_vec, k_lex, final_k y tamaño de chunk) y
+reporta por configuración recall@k, hit@k, MRR, nDCG@k y la latencia por
+consulta (media, p50, p95).
+
+Relevancia por chunk (graduada para nDCG):
+  2 = chunk del tomo esperado que contiene el encabezado de la regla
+      ("REGLA 6.1.2") o alguna de sus secciones ("SECCIÓN 6.1.2.1")
+  1 = chunk del tomo esperado sin la regla
+  0 = otro documento
+recall@k usa como relevantes todos los chunks de nivel 2 del índice.
+
+Para cada tamaño de chunk se construye una base FTS temporal con el corpus de
+data/ (igual que build_index.py). La parte vectorial depende de --embeddings:
+  none   solo búsqueda léxica (no requiere red)
+  azure  embeddings de Azure OpenAI con índice FAISS por tamaño de chunk; los
+         vectores se guardan en --embed-cache para no volver a pagarlos
+Los embeddings de las preguntas también se cachean, así que la latencia
+reportada es la del retriever local (FTS + FAISS + fusión), no la de la API.
+
+Uso:
+    python scripts/eval_retrieval.py --output eval/retrieval_actual.json
+    python scripts/eval_retrieval.py --grid mi_grid.json --compare eval/retrieval_base.json
+    python scripts/eval_retrieval.py --embeddings azure --embed-cache database/eval_embeddings.npz
+
+El grid es una lista JSON de configuraciones; los campos omitidos toman los
+valores por defecto de producción:
+    [{"name": "k8", "k_vec": 8, "k_lex": 8, "final_k": 4},
+     {"name": "rrf", "weights": [1.0, 0.5]},
+     {"name": "chunk2000", "max_chars": 2000, "overlap": 300}]
+"""
+
+import argparse
+import glob
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_GOLD = ROOT / 'scripts' / 'eval_retrieval_gold.jsonl'
+
+# Configuración de producción (HybridRetriever.hybrid y build_index.py)
+DEFAULT_CONFIG = {
+    'name': 'produccion', 'max_chars': 4000, 'overlap': 600,
+    'k_vec': 12, 'k_lex': 12, 'final_k': 6, 'weights': None,
+}
+DEFAULT_GRID = [
+    DEFAULT_CONFIG,
+    {'name': 'k8_final4', 'k_vec': 8, 'k_lex': 8, 'final_k': 4},
+    {'name': 'rrf_1_1', 'weights': [1.0, 1.0]},
+    {'name': 'rrf_vec_0.5', 'weights': [0.5, 1.0]},
+    {'name': 'chunk2000', 'max_chars': 2000, 'overlap': 300},
+    {'name': 'chunk2000_final4', 'max_chars': 2000, 'overlap': 300, 'final_k': 4},
+]
+EMBED_BATCH = 64
+
+_TOMO_RE = re.compile(r"tomo_?(\d+)", re.IGNORECASE)
+
+
+def cargar_gold(path: Path) -> List[Dict]:
+    items = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            for campo in ('id', 'question', 'tomo', 'article'):
+                if campo not in item:
+                    raise SystemExit(f"❌ {path}:{n}: falta el campo '{campo}'")
+            items.append(item)
+    return items
+
+
+def cargar_corpus() -> Dict[str, str]:
+    corpus = {}
+    for path in sorted(glob.glob(str(ROOT / 'data' / '*.txt'))):
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            corpus[os.path.basename(path)] = f.read()
+    if not corpus:
+        raise SystemExit(f"No se encontraron .txt en {ROOT / 'data'}")
+    return corpus
+
+
+def tomo_de_doc(doc_id: str) -> Optional[int]:
+    m = _TOMO_RE.search(doc_id or '')
+    return int(m.group(1)) if m else None
+
+
+def patron_regla(article: str) -> re.Pattern:
+    # "REGLA 6.1.2" o "SECCIÓN 6.1.2.1", sin confundir 6.1.2 con 6.1.20
+    return re.compile(rf"\b(?:REGLA|SECCI[OÓ]N)\s+{re.escape(article)}(?:\.\d+)*(?![\d])")
+
+
+# --------------------------------------------------------------------------- embeddings
+class EmbeddingCache:
+    """Vectores por sha1 del texto; opcionalmente persistidos en un .npz."""
+
+    def __init__(self, path: Optional[str]):
+        import numpy as np
+        self.path = path
+        self.vectors: Dict[str, 'np.ndarray'] = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            with np.load(path) as data:
+                self.vectors = {k: data[k] for k in data.files}
+            print(f"📦 {len(self.vectors)} embeddings cargados de {path}")
+        self._client = None
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _embed_remote(self, texts: List[str]):
+        import numpy as np
+        if self._client is None:
+            from openai import AzureOpenAI
+            from ai_system.config import (AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_KEY, AZURE_OPENAI_API_VERSION,
+                                          AZURE_OPENAI_EMBEDDING_DEPLOYMENT)
+            if not AZURE_OPENAI_ENDPOINT or not AZURE_OPENAI_KEY:
+                raise SystemExit("❌ --embeddings azure requiere AZURE_OPENAI_ENDPOINT y AZURE_OPENAI_KEY")
+            self._client = AzureOpenAI(api_key=AZURE_OPENAI_KEY, api_version=AZURE_OPENAI_API_VERSION,
+                                       azure_endpoint=AZURE_OPENAI_ENDPOINT)
+            self._model = AZURE_OPENAI_EMBEDDING_DEPLOYMENT
+        resp = self._client.embeddings.create(model=self._model, input=texts)
+        return [np.array(d.embedding, dtype='float32') for d in resp.data]
+
+    def embed_many(self, texts: List[str]):
+        import numpy as np
+        import faiss
+        faltan = [t for t in dict.fromkeys(texts) if self.key(t) not in self.vectors]
+        for i in range(0, len(faltan), EMBED_BATCH):
+            batch = faltan[i:i + EMBED_BATCH]
+            for t, v in zip(batch, self._embed_remote(batch)):
+                self.vectors[self.key(t)] = v
+            self.dirty = True
+            print(f"   🔢 Embeddings: {min(i + EMBED_BATCH, len(faltan))}/{len(faltan)}", flush=True)
+        X = np.vstack([self.vectors[self.key(t)] for t in texts]).astype('float32')
+        faiss.normalize_L2(X)
+        return X
+
+    def save(self):
+        import numpy as np
+        if self.path and self.dirty:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            np.savez(self.path, **self.vectors)
+            print(f"💾 {len(self.vectors)} embeddings guardados en {self.path}")
+            self.dirty = False
+
+
+# --------------------------------------------------------------------------- índice por chunking
+def construir_indice(corpus: Dict[str, str], max_chars: int, overlap: int, workdir: str) -> str:
+    """Base FTS temporal con el corpus partido en bloques de `max_chars`."""
+    from ai_system.chunker import split_into_blocks, guess_metadata_from_text
+    from ai_system.db import get_conn, upsert_chunk
+    from ai_system.schema import migrate_database
+
+    db_path = os.path.join(workdir, f"eval_{max_chars}_{overlap}.db")
+    if os.path.exists(db_path):
+        return db_path
+    migrate_database(db_path)
+    with get_conn(db_path) as con:
+        for doc_id, raw in corpus.items():
+            for i, b in enumerate(split_into_blocks(raw, max_chars=max_chars, overlap=overlap)):
+                md = guess_metadata_from_text(b)
+                upsert_chunk(con, f"{doc_id}#{i}", doc_id, None, None, md.get('heading_path', ''), b)
+    return db_path
+
+
+def construir_retriever(db_path: str, embeddings: Optional[EmbeddingCache]):
+    """HybridRetriever sobre `db_path` sin leer el índice FAISS de producción.
+
+    Con embeddings, el índice FAISS usa el rowid de fts_chunks como chunk_id
+    para que la fusión una los mismos chunks de ambas búsquedas.
+    """
+    import faiss
+    from ai_system.db import get_conn
+    from ai_system.retrieve import HybridRetriever
+
+    class EvalRetriever(HybridRetriever):
+        def __init__(self):
+            self.db_path = db_path
+            self.embedding_client = None
+            self.embedding_model = None
+            self.index = None
+            self.metas = []
+            if embeddings is None:
+                return
+            with get_conn(db_path) as con:
+                rows = con.execute("SELECT rowid, chunk_text, doc_id, heading_path FROM fts_chunks").fetchall()
+            X = embeddings.embed_many([r[1] for r in rows])
+            self.index = faiss.IndexFlatIP(X.shape[1])
+            self.index.add(X)
+            self.metas = [{'chunk_id': r[0], 'doc_id': r[2], 'heading_path': r[3],
+                           'page_start': None, 'page_end': None} for r in rows]
+            self.embedding_client = embeddings
+            self.embedding_model = 'eval'
+
+        def embed(self, text):
+            return embeddings.embed_many([text])
+
+        def search_vectors(self, query, k=12):
+            if self.index is None:
+                return []
+            return super().search_vectors(query, k=k)
+
+    return EvalRetriever()
+
+
+# --------------------------------------------------------------------------- métricas
+def juzgar(db_path: str, gold: List[Dict]) -> Dict[str, Dict]:
+    """Por pregunta: {rowid: ganancia} y el número de chunks de nivel 2 del índice."""
+    import sqlite3
+    con = sqlite3.connect(db_path)
+    try:
+        rows = con.execute("SELECT rowid, doc_id, chunk_text FROM fts_chunks").fetchall()
+    finally:
+        con.close()
+    juicios = {}
+    for item in gold:
+        patron = patron_regla(str(item['article']))
+        gains = {}
+        for rowid, doc_id, text in rows:
+            if tomo_de_doc(doc_id) != int(item['tomo']):
+                continue
+            gains[rowid] = 2 if patron.search(text or '') else 1
+        juicios[item['id']] = {'gains': gains, 'relevantes': sum(1 for g in gains.values() if g == 2)}
+    return juicios
+
+
+def metricas_consulta(ranked: List[int], juicio: Dict, ks: List[int]) -> Dict:
+    gains = juicio['gains']
+    relevantes = juicio['relevantes']
+    out = {}
+    rr = 0.0
+    for pos, cid in enumerate(ranked, 1):
+        if gains.get(cid) == 2:
+            rr = 1.0 / pos
+            break
+    out['mrr'] = rr
+    ideal = sorted((g for g in gains.values()), reverse=True)
+    for k in ks:
+        top = ranked[:k]
+        encontrados = sum(1 for cid in top if gains.get(cid) == 2)
+        out[f'recall@{k}'] = encontrados / relevantes if relevantes else 0.0
+        out[f'hit@{k}'] = 1.0 if encontrados else 0.0
+        dcg = sum((2 ** gains.get(cid, 0) - 1) / math.log2(i + 2) for i, cid in enumerate(top))
+        idcg = sum((2 ** g - 1) / math.log2(i + 2) for i, g in enumerate(ideal[:k]))
+        out[f'ndcg@{k}'] = dcg / idcg if idcg else 0.0
+    return out
+
+
+def percentil(valores: List[float], q: float) -> float:
+    if not valores:
+        return 0.0
+    orden = sorted(valores)
+    return orden[min(len(orden) - 1, int(q * len(orden)))]
+
+
+def evaluar_config(cfg: Dict, gold: List[Dict], db_path: str, retriever, juicios: Dict, ks: List[int]) -> Dict:
+    weights = tuple(cfg['weights']) if cfg.get('weights') else None
+    ks = sorted({k for k in ks if k <= cfg['final_k']} | {cfg['final_k']})
+    por_consulta, latencias = [], []
+    errores_fts = 0
+    for item in gold:
+        juicio = juicios[item['id']]
+        if not juicio['relevantes']:
+            continue
+        # fts_search imprime y devuelve [] si la pregunta no es una expresión MATCH válida
+        salida = io.StringIO()
+        with redirect_stdout(salida):
+            t0 = time.perf_counter()
+            resultados = retriever.hybrid(item['question'], k_vec=cfg['k_vec'], k_lex=cfg['k_lex'],
+                                          final_k=cfg['final_k'], weights=weights)
+            ms = (time.perf_counter() - t0) * 1000.0
+        if 'Error en fts_search' in salida.getvalue():
+            errores_fts += 1
+        latencias.append(ms)
+        ranked = [int(r['chunk_id']) for r in resultados]
+        m = metricas_consulta(ranked, juicio, ks)
+        por_consulta.append({'id': item['id'], 'latency_ms': round(ms, 3), 'retrieved': ranked,
+                             'relevantes': juicio['relevantes'],
+                             **{k: round(v, 4) for k, v in m.items()}})
+    claves = [c for c in (por_consulta[0] if por_consulta else {}) if c == 'mrr' or '@' in c]
+    agregados = {c: round(statistics.mean(q[c] for q in por_consulta), 4) for c in claves}
+    return {
+        'config': cfg,
+        'queries': len(por_consulta),
+        'fts_errors': errores_fts,
+        'metrics': agregados,
+        'latency_ms': {
+            'mean': round(statistics.mean(latencias), 3) if latencias else 0.0,
+            'p50': round(percentil(latencias, 0.5), 3),
+            'p95': round(percentil(latencias, 0.95), 3),
+            'max': round(max(latencias), 3) if latencias else 0.0,
+        },
+        'per_query': por_consulta,
+    }
+
+
+# --------------------------------------------------------------------------- reporte
+def imprimir(resultados: List[Dict], previo: Optional[Dict]):
+    base = {r['config']['name']: r for r in (previo or {}).get('results', [])}
+    for r in resultados:
+        cfg = r['config']
+        print(f"\n📊 {cfg['name']}  (chunk {cfg['max_chars']}/{cfg['overlap']}, k_vec={cfg['k_vec']}, "
+              f"k_lex={cfg['k_lex']}, final_k={cfg['final_k']}, pesos={cfg.get('weights')})")
+        anterior = base.get(cfg['name'], {}).get('metrics', {})
+        for clave, valor in r['metrics'].items():
+            delta = ''
+            if clave in anterior:
+                delta = f"  ({valor - anterior[clave]:+.4f})"
+            print(f"   {clave:<12} {valor:.4f}{delta}")
+        if r['fts_errors']:
+            print(f"   ⚠️ {r['fts_errors']}/{r['queries']} preguntas con error de sintaxis FTS (búsqueda léxica vacía)")
+        lat = r['latency_ms']
+        print(f"   latencia     media {lat['mean']:.2f} ms · p50 {lat['p50']:.2f} · p95 {lat['p95']:.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Evaluación de recuperación de HybridRetriever")
+    ap.add_argument('--gold', default=str(DEFAULT_GOLD), help="Preguntas de referencia (JSONL)")
+    ap.add_argument('--grid', help="Lista JSON de configuraciones (por defecto un grid básico)")
+    ap.add_argument('--ks', default='1,3,6', help="Cortes k para recall/hit/nDCG (se limitan a final_k)")
+    ap.add_argument('--embeddings', choices=('none', 'azure'), default='none')
+    ap.add_argument('--embed-cache', help="Archivo .npz para reutilizar embeddings entre corridas")
+    ap.add_argument('--output', help="Guardar los resultados en este JSON")
+    ap.add_argument('--compare', help="JSON de una corrida anterior para mostrar diferencias")
+    args = ap.parse_args()
+
+    sys.path.insert(0, str(ROOT))
+    logging.disable(logging.WARNING)
+
+    gold = cargar_gold(Path(args.gold))
+    grid = json.loads(Path(args.grid).read_text(encoding='utf-8')) if args.grid else DEFAULT_GRID
+    configs = [{**DEFAULT_CONFIG, **c} for c in grid]
+    ks = [int(k) for k in args.ks.split(',') if k.strip()]
+    corpus = cargar_corpus()
+    embeddings = EmbeddingCache(args.embed_cache) if args.embeddings == 'azure' else None
+
+    resultados = []
+    sin_relevantes = {}
+    with tempfile.TemporaryDirectory(prefix='jp_eval_') as workdir:
+        retrievers = {}
+        for cfg in configs:
+            chunking = (cfg['max_chars'], cfg['overlap'])
+            if chunking not in retrievers:
+                print(f"🔧 Indexando corpus con chunks de {chunking[0]} (solape {chunking[1]})...", flush=True)
+                db_path = construir_indice(corpus, chunking[0], chunking[1], workdir)
+                retrievers[chunking] = (db_path, construir_retriever(db_path, embeddings), juzgar(db_path, gold))
+                if embeddings is not None:
+                    embeddings.save()
+            db_path, retriever, juicios = retrievers[chunking]
+            faltantes = [i['id'] for i in gold if not juicios[i['id']]['relevantes']]
+            if faltantes:
+                sin_relevantes[f"{chunking[0]}/{chunking[1]}"] = faltantes
+            resultados.append(evaluar_config(cfg, gold, db_path, retriever, juicios, ks))
+        if embeddings is not None:
+            embeddings.save()
+
+    for chunking, ids in sin_relevantes.items():
+        print(f"⚠️ Chunks {chunking}: {len(ids)} preguntas sin la regla esperada en el índice: {', '.join(ids)}")
+
+    previo = json.loads(Path(args.compare).read_text(encoding='utf-8')) if args.compare else None
+    imprimir(resultados, previo)
+
+    if args.output:
+        informe = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'gold': os.path.relpath(args.gold, ROOT) if os.path.isabs(args.gold) else args.gold,
+                'gold_queries': len(gold),
+                'embeddings': args.embeddings,
+                'corpus_docs': len(corpus),
+                'ks': ks,
+            },
+            'results': resultados,
+        }
+        out = Path(args.output)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(informe, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"\n💾 Resultados guardados en {out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,8 +6,12 @@ Se ejecuta automáticamente en el despliegue para crear las tablas necesarias
 
 import os
 import sqlite3
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ai_system.schema import migrate_database
+
 def init_database():
     """Inicializa la base de datos SQLite con las tablas necesarias"""
     
@@ -21,64 +25,13 @@ def init_database():
     print(f"🔧 Inicializando base de datos en: {db_path}")
     
     try:
-        # Conectar a la base de datos (se crea si no existe)
+        # Crear tablas e índices con el esquema canónico (ai_system/schema.py)
+        migrate_database(str(db_path))
+
+        # Conectar a la base de datos
         conn = sqlite3.connect(str(db_path))
         cursor = conn.cursor()
         
-        # Crear tabla de conversaciones
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversaciones (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                usuario TEXT,
-                consulta TEXT NOT NULL,
-                respuesta TEXT NOT NULL,
-                sistema_usado TEXT,
-                confianza REAL,
-                tiempo_procesamiento REAL,
-                ip_usuario TEXT,
-                user_agent TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Crear tabla de métricas de rendimiento
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS metricas_rendimiento (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                consulta_length INTEGER,
-                respuesta_length INTEGER,
-                sistema_usado TEXT,
-                confianza REAL,
-                tiempo_procesamiento REAL,
-                ip TEXT,
-                user_agent TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Crear tabla de aprendizaje del sistema
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS aprendizaje_sistema (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patron_consulta TEXT,
-                respuesta_generada TEXT,
-                efectividad REAL,
-                feedback_usuario TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Crear índices para mejor rendimiento
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversaciones_timestamp ON conversaciones(timestamp)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversaciones_usuario ON conversaciones(usuario)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_metricas_timestamp ON metricas_rendimiento(timestamp)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_aprendizaje_patron ON aprendizaje_sistema(patron_consulta)")
-        
-        # Confirmar cambios
-        conn.commit()
-        
         # Verificar que las tablas se crearon correctamente
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
         tablas = cursor.fetchall()
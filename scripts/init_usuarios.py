@@ -8,9 +8,10 @@ Crea la tabla usuarios en database/Usuarios.db
 import sqlite3
 import os
 import sys
-import hashlib
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 def init_usuarios_db():
     """Crear la base de datos de usuarios con tabla segura"""
     
@@ -74,9 +75,9 @@ def init_usuarios_db():
         return False
 
 def hash_password(password):
-    """Crear hash seguro de password"""
-    # Usar SHA-256 por simplicidad (en producción usar bcrypt)
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    """Crear hash scrypt con sal (mismo formato que core.auth)"""
+    from core.passwords import hash_password as scrypt_hash
+    return scrypt_hash(password)
 
 def add_test_user():
     """Agregar usuario de prueba"""
@@ -7,17 +7,20 @@ Script para agregar, listar y gestionar usuarios
 
 import sqlite3
 import os
-import hashlib
+import sys
 import getpass
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core import passwords
+
 def hash_password(password):
-    """Crear hash seguro de password"""
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    """Crear hash scrypt con sal (mismo formato que core.auth)"""
+    return passwords.hash_password(password)
 
 def verify_password(password, hash_stored):
-    """Verificar password"""
-    return hash_password(password) == hash_stored
+    """Verificar password (acepta también hashes SHA-256 antiguos)"""
+    return passwords.verify_password(password, hash_stored)[0]
 
 def add_user():
     """Agregar nuevo usuario interactivamente"""
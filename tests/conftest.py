@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Bases de prueba fuera de database/: se fijan antes de importar ai_system.config
+_tmp = tempfile.mkdtemp(prefix='jp_tests_')
+os.environ.setdefault('DB_PATH', os.path.join(_tmp, 'hybrid_knowledge.db'))
+os.environ.setdefault('CONVERSACIONES_DB', os.path.join(_tmp, 'conversaciones.db'))
+os.environ.setdefault('USUARIOS_DB', os.path.join(_tmp, 'usuarios.db'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
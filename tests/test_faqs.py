@@ -0,0 +1,16 @@
+from ai_system.faqs import cluster_near_duplicates
+
+
+def test_negacion_no_se_fusiona():
+    textos = [
+        "¿Se requiere permiso para demoler una casa?",
+        "¿No se requiere permiso para demoler una casa?",
+        "¿Puedo construir una marquesina en el retiro lateral?",
+        "¿No puedo construir una marquesina en el retiro lateral?",
+    ]
+    assert cluster_near_duplicates(textos) == []
+
+
+def test_variantes_de_la_misma_pregunta_se_fusionan():
+    textos = ["¿Qué es un permiso verde?", "que es el permiso verde", "¿Qué es un permiso de uso?"]
+    assert cluster_near_duplicates(textos) == [[0, 1]]
@@ -0,0 +1,28 @@
+from ai_system.flujogramas import _detect_actor, es_consulta_procedimiento
+
+
+def test_distrito_de_calificacion_no_es_cambio_de_calificacion():
+    # "distrito de calificación" aparece en todo el corpus: no debe activar el flujograma
+    assert not es_consulta_procedimiento(
+        "¿Qué requisitos para construir en un distrito de calificación residencial?")
+    assert not es_consulta_procedimiento(
+        "¿Cuál es el procedimiento para una variación en un distrito de calificación R-1?")
+
+
+def test_cambio_de_calificacion_usa_el_flujograma():
+    assert es_consulta_procedimiento("¿Cuáles son los pasos para un cambio de calificación?")
+    assert es_consulta_procedimiento("¿Cuál es el proceso de recalificación en el Tomo 8?")
+    assert es_consulta_procedimiento("Procedimiento para sitios históricos")
+
+
+def test_zona_historica_no_es_sitio_historico():
+    assert not es_consulta_procedimiento("¿Cuál es el procedimiento para construir en una zona histórica?")
+    assert es_consulta_procedimiento("¿Cuáles son los pasos para evaluar un sitio histórico?")
+
+
+def test_reglamento_jp_no_es_la_junta():
+    paso = ("Iniciar solicitud de cambio de calificación directo por parte del promotor o propietario. "
+            "¿La solicitud cumple con los requisitos básicos del Reglamento de Emergencia JP-RP-41?")
+    assert _detect_actor(paso) == 'Solicitante'
+    assert _detect_actor("Reglamento de Emergencia JP-RP-41") is None
+    assert _detect_actor("La JP emite la resolución") == 'Junta de Planificación'
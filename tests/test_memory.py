@@ -0,0 +1,47 @@
+import sqlite3
+
+import pytest
+
+from ai_system import memory
+from ai_system.schema import migrate_database
+
+
+def test_pesos_de_terminos_no_desbordan(tmp_path, monkeypatch):
+    # Vida media de un día: 2 ** ((t - época) / vida media) pasa de 1e308 hacia fines de 2027
+    monkeypatch.setattr(memory, 'TERM_HALF_LIFE_DAYS', 1.0)
+    db = str(tmp_path / 'conversaciones.db')
+    migrate_database(db)
+    con = sqlite3.connect(db)
+    memory.record_user_terms(con, 'ana', 'zonificación del solar', '', '2030-01-01 00:00:00')
+    memory.record_user_terms(con, 'ana', 'zonificación', '', '2030-01-01 00:00:00')
+    memory.record_user_terms(con, 'ana', 'permiso', '', '2029-12-31 00:00:00')
+    con.commit()
+    weights = dict(con.execute("SELECT term, weight FROM user_term_stats WHERE usuario = 'ana'").fetchall())
+    con.close()
+    assert weights['zonificación'] - weights['solar'] == pytest.approx(1.0)
+    assert weights['solar'] - weights['permiso'] == pytest.approx(1.0)
+
+
+def test_rehidratacion_no_reordena_turnos_viejos():
+    migrate_database(memory.DB_PATH)
+    cache = memory.MemoryCache(capacity=5, ttl_seconds=0)
+    user = 'mem-rehidratacion'
+
+    def guardar(i):
+        con = sqlite3.connect(memory.DB_PATH)
+        con.execute("INSERT INTO conversaciones (usuario, consulta, respuesta, timestamp) VALUES (?, ?, 'r', ?)",
+                    (user, f'q{i}', f'2030-01-01 00:00:0{i}'))
+        con.commit()
+        con.close()
+
+    for i in range(5):
+        cache.append(user, f'q{i}', 'r', f'2030-01-01 00:00:0{i}')
+        guardar(i)
+    assert [t['pregunta'] for t in cache.turns(user)] == ['q0', 'q1', 'q2', 'q3', 'q4']
+
+    # Otro worker guarda q5 y q6; q7 de este proceso sigue en la cola write-behind
+    guardar(5)
+    guardar(6)
+    cache.append(user, 'q7', 'r', '2030-01-01 00:00:07')
+
+    assert [t['pregunta'] for t in cache.turns(user)] == ['q3', 'q4', 'q5', 'q6', 'q7']
@@ -0,0 +1,11 @@
+from core.metrics import Histogram
+
+
+def test_maximo_del_rollup_es_del_intervalo():
+    h = Histogram()
+    h.observe(5.0)
+    assert h.rollup_snapshot()[3] == 5.0
+    h.observe(1.0)
+    assert h.rollup_snapshot()[3] == 1.0
+    assert h.rollup_snapshot()[3] == 0.0
+    assert h.snapshot()[3] == 5.0
@@ -0,0 +1,20 @@
+from core import passwords
+from core.passwords import KDFParams, calibrate, hash_password, verify_password
+
+BAJO = KDFParams(2 ** 14, 8, 1)
+ALTO = KDFParams(2 ** 15, 8, 1)
+
+
+def test_solo_se_rehace_un_hash_de_n_menor():
+    assert verify_password('clave', hash_password('clave', BAJO), ALTO) == (True, True)
+    assert verify_password('clave', hash_password('clave', ALTO), BAJO) == (True, False)
+    assert verify_password('otra', hash_password('clave', BAJO), ALTO) == (False, False)
+
+
+def test_calibracion_respeta_el_tope_de_memoria(monkeypatch):
+    # scrypt usa 128 * r * N bytes: 16 MB por hash con N=2^14 y 32 MB con 2^15
+    monkeypatch.setattr(passwords, 'SCRYPT_MAX_MEM_MB', 40.0)
+    assert passwords.max_n_for_memory(8, 2) == 2 ** 14
+    monkeypatch.setattr(passwords, 'SCRYPT_MAX_MEM_MB', 64.0)
+    assert passwords.max_n_for_memory(8, 2) == 2 ** 15
+    assert calibrate(10_000, max_n=2 ** 14).n == 2 ** 14
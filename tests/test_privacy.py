@@ -0,0 +1,104 @@
+import io
+import json
+import os
+import sqlite3
+import zipfile
+
+from ai_system.privacy import (ANON_USER, LEARNING_DB_PATH, apply_retention_policy, detect_pii, safe_to_send,
+                               sanitize_text, stream_user_export_zip)
+from ai_system.schema import migrate_database
+
+# Oraciones de los tomos (y citas con la misma forma) que no contienen datos personales
+ORACIONES_CORPUS = [
+    "Este Capítulo se promulga conforme a la Ley 161-2009, la Ley 75-1975, la Ley 107-2020 y la",
+    "de la Ley 161-2009, y Ley 416-2004, para establecer los procesos a seguir",
+    "2. JPI-31-01-2011 — Para I",
+    "1 4 10 30 100 500 1000",
+    "La resolución se notificó el 01-02-2023 en el Expediente 2021-123456.",
+    "Retiros de 10 15 20 25 30 metros según el distrito.",
+]
+
+
+def test_citas_del_corpus_no_son_pii():
+    for oracion in ORACIONES_CORPUS:
+        ok, hits = safe_to_send(oracion)
+        assert ok, (oracion, hits)
+        assert sanitize_text(oracion) == oracion
+
+
+def test_telefonos_emails_e_ids():
+    hits = detect_pii("Soy Ana, ana.rivera@gmail.com, tel. 787-555-1234 o +1 939 555 9876; catastro 123456789")
+    assert hits['phones'] == ['787-555-1234', '+1 939 555 9876']
+    assert hits['emails'] == ['ana.rivera@gmail.com']
+    assert hits['ids'] == ['123456789']
+    assert detect_pii("Llámenme al 555-1234 2 veces")['phones'] == ['555-1234']
+    assert sanitize_text("tel. 787-555-1234") == "tel. [REDACTED]"
+
+
+def test_seguro_social_area_entre_parentesis_y_diez_digitos():
+    hits = detect_pii("SS 123-45-6789, tel. (787) 555-1234 o 7875551234")
+    assert hits['ssns'] == ['123-45-6789']
+    assert hits['phones'] == ['(787) 555-1234', '7875551234']
+    assert hits['ids'] == []
+    assert sanitize_text("Llame al (787) 555-1234") == "Llame al [REDACTED]"
+
+
+def test_retencion_anonimiza_solo_datos_del_usuario(tmp_path):
+    db = str(tmp_path / 'conversaciones.db')
+    migrate_database(db)
+    con = sqlite3.connect(db)
+    respuesta = "Según la Ley 161-2009, llame a la oficina regional al 787-555-0000."
+    con.execute("""INSERT INTO conversaciones (timestamp, usuario, consulta, respuesta, ip_usuario)
+                   VALUES ('2000-01-01 00:00:00', 'ana', 'mi teléfono es 787-555-1234', ?, '10.0.0.1')""",
+                (respuesta,))
+    con.execute("INSERT INTO user_term_stats (usuario, term, weight) VALUES ('ana', 'solar', 1.0)")
+    con.commit()
+    # conversations y conversation_messages van a la base de aprendizaje, como en la app
+    migrate_database(LEARNING_DB_PATH)
+    lcon = sqlite3.connect(LEARNING_DB_PATH)
+    lcon.execute("INSERT INTO conversations (id, user_id, started_at) VALUES ('ret-c1', 'ana', '2000-01-01 00:00:00')")
+    lcon.executemany("""INSERT INTO conversation_messages (id, conversation_id, role, content, created_at)
+                        VALUES (?, 'ret-c1', ?, ?, '2000-01-01 00:00:00')""",
+                     [('ret-m1', 'user', 'Soy Ana, tel 787-555-1234'), ('ret-m2', 'assistant', respuesta)])
+    lcon.commit()
+
+    summary = apply_retention_policy(30, db_path=db, pause=0)
+
+    assert summary['anonymized'] == 3
+    row = con.execute("SELECT usuario, consulta, respuesta, ip_usuario FROM conversaciones").fetchone()
+    assert row == (ANON_USER, 'mi teléfono es [REDACTED]', respuesta, None)
+    assert con.execute("SELECT COUNT(*) FROM user_term_stats WHERE usuario = 'ana'").fetchone()[0] == 0
+    con.close()
+    messages = dict(lcon.execute("SELECT id, content FROM conversation_messages WHERE conversation_id = 'ret-c1'"))
+    assert messages == {'ret-m1': 'Soy Ana, tel [REDACTED]', 'ret-m2': respuesta}
+    assert lcon.execute("SELECT user_id FROM conversations WHERE id = 'ret-c1'").fetchone()[0] == ANON_USER
+    lcon.close()
+
+
+def test_export_zip_con_varias_conversaciones(tmp_path):
+    db = str(tmp_path / 'conversaciones.db')
+    migrate_database(db)
+    # Donde los escribe la app (resolve_learning_db_path: DB_PATH, fijado en conftest)
+    learning_db = os.environ['DB_PATH']
+    assert LEARNING_DB_PATH == learning_db
+    migrate_database(learning_db)
+    con = sqlite3.connect(learning_db)
+    for conv in ('exp-c1', 'exp-c2', 'exp-c3'):
+        con.execute("INSERT INTO conversations (id, user_id) VALUES (?, 'ana-export')", (conv,))
+        for i in range(2):
+            con.execute("INSERT INTO conversation_messages (id, conversation_id, role, content) VALUES (?, ?, 'user', ?)",
+                        (f'{conv}-{i}', conv, f'pregunta {i}'))
+    con.commit()
+    con.close()
+
+    data = b''.join(stream_user_export_zip('ana-export', db_path=db, batch_size=2))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        names = zf.namelist()
+        assert len(names) == len(set(names))
+        conversations = zf.read('conversations.ndjson').decode('utf-8').splitlines()
+        messages = [json.loads(l) for l in zf.read('conversation_messages.ndjson').decode('utf-8').splitlines()]
+        resumen = json.loads(zf.read('resumen.json'))
+    assert len(conversations) == 3
+    assert [m['id'] for m in messages] == ['exp-c1-0', 'exp-c1-1', 'exp-c2-0', 'exp-c2-1', 'exp-c3-0', 'exp-c3-1']
+    assert resumen['conteo'] == {'conversations': 3, 'conversation_messages': 6}
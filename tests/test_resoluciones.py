@@ -0,0 +1,29 @@
+from ai_system.db import get_conn
+from ai_system.resoluciones import (_query_filters, ensure_resoluciones_tables, es_consulta_resoluciones,
+                                    lookup_resoluciones)
+
+
+def test_mencionar_resolucion_no_basta():
+    assert not es_consulta_resoluciones("¿Qué plazo hay para pedir reconsideración de una resolución?")
+
+
+def test_numero_o_anio_activan_la_consulta():
+    assert es_consulta_resoluciones("¿Qué dice la Resolución JP-2019-001?")
+    assert es_consulta_resoluciones("Resoluciones de 2009")
+    assert es_consulta_resoluciones("resoluciones entre 2010 y 2012")
+
+
+def test_anio_suelto_no_es_numero():
+    assert _query_filters("resoluciones 2020") == (None, (2020, 2020))
+    assert _query_filters("Resolución 8.1") == ('8.1', None)
+
+
+def test_listado_por_anio_avisa_truncado(tmp_path):
+    db = str(tmp_path / 'res.db')
+    with get_conn(db) as con:
+        ensure_resoluciones_tables(con)
+        con.executemany("INSERT INTO resoluciones(tomo, numero, anio, tema, asunto, fuente) VALUES (?,?,?,?,?,?)",
+                        [(1, None, 2020, None, f"Asunto {i}", 't1.txt') for i in range(30)])
+        con.execute("INSERT INTO resoluciones_fts(resoluciones_fts) VALUES('rebuild')")
+    rows, total = lookup_resoluciones("resoluciones 2020", db_path=db)
+    assert (len(rows), total) == (20, 30)
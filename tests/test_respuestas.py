@@ -0,0 +1,16 @@
+from ai_system import respuestas
+
+
+def test_consulta_de_un_termino_no_responde_desde_el_nivel_curado(tmp_path, monkeypatch):
+    monkeypatch.setattr(respuestas, '_cache', None)
+    db = str(tmp_path / 'kb.db')
+    assert respuestas.search_respuestas("¿Qué es un distrito?", db_path=db) == []
+
+
+def test_pregunta_curada_se_reconoce(tmp_path, monkeypatch):
+    monkeypatch.setattr(respuestas, '_cache', None)
+    db = str(tmp_path / 'kb.db')
+    hits = respuestas.search_respuestas("¿Cómo aplican estos parámetros en los distritos de calificación?",
+                                        k=1, db_path=db)
+    assert hits and hits[0]['score'] >= 0.75
+    assert hits[0]['pregunta'].startswith('¿Como aplican estos parámetros')
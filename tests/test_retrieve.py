@@ -0,0 +1,42 @@
+from ai_system.db import get_conn, insert_knowledge_fact
+from ai_system.retrieve import HybridRetriever
+from ai_system.schema import migrate_database
+
+
+def _retriever(db_path):
+    # Sin cliente Azure: search_facts solo usa la base
+    retriever = HybridRetriever.__new__(HybridRetriever)
+    retriever.db_path = db_path
+    return retriever
+
+
+def test_facts_requieren_tipo_aprendido_y_varios_terminos(tmp_path):
+    db = str(tmp_path / 'hybrid_knowledge.db')
+    migrate_database(db)
+    with get_conn(db) as con:
+        insert_knowledge_fact(con, 'f1', 'El permiso de demolición paga derechos de $50.', '', 'correction')
+        insert_knowledge_fact(con, 'f2', 'Los retiros laterales en R-1 son de 3 metros (respuesta anterior).',
+                              'conversation:c1', 'conversation')
+        insert_knowledge_fact(con, 'f3', 'En el distrito R-1 los retiros laterales mínimos son de 1.50 metros.',
+                              '', 'correction')
+        con.commit()
+
+    facts = _retriever(db).search_facts('¿Cuáles son los retiros laterales para un permiso en R-1?')
+
+    assert [f['chunk_id'] for f in facts] == ['fact:f3']
+
+
+def test_busqueda_lexica_acepta_preguntas_con_signos(tmp_path, capsys):
+    db = str(tmp_path / 'hybrid_knowledge.db')
+    migrate_database(db)
+    with get_conn(db) as con:
+        con.executemany("""INSERT INTO fts_chunks(chunk_text, chunk_id, doc_id, heading_path, page_start, page_end)
+                           VALUES (?,?,?,?,?,?)""",
+                        [('El permiso de construcción se solicita ante la OGPe.', 1, 'tomo2', 'Cap. 2', 1, 1),
+                         ('Los retiros laterales dependen del distrito.', 2, 'tomo6', 'Cap. 6', 3, 3)])
+        con.commit()
+
+    hits = _retriever(db).search_lexical('¿Qué es un "permiso de construcción"?')
+
+    assert 'Error en fts_search' not in capsys.readouterr().out
+    assert [h['doc_id'] for h in hits] == ['tomo2']
@@ -0,0 +1,98 @@
+"""
+Punto de entrada WSGI de producción (gunicorn pre-fork, ver gunicorn_config.py).
+
+Con `preload_app` gunicorn importa este módulo una sola vez en el proceso
+maestro y después crea los workers con fork(). `create_app()` aprovecha ese
+momento para:
+
+- migrar las bases SQLite una sola vez (no una por worker);
+- cargar los recursos de solo lectura (índice FAISS y metadatos, respuestas
+  curadas con sus términos y embeddings, flujogramas, tablas de cabida), que
+  los workers comparten copy-on-write;
+- calibrar scrypt (AUTH_SCRYPT_TARGET_MS) para que todos los workers usen el
+  mismo N;
+- congelar el heap (`gc.freeze`) para que el recolector de los workers no
+  toque esos objetos y no copie sus páginas.
+
+El maestro no abre clientes ni hilos: los clientes Azure OpenAI, el
+retriever, el hilo de rollup de métricas y el write-behind se crean en cada
+worker después del fork (`init_worker`, llamado desde `post_fork`).
+
+Uso:
+    gunicorn -c gunicorn_config.py
+"""
+
+import gc
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# El maestro no debe arrancar hilos antes del fork (ver app.iniciar_servicios_de_fondo)
+os.environ['APP_PREFORK'] = 'true'
+# Varios workers: el límite por IP debe sumar los requests de todos (core/rate_limit.py)
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'sqlite')
+
+import app as aplicacion  # noqa: E402
+
+
+def preload_shared_assets() -> dict:
+    """Cargar en este proceso los recursos de solo lectura que comparten los workers."""
+    from ai_system.config import DB_PATH, FAISS_PATH
+
+    from core.passwords import calibrated_params
+
+    services = aplicacion.services
+    # Calibración de scrypt una sola vez, no por worker ni en un login
+    cargas = [('scrypt', lambda: calibrated_params().n)]
+    if aplicacion.SISTEMA_AI_DISPONIBLE and os.path.exists(FAISS_PATH):
+        from ai_system.retrieve import load_shared_index
+        cargas.append(('faiss', lambda: load_shared_index(FAISS_PATH)[0].ntotal))
+    if aplicacion.RESPUESTAS_CURADAS_AVAILABLE:
+        from ai_system import respuestas
+        cargas.append(('respuestas', lambda: respuestas.preload(DB_PATH)))
+    if aplicacion.FLUJOGRAMAS_AVAILABLE:
+        from ai_system import flujogramas
+        cargas.append(('flujogramas', lambda: flujogramas.preload(DB_PATH)))
+    if aplicacion.CABIDA_AVAILABLE:
+        from ai_system import cabida
+        cargas.append(('cabida', lambda: cabida.preload(DB_PATH)))
+
+    resumen = {}
+    for nombre, cargar in cargas:
+        try:
+            with services.phase(f'prefork:{nombre}'):
+                resumen[nombre] = cargar()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo precargar {nombre}: {e}")
+    return resumen
+
+
+def create_app():
+    """App Flask lista para servir desde workers creados con fork()."""
+    started = time.perf_counter()
+    try:
+        # Migraciones una sola vez, antes de que los workers abran conexiones
+        with aplicacion.services.phase('prefork:bases_datos'):
+            aplicacion.services.get('bases_datos')
+    except aplicacion.ServiceUnavailable as e:
+        logger.error(f"❌ {e}")
+    resumen = preload_shared_assets()
+    gc.collect()
+    gc.freeze()
+    logger.info(f"📦 Recursos compartidos cargados en {time.perf_counter() - started:.2f} s: {resumen}")
+    return aplicacion.app
+
+
+def init_worker():
+    """Tras el fork: hilos y clientes propios del worker (rollup, precalentamiento)."""
+    aplicacion.iniciar_servicios_de_fondo()
+
+
+def shutdown_worker():
+    """Vaciar las escrituras diferidas del worker antes de salir."""
+    aplicacion.get_writer().stop()
+
+
+app = create_app()